@@ -234,7 +234,8 @@ sudo mkdir -p \
   "$IOTLAB_DATA_ROOT/mosquitto/data" \
   "$IOTLAB_DATA_ROOT/mosquitto/log" \
   "$IOTLAB_DATA_ROOT/suricata/logs" \
-  "$IOTLAB_DATA_ROOT/evebox/data"
+  "$IOTLAB_DATA_ROOT/evebox/data" \
+  "$IOTLAB_DATA_ROOT/spool"
 
 sudo mkdir -p \
   "$IOTLAB_ETC_ROOT/suricata" \
@@ -0,0 +1,414 @@
+"""
+End-to-end bridge benchmarks against local stand-ins (no Docker, no network).
+
+  python bench/bench.py core   --devices 2000 --rate 20000 --duration 30
+  python bench/bench.py modbus --devices 500 --servers 3 --interval 1
+  python bench/bench.py bacnet --devices 20 --points 70 --interval 1
+  python bench/bench.py all --out results.json
+
+Mosquitto and ThingsBoard are replaced by in-process MQTT stand-ins
+(mqtt_stub.py); the windmill and BACnet simulators and the bridges run as
+real subprocesses. Readings are only counted after --warmup seconds.
+
+Latency is measured at the ThingsBoard stand-in:
+  core    arrival - "bench_ts" embedded in each injected reading
+  modbus  arrival - gateway "ts" (taken just before the Modbus poll)
+  bacnet  arrival - gateway "ts" (taken when the read cycle starts)
+CPU and RSS cover the bridge process and its children only.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import subprocess
+from typing import Dict, List, Optional
+
+from mqtt_stub import StubBroker
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+STACKS = os.path.dirname(BENCH_DIR)
+COMMON = os.path.join(STACKS, "common")
+
+CORE_BRIDGE = os.path.join(STACKS, "iot-lab-core", "tb-bridge", "bridge.py")
+WINDMILL_SERVER = os.path.join(STACKS, "iot-lab-modbus", "windmill_modbus", "server.py")
+WINDMILL_POLLER = os.path.join(STACKS, "iot-lab-modbus", "windmill_poller", "poller_multi.py")
+BACNET_SIM = os.path.join(STACKS, "iot-lab-bacnet", "bacnet_sim", "sim.py")
+BACNET_BRIDGE = os.path.join(STACKS, "iot-lab-bacnet", "tb_bridge", "bridge.py")
+BACNET_POINTS = os.path.join(STACKS, "iot-lab-bacnet", "tb_bridge", "points.json")
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+def percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    if not samples:
+        return {"count": 0, "p50": None, "p99": None, "max": None}
+    s = sorted(samples)
+
+    def rank(q: float) -> float:
+        return round(s[min(len(s) - 1, int(q * len(s)))], 2)
+    return {"count": len(s), "p50": rank(0.50), "p99": rank(0.99), "max": round(s[-1], 2)}
+
+def free_port(kind: int = socket.SOCK_STREAM) -> int:
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+class ProcSampler:
+    """CPU seconds and RSS for a process and its children, from /proc."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.cpu0 = 0.0
+        self.t0 = 0.0
+        self.rss_peak = 0
+
+    def _tree(self) -> List[int]:
+        pids = [self.pid]
+        try:
+            entries = os.listdir("/proc")
+        except OSError:
+            return pids
+        parents: Dict[int, int] = {}
+        for e in entries:
+            if e.isdigit():
+                try:
+                    with open(f"/proc/{e}/stat") as f:
+                        parents[int(e)] = int(f.read().rsplit(")", 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    pass
+        i = 0
+        while i < len(pids):
+            pids.extend(p for p, pp in parents.items() if pp == pids[i])
+            i += 1
+        return pids
+
+    def cpu_seconds(self) -> float:
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(")", 1)[1].split()
+                total += int(fields[11]) + int(fields[12])  # utime + stime
+            except (OSError, IndexError, ValueError):
+                pass
+        return total / CLK_TCK
+
+    def rss_bytes(self) -> int:
+        total = 0
+        for pid in self._tree():
+            try:
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith("VmRSS:"):
+                            total += int(line.split()[1]) * 1024
+                            break
+            except OSError:
+                pass
+        self.rss_peak = max(self.rss_peak, total)
+        return total
+
+    def start(self):
+        self.cpu0 = self.cpu_seconds()
+        self.t0 = time.monotonic()
+        self.rss_bytes()
+
+    def result(self) -> Dict[str, float]:
+        wall = time.monotonic() - self.t0
+        rss = self.rss_bytes()
+        return {
+            "cpu_pct": round(100.0 * (self.cpu_seconds() - self.cpu0) / wall, 1) if wall > 0 else 0.0,
+            "rss_mb": round(rss / 1e6, 1),
+            "rss_peak_mb": round(self.rss_peak / 1e6, 1),
+        }
+
+class TbStandIn:
+    """Counts what reaches ThingsBoard and records latency samples."""
+
+    def __init__(self):
+        self.broker = StubBroker(self.on_message)
+        self.measuring = False
+        self.messages = 0
+        self.payload_bytes = 0
+        self.values = 0
+        self.latency_ms: List[float] = []
+
+    def reset(self):
+        self.measuring = True
+        self.messages = self.payload_bytes = self.values = 0
+        self.latency_ms = []
+
+    def on_message(self, topic: str, payload: bytes):
+        if not self.measuring:
+            return
+        now_ms = time.time() * 1000
+        self.messages += 1
+        self.payload_bytes += len(payload)
+        msg = json.loads(payload)
+        if topic == "v1/gateway/telemetry":
+            for entries in msg.values():
+                for e in entries:
+                    values = e.get("values", {})
+                    self.values += len(values)
+                    src = values.get("bench_ts", values.get("bench_ts_last", e.get("ts")))
+                    if src is not None:
+                        self.latency_ms.append(now_ms - src)
+        else:
+            self.values += len(msg)
+
+async def spawn(script: str, env: Dict[str, str], log_dir: str, name: str) -> subprocess.Popen:
+    full_env = dict(os.environ)
+    full_env.update(env)
+    full_env["PYTHONPATH"] = os.pathsep.join([COMMON, os.path.dirname(script)] +
+                                             ([full_env["PYTHONPATH"]] if full_env.get("PYTHONPATH") else []))
+    full_env["PYTHONUNBUFFERED"] = "1"
+    log = open(os.path.join(log_dir, f"{name}.log"), "wb")
+    return subprocess.Popen([sys.executable, "-u", script], env=full_env, cwd=os.path.dirname(script),
+                            stdout=log, stderr=subprocess.STDOUT)
+
+def stop(procs: List[subprocess.Popen]):
+    for p in procs:
+        if p.poll() is None:
+            p.terminate()
+    for p in procs:
+        try:
+            p.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+def check_alive(procs: List[subprocess.Popen], log_dir: str):
+    for p in procs:
+        if p.poll() is not None:
+            raise SystemExit(f"{' '.join(p.args)} exited with {p.returncode}; logs in {log_dir}")
+
+async def wait_until(cond, timeout: float, what: str):
+    deadline = time.monotonic() + timeout
+    while not cond():
+        if time.monotonic() > deadline:
+            raise SystemExit(f"timed out waiting for {what}")
+        await asyncio.sleep(0.05)
+
+def tcp_open(port: int) -> bool:
+    try:
+        with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+async def measure(tb: TbStandIn, sampler: ProcSampler, procs: List[subprocess.Popen],
+                  log_dir: str, warmup: float, duration: float) -> Dict:
+    await asyncio.sleep(warmup)
+    check_alive(procs, log_dir)
+    tb.reset()
+    sampler.start()
+    t0 = time.monotonic()
+    while time.monotonic() - t0 < duration:
+        await asyncio.sleep(min(1.0, duration))
+        sampler.rss_bytes()
+    elapsed = time.monotonic() - t0
+    tb.measuring = False
+    check_alive(procs, log_dir)
+    out = {
+        "tb_msgs_per_sec": round(tb.messages / elapsed, 1),
+        "tb_values_per_sec": round(tb.values / elapsed, 1),
+        "tb_bytes_per_sec": round(tb.payload_bytes / elapsed, 1),
+        "latency_ms": percentiles(tb.latency_ms),
+        "elapsed_sec": round(elapsed, 2),
+    }
+    out.update(sampler.result())
+    return out
+
+async def bench_core(args, log_dir: str) -> Dict:
+    tb = TbStandIn()
+    mosq = StubBroker()
+    tb_port = await tb.broker.start()
+    mosq_port = await mosq.start()
+
+    bridge = await spawn(CORE_BRIDGE, {
+        "MOSQUITTO_HOST": "127.0.0.1", "MOSQUITTO_PORT": str(mosq_port),
+        "TB_HOST": "127.0.0.1", "TB_PORT": str(tb_port), "TB_GATEWAY_TOKEN": "bench",
+        "BATCH_MODE": args.batch_mode, "WORKERS": str(args.workers), "SCALE_MODE": "hash",
+        "INTERVAL_FLUSH_SEC": str(args.flush_sec),
+        "ROUTES_FILE": "", "SPOOL_DIR": "", "DEADBAND_FILE": "",
+    }, log_dir, "core-bridge")
+    procs = [bridge]
+    try:
+        await wait_until(lambda: any(s.subs for s in mosq.sessions), 30, "core bridge to subscribe")
+        devices = args.devices or 1000
+        topics = [f"sensors/temperature/room{i:05d}/temp".encode() for i in range(devices)]
+        injected = 0
+        stalled = 0
+        counting = {"from": None}
+
+        async def generate():
+            nonlocal injected, stalled
+            start = time.monotonic()
+            sent = 0
+            i = 0
+            while True:
+                await asyncio.sleep(0.005)
+                due = int((time.monotonic() - start) * args.rate) - sent
+                if mosq.write_buffer_size() > 16 << 20:
+                    # bridge isn't reading; don't let the stand-in buffer grow without bound
+                    stalled += due
+                    sent += due
+                    continue
+                ts = time.time() * 1000
+                for _ in range(due):
+                    payload = b'{"bench_ts":%.3f,"value":%.2f}' % (ts, 20.0 + (i % 500) / 100)
+                    mosq.inject(topics[i % len(topics)], payload)
+                    i += 1
+                sent += due
+                if counting["from"] is not None:
+                    injected += due
+
+        gen = asyncio.ensure_future(generate())
+        await asyncio.sleep(args.warmup)
+        counting["from"] = time.monotonic()
+        sampler = ProcSampler(bridge.pid)
+        result = await measure(tb, sampler, procs, log_dir, 0, args.duration)
+        gen.cancel()
+        result["readings_in_per_sec"] = round(injected / result["elapsed_sec"], 1)
+        result["generator_dropped"] = stalled
+        result["params"] = {"devices": devices, "rate": args.rate, "batch_mode": args.batch_mode,
+                            "workers": args.workers, "flush_sec": args.flush_sec}
+        return result
+    finally:
+        stop(procs)
+        await mosq.close()
+        await tb.broker.close()
+
+async def bench_modbus(args, log_dir: str) -> Dict:
+    tb = TbStandIn()
+    tb_port = await tb.broker.start()
+
+    # each simulator process hosts up to 247 turbines as unit IDs on one port
+    devices = args.devices or 50
+    n_servers = max(1, args.servers, -(-devices // 247))
+    per_server = -(-devices // n_servers)
+    ports = [free_port() for _ in range(n_servers)]
+    servers = [await spawn(WINDMILL_SERVER, {"MODBUS_HOST": "127.0.0.1", "MODBUS_PORT": str(p),
+                                             "TURBINES": str(per_server), "UNITS_PER_PORT": "247",
+                                             "SERVER_MODE": args.server_mode},
+                           log_dir, f"windmill-{p}") for p in ports]
+    procs = list(servers)
+    try:
+        for p in ports:
+            await wait_until(lambda: tcp_open(p), 30, f"windmill server on {p}")
+        # each target still gets its own client/socket
+        spec = ",".join(f"Windmill-{i:04d}@127.0.0.1:{ports[i // per_server]}:{1 + i % per_server}"
+                        for i in range(devices))
+        poller = await spawn(WINDMILL_POLLER, {
+            "TB_HOST": "127.0.0.1", "TB_MQTT_PORT": str(tb_port), "TB_GATEWAY_TOKEN": "bench",
+            "WINDMILLS": spec, "POLL_INTERVAL_SEC": str(args.interval), "POLL_MODE": args.poll_mode,
+            "SPOOL_DIR": "", "DEADBAND_FILE": "",
+        }, log_dir, "windmill-poller")
+        procs.append(poller)
+        result = await measure(tb, ProcSampler(poller.pid), procs, log_dir, args.warmup, args.duration)
+        result["params"] = {"devices": devices, "servers": n_servers, "server_mode": args.server_mode,
+                            "interval": args.interval, "poll_mode": args.poll_mode}
+        return result
+    finally:
+        stop(procs)
+        await tb.broker.close()
+
+async def bench_bacnet(args, log_dir: str) -> Dict:
+    tb = TbStandIn()
+    tb_port = await tb.broker.start()
+
+    with open(BACNET_POINTS) as f:
+        base = json.load(f)
+    # scale by reading the same objects under distinct keys
+    points = [dict(p, key=f"{p['key']}_{i // len(base)}") for i, p in
+              zip(range(args.points), (base[j % len(base)] for j in range(args.points)))]
+    points_file = os.path.join(log_dir, "points.json")
+    with open(points_file, "w") as f:
+        json.dump(points, f)
+
+    # one simulator process per controller
+    devices = args.devices or 1
+    sim_ports = [free_port(socket.SOCK_DGRAM) for _ in range(devices)]
+    bridge_port = free_port(socket.SOCK_DGRAM)
+    procs = [await spawn(BACNET_SIM, {"BACNET_BIND_IP": "127.0.0.1", "BACNET_PORT": str(p),
+                                      "BACNET_DEVICE_ID": str(40001 + i)}, log_dir, f"bacnet-sim-{p}")
+             for i, p in enumerate(sim_ports)]
+    try:
+        await asyncio.sleep(1.0)
+        bridge = await spawn(BACNET_BRIDGE, {
+            "BACNET_BIND": f"127.0.0.1:{bridge_port}",
+            "BACNET_TARGETS": ",".join(f"Plant-{i:03d}@127.0.0.1:{p}" for i, p in enumerate(sim_ports)),
+            "POINTS_FILE": points_file, "POLL_SECONDS": str(args.interval),
+            "TB_MQTT_HOST": "127.0.0.1", "TB_MQTT_PORT": str(tb_port), "TB_GATEWAY_TOKEN": "bench",
+            "SPOOL_DIR": "", "DEADBAND_FILE": "",
+        }, log_dir, "bacnet-bridge")
+        procs.append(bridge)
+        result = await measure(tb, ProcSampler(bridge.pid), procs, log_dir, args.warmup, args.duration)
+        result["params"] = {"devices": devices, "points": args.points, "interval": args.interval}
+        return result
+    finally:
+        stop(procs)
+        await tb.broker.close()
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=STACKS,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        return ""
+
+async def run(args) -> Dict:
+    log_dir = args.log_dir or tempfile.mkdtemp(prefix="iotlab-bench-")
+    os.makedirs(log_dir, exist_ok=True)
+    scenarios = ["core", "modbus", "bacnet"] if args.scenario == "all" else [args.scenario]
+    runners = {"core": bench_core, "modbus": bench_modbus, "bacnet": bench_bacnet}
+
+    results = {}
+    for name in scenarios:
+        print(f"[bench] {name} ...", file=sys.stderr, flush=True)
+        results[name] = await runners[name](args, log_dir)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "timestamp": int(time.time()),
+        "log_dir": log_dir,
+        "results": results,
+    }
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("scenario", choices=["core", "modbus", "bacnet", "all"])
+    ap.add_argument("--duration", type=float, default=20.0, help="measured seconds per scenario")
+    ap.add_argument("--warmup", type=float, default=5.0)
+    ap.add_argument("--out", default="", help="also write the JSON report here")
+    ap.add_argument("--log-dir", default="", help="bridge/simulator logs (default: a temp dir)")
+
+    core = ap.add_argument_group("core bridge")
+    core.add_argument("--devices", type=int, default=0, help="core: sensor topics (1000), modbus: windmills (50), bacnet: controllers (1)")
+    core.add_argument("--rate", type=float, default=5000, help="readings/sec injected")
+    core.add_argument("--batch-mode", default="last", choices=["last", "samples", "aggregate"])
+    core.add_argument("--workers", type=int, default=1)
+    core.add_argument("--flush-sec", type=float, default=1.0)
+
+    mb = ap.add_argument_group("windmill poller")
+    mb.add_argument("--servers", type=int, default=4, help="simulator processes (each hosts up to 247 turbines)")
+    mb.add_argument("--server-mode", default="sync", choices=["sync", "asyncio"], help="simulator SERVER_MODE")
+    mb.add_argument("--poll-mode", default="concurrent", choices=["concurrent", "serial"])
+    mb.add_argument("--interval", type=float, default=1.0, help="modbus/bacnet poll interval")
+
+    bn = ap.add_argument_group("bacnet bridge")
+    bn.add_argument("--points", type=int, default=7)
+
+    args = ap.parse_args()
+    report = asyncio.run(run(args))
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+
+if __name__ == "__main__":
+    main()
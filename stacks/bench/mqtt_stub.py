@@ -0,0 +1,161 @@
+import asyncio
+import struct
+from typing import Callable, Dict, List, Optional, Set
+
+# MQTT 3.1.1 packet types
+CONNECT, CONNACK, PUBLISH, PUBACK, PUBREC, PUBREL, PUBCOMP = 1, 2, 3, 4, 5, 6, 7
+SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = 8, 9, 10, 11, 12, 13, 14
+
+def topic_matches(pattern: str, topic: str) -> bool:
+    p = pattern.split("/")
+    t = topic.split("/")
+    for i, level in enumerate(p):
+        if level == "#":
+            return True
+        if i >= len(t) or (level != "+" and level != t[i]):
+            return False
+    return len(p) == len(t)
+
+def _remaining_length(n: int) -> bytes:
+    out = bytearray()
+    while True:
+        b = n & 0x7F
+        n >>= 7
+        out.append(b | 0x80 if n else b)
+        if not n:
+            return bytes(out)
+
+def encode_publish(topic: bytes, payload: bytes) -> bytes:
+    body_len = 2 + len(topic) + len(payload)
+    return b"\x30" + _remaining_length(body_len) + struct.pack(">H", len(topic)) + topic + payload
+
+class _Session(asyncio.Protocol):
+    def __init__(self, broker: "StubBroker"):
+        self.broker = broker
+        self.transport: Optional[asyncio.Transport] = None
+        self.buf = bytearray()
+        self.subs: Set[str] = set()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.broker.sessions.add(self)
+
+    def connection_lost(self, exc):
+        self.broker.sessions.discard(self)
+        if self.subs:
+            self.broker.invalidate()
+
+    def data_received(self, data: bytes):
+        buf = self.buf
+        buf += data
+        while len(buf) >= 2:
+            # fixed header: type/flags byte + 1..4 byte remaining length
+            n, mult, i = 0, 1, 1
+            while True:
+                if i >= len(buf):
+                    return
+                b = buf[i]
+                n += (b & 0x7F) * mult
+                mult <<= 7
+                i += 1
+                if not b & 0x80:
+                    break
+            if len(buf) < i + n:
+                return
+            first = buf[0]
+            body = bytes(buf[i:i + n])
+            del buf[:i + n]
+            self.handle(first >> 4, first & 0x0F, body)
+
+    def handle(self, ptype: int, flags: int, body: bytes):
+        w = self.transport.write
+        if ptype == PUBLISH:
+            qos = (flags >> 1) & 3
+            tlen = struct.unpack_from(">H", body)[0]
+            topic = body[2:2 + tlen]
+            pos = 2 + tlen
+            if qos:
+                pid = body[pos:pos + 2]
+                pos += 2
+                w((b"\x40\x02" if qos == 1 else b"\x50\x02") + pid)
+            self.broker.route(topic, body[pos:])
+        elif ptype == PUBREL:
+            w(b"\x70\x02" + body[:2])
+        elif ptype == CONNECT:
+            # 3.1 / 3.1.1 only; the harness never uses v5 (SCALE_MODE=shared)
+            w(b"\x20\x02\x00\x00")
+        elif ptype == SUBSCRIBE:
+            pid, pos, granted = body[:2], 2, bytearray()
+            while pos < len(body):
+                tlen = struct.unpack_from(">H", body, pos)[0]
+                self.subs.add(body[pos + 2:pos + 2 + tlen].decode())
+                pos += 2 + tlen + 1
+                granted.append(0)  # everything is delivered at QoS 0
+            w(b"\x90" + _remaining_length(2 + len(granted)) + pid + bytes(granted))
+            self.broker.invalidate()
+        elif ptype == UNSUBSCRIBE:
+            pos = 2
+            while pos < len(body):
+                tlen = struct.unpack_from(">H", body, pos)[0]
+                self.subs.discard(body[pos + 2:pos + 2 + tlen].decode())
+                pos += 2 + tlen
+            w(b"\xb0\x02" + body[:2])
+            self.broker.invalidate()
+        elif ptype == PINGREQ:
+            w(b"\xd0\x00")
+        elif ptype == DISCONNECT:
+            self.transport.close()
+
+class StubBroker:
+    """
+    Minimal in-process MQTT 3.1.1 broker for benchmarks: enough of the
+    protocol for paho (QoS 0/1/2 in, QoS 0 out, + and # wildcards, no
+    retained messages, sessions or auth). on_message, if set, sees every
+    PUBLISH received from a client; inject() delivers a message to
+    subscribers without a client connection at all.
+    """
+
+    def __init__(self, on_message: Optional[Callable[[str, bytes], None]] = None):
+        self.on_message = on_message
+        self.sessions: Set[_Session] = set()
+        self._routes: Dict[bytes, List[_Session]] = {}
+        self.server: Optional[asyncio.AbstractServer] = None
+        self.port = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> int:
+        self.server = await asyncio.get_running_loop().create_server(lambda: _Session(self), host, port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self.port
+
+    def invalidate(self):
+        self._routes.clear()
+
+    def _subscribers(self, topic: bytes) -> List[_Session]:
+        subs = self._routes.get(topic)
+        if subs is None:
+            t = topic.decode()
+            subs = [s for s in self.sessions if any(topic_matches(p, t) for p in s.subs)]
+            self._routes[topic] = subs
+        return subs
+
+    def route(self, topic: bytes, payload: bytes):
+        if self.on_message is not None:
+            self.on_message(topic.decode(), payload)
+        self.inject(topic, payload)
+
+    def inject(self, topic: bytes, payload: bytes):
+        subs = self._subscribers(topic)
+        if subs:
+            packet = encode_publish(topic, payload)
+            for s in subs:
+                s.transport.write(packet)
+
+    def write_buffer_size(self) -> int:
+        return sum(s.transport.get_write_buffer_size() for s in self.sessions if s.transport)
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            for s in list(self.sessions):
+                s.transport.close()
+            await self.server.wait_closed()
@@ -0,0 +1,87 @@
+import json
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+@dataclass
+class Rule:
+    abs: float = 0.0      # report when |new - last| > abs
+    pct: float = 0.0      # report when |new - last| > pct% of |last|
+    exact: bool = False   # report on any change (status words, codes)
+
+def _rule_from_dict(d: Dict) -> Rule:
+    return Rule(abs=float(d.get("abs", 0.0)), pct=float(d.get("pct", 0.0)), exact=bool(d.get("exact", False)))
+
+class DeadbandFilter:
+    """
+    Report-by-exception filter in front of a ThingsBoard publish.
+
+    Each (device, key) remembers the last value actually reported. A new value
+    is passed through when:
+      - the key has never been reported, or
+      - it is a bool/str, or the rule is exact, and it differs, or
+      - it is numeric and moved more than `abs` or more than `pct` percent
+        of the last reported value (a rule with neither set reports any change), or
+      - nothing was reported for the key for heartbeat_sec (so dashboards can
+        tell "unchanged" from "dead").
+    """
+
+    def __init__(self, rules: Dict[str, Rule], default: Rule, heartbeat_sec: float):
+        self.rules = rules
+        self.default = default
+        self.heartbeat_sec = heartbeat_sec
+        self.last: Dict[str, Dict[str, Tuple[object, float]]] = {}
+        self.passed = 0
+        self.suppressed = 0
+
+    def _changed(self, rule: Rule, old, new) -> bool:
+        if isinstance(new, (bool, str)) or isinstance(old, (bool, str)) or rule.exact:
+            return new != old
+        if not isinstance(new, (int, float)) or not isinstance(old, (int, float)):
+            return new != old
+        delta = abs(new - old)
+        if rule.abs <= 0 and rule.pct <= 0:
+            return delta != 0
+        if rule.abs > 0 and delta > rule.abs:
+            return True
+        return rule.pct > 0 and delta > abs(old) * rule.pct / 100.0
+
+    def filter(self, device: str, values: Dict, now: Optional[float] = None) -> Dict:
+        """Returns the subset of values to report (may be empty)."""
+        if now is None:
+            now = time.monotonic()
+        last = self.last.setdefault(device, {})
+        out = {}
+        for key, v in values.items():
+            prev = last.get(key)
+            if (prev is None
+                    or now - prev[1] >= self.heartbeat_sec
+                    or self._changed(self.rules.get(key, self.default), prev[0], v)):
+                out[key] = v
+                last[key] = (v, now)
+        self.passed += len(out)
+        self.suppressed += len(values) - len(out)
+        return out
+
+def load_deadband(path: str) -> DeadbandFilter:
+    """
+    File format:
+      {"heartbeat_sec": 60,
+       "default": {"abs": 0, "pct": 0},
+       "keys": {"power_kw": {"pct": 1.0}, "status_raw": {"exact": true}}}
+    """
+    with open(path, "r") as f:
+        doc = json.load(f)
+    return DeadbandFilter(
+        rules={k: _rule_from_dict(v) for k, v in doc.get("keys", {}).items()},
+        default=_rule_from_dict(doc.get("default", {})),
+        heartbeat_sec=float(doc.get("heartbeat_sec", 60.0)),
+    )
+
+def deadband_from_env() -> Optional[DeadbandFilter]:
+    """DEADBAND_FILE enables filtering; unset = report every reading."""
+    path = os.getenv("DEADBAND_FILE", "").strip()
+    if not path:
+        return None
+    return load_deadband(path)
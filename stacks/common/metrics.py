@@ -0,0 +1,210 @@
+import abc
+import bisect
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Dependency-free subset of the Prometheus client: counters, gauges and
+# histograms with labels, rendered in the text exposition format. Updates
+# are a lock + a few adds, so they are cheap enough for per-message paths.
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+_registry: List["_Metric"] = []
+_registry_lock = threading.Lock()
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _escape(v: str) -> str:
+    # text exposition format: backslash, double quote and newline are escaped in label values
+    return v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric(abc.ABC):
+    kind = ""
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+        with _registry_lock:
+            _registry.append(self)
+
+    def labels(self, *values):
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    @abc.abstractmethod
+    def _new_child(self):
+        """A fresh value for one label set."""
+
+    def render(self) -> List[str]:
+        doc = self.doc.replace("\\", "\\\\").replace("\n", "\\n")   # HELP escapes all but quotes
+        lines = [f"# HELP {self.name} {doc}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.extend(child.render(self.name, self.labelnames, key))
+        return lines
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, n: float = 1):
+        with self._lock:
+            self.value += n
+
+    def dec(self, n: float = 1):
+        with self._lock:
+            self.value -= n
+
+    def set(self, v: float):
+        self.value = v
+
+    def render(self, name, labelnames, key):
+        return [f"{name}{_labels(labelnames, key)} {_fmt(self.value)}"]
+
+class _FuncValue:
+    def __init__(self, fn: Callable[[], float]):
+        self.fn = fn
+
+    def render(self, name, labelnames, key):
+        try:
+            v = self.fn()
+        except Exception:
+            return []
+        return [f"{name}{_labels(labelnames, key)} {_fmt(v)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, n: float = 1):
+        self.labels().inc(n)
+
+    def set_function(self, fn: Callable[[], float], *labelvalues):
+        """Report a count kept elsewhere (dropped messages in a publisher), read at scrape time."""
+        with self._lock:
+            self._children[tuple(str(v) for v in labelvalues)] = _FuncValue(fn)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, v: float):
+        self.labels().set(v)
+
+    def set_function(self, fn: Callable[[], float], *labelvalues):
+        """Evaluate fn at scrape time (queue depths, in-flight counts)."""
+        with self._lock:
+            self._children[tuple(str(v) for v in labelvalues)] = _FuncValue(fn)
+
+class _HistogramValue:
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, v: float):
+        i = bisect.bisect_left(self.buckets, v)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += v
+
+    def render(self, name, labelnames, key):
+        with self._lock:
+            counts = list(self.counts)
+            total = self.sum
+        lines = []
+        cum = 0
+        for bound, c in zip(self.buckets + (float("inf"),), counts):
+            cum += c
+            le = 'le="%s"' % _fmt(bound)
+            lines.append(f"{name}_bucket{_labels(labelnames, key, le)} {cum}")
+        lines.append(f"{name}_sum{_labels(labelnames, key)} {_fmt(total)}")
+        lines.append(f"{name}_count{_labels(labelnames, key)} {cum}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, doc, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, v: float):
+        self.labels().observe(v)
+
+def render() -> bytes:
+    with _registry_lock:
+        metrics = list(_registry)
+    lines: List[str] = []
+    for m in metrics:
+        lines.extend(m.render())
+    return ("\n".join(lines) + "\n").encode()
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        pass  # no access log on stdout
+
+def start_metrics_server(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+def metrics_from_env(offset: int = 0) -> Optional[ThreadingHTTPServer]:
+    """METRICS_PORT > 0 serves /metrics on METRICS_PORT + offset; unset/0 = off."""
+    try:
+        port = int(os.getenv("METRICS_PORT", "0"))
+    except ValueError:
+        port = 0
+    if port <= 0:
+        return None
+    server = start_metrics_server(port + offset)
+    print(f"[metrics] serving /metrics on :{port + offset}", flush=True)
+    return server
+
+def paho_inflight(client) -> int:
+    """Messages paho has queued or in flight (not acknowledged yet)."""
+    return len(getattr(client, "_out_messages", ()))
+
+def log_readings() -> bool:
+    """LOG_READINGS=1 turns per-reading stdout lines back on (off by default)."""
+    return os.getenv("LOG_READINGS", "0").strip().lower() in ("1", "true", "yes")
@@ -0,0 +1,276 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Set, Tuple
+
+from env import env_float, env_int
+from metrics import Counter, Gauge
+from store_forward import _NO_CONN, Queued
+
+GATEWAY_TOPIC = "v1/gateway/telemetry"
+POLICIES = ("block", "coalesce", "drop_oldest")
+
+class BoundedPublisher:
+    """
+    In-memory flow control in front of a paho client's publish().
+
+    At most max_inflight QoS > 0 messages are handed to paho without an
+    acknowledgement (mids are tracked through on_publish); the rest wait in
+    a FIFO here, and nothing is handed over while disconnected. So paho's
+    own queue never holds more than max_inflight messages, and this one
+    holds at most max_queued_bytes of payload. When a publish would go over
+    that, the overload policy decides:
+
+      block       publish() waits for room, holding up the caller's loop
+      coalesce    queued v1/gateway/telemetry messages are folded into the
+                  latest values per device (stamped with the newest ts) and
+                  sent, oldest first, ahead of what is queued after them
+      drop_oldest the oldest queued messages are discarded
+
+    Other topics can't be coalesced and are dropped oldest-first under
+    coalesce. A message larger than max_queued_bytes on its own is still
+    accepted when nothing else is queued. A message paho refuses outright
+    (queue full, invalid topic, oversized payload) is dropped and counted in
+    `failed`; only a lost connection pauses the window until on_connect.
+    """
+
+    def __init__(self, client, max_inflight: int = 20, max_queued_bytes: int = 8 << 20,
+                 policy: str = "coalesce", max_message_bytes: int = 65536):
+        if policy not in POLICIES:
+            raise ValueError(f"overload policy must be one of {', '.join(POLICIES)}, not {policy!r}")
+        self.client = client
+        self.max_inflight = max(1, max_inflight)
+        self.max_queued_bytes = max(1, max_queued_bytes)
+        self.policy = policy
+        self.max_message_bytes = max_message_bytes
+
+        self.lock = threading.Lock()
+        self.room = threading.Condition(self.lock)
+        self.online = False
+        self.closed = False
+        self.queue: Deque[Tuple[str, bytes, int]] = deque()
+        self.queue_bytes = 0
+        self.latest: Dict[str, Dict] = {}   # coalesced: device -> {"ts", "values"}
+        self.latest_bytes = 0
+        self.inflight: Set[int] = set()     # mids handed to paho, not acknowledged yet
+        self.early_acks: Set[int] = set()   # mids acked before publish() returned
+        self._pumping = False
+        self._again = False
+        self._logged: Set[Optional[int]] = set()   # rcs of refused publishes already logged
+
+        # overload accounting (messages)
+        self.dropped = 0
+        self.coalesced = 0
+        self.failed = 0
+        self.blocked_sec = 0.0
+
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+
+    # -- public -------------------------------------------------------------
+
+    def publish(self, topic: str, payload, qos: int = 1) -> Queued:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        size = len(payload)
+        with self.lock:
+            if self._over(size):
+                if self.policy == "block":
+                    t0 = time.monotonic()
+                    while self._over(size) and not self.closed:
+                        self.room.wait()
+                    self.blocked_sec += time.monotonic() - t0
+                else:
+                    self._make_room(size)
+            self.queue.append((topic, payload, qos))
+            self.queue_bytes += size
+        self._pump()
+        return Queued(rc=0, seq=0)
+
+    @property
+    def queued(self) -> int:
+        """Messages, plus coalesced devices, waiting for an in-flight slot."""
+        return len(self.queue) + len(self.latest)
+
+    @property
+    def queued_bytes(self) -> int:
+        return self.queue_bytes + self.latest_bytes
+
+    def export(self, prefix: str):
+        """Register <prefix>_publish_* metrics, read from this publisher at scrape time."""
+        Gauge(f"{prefix}_publish_queue", "Messages (and coalesced devices) waiting for a publish window slot"
+              ).set_function(lambda: self.queued)
+        Gauge(f"{prefix}_publish_queue_bytes", "Payload bytes waiting for a publish window slot"
+              ).set_function(lambda: self.queued_bytes)
+        overload = Counter(f"{prefix}_publish_overload_total",
+                           "Queued messages dropped, coalesced under overload, or refused by paho, by action", ["action"])
+        overload.set_function(lambda: self.dropped, "dropped")
+        overload.set_function(lambda: self.coalesced, "coalesced")
+        overload.set_function(lambda: self.failed, "failed")
+        Counter(f"{prefix}_publish_blocked_seconds_total", "Time publishes waited for queue room"
+                ).set_function(lambda: self.blocked_sec)
+
+    def close(self):
+        """Release callers blocked in publish(); what is still queued is not sent."""
+        with self.lock:
+            self.closed = True
+            self.room.notify_all()
+
+    # -- paho callbacks (VERSION1 and VERSION2 signatures) ------------------
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        with self.lock:
+            self.online = (rc == 0)
+        self._pump()
+
+    def _on_disconnect(self, client, userdata, *args):
+        with self.lock:
+            self.online = False
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self.lock:
+            if mid in self.inflight:
+                self.inflight.discard(mid)
+            else:
+                self.early_acks.add(mid)
+        self._pump()
+
+    # -- internals (called with the lock held unless noted) -----------------
+
+    def _over(self, size: int) -> bool:
+        total = self.queue_bytes + self.latest_bytes
+        return total > 0 and total + size > self.max_queued_bytes
+
+    def _make_room(self, size: int):
+        if self.policy == "coalesce":
+            self._coalesce()
+        while self.queue and self._over(size):
+            _, payload, _ = self.queue.popleft()
+            self.queue_bytes -= len(payload)
+            self.dropped += 1
+
+    def _coalesce(self):
+        kept: Deque[Tuple[str, bytes, int]] = deque()
+        for item in self.queue:
+            topic, payload, _ = item
+            if topic != GATEWAY_TOPIC:
+                kept.append(item)
+                continue
+            try:
+                msg = json.loads(payload)
+            except ValueError:
+                kept.append(item)
+                continue
+            for device, entries in msg.items():
+                cur = self.latest.setdefault(device, {"ts": 0, "values": {}})
+                for entry in entries:
+                    cur["values"].update(entry.get("values", {}))
+                    cur["ts"] = max(cur["ts"], entry.get("ts", 0))
+            self.coalesced += 1
+        self.queue = kept
+        self.queue_bytes = sum(len(p) for _, p, _ in kept)
+        self.latest_bytes = len(json.dumps(self.latest)) if self.latest else 0
+
+    def _take_latest(self) -> bytes:
+        """Up to max_message_bytes of the coalesced devices as one gateway message."""
+        parts: List[str] = []
+        size = 2
+        for device in list(self.latest):
+            part = f"{json.dumps(device)}:{json.dumps([self.latest[device]])}"
+            if parts and size + len(part) + 1 > self.max_message_bytes:
+                break
+            parts.append(part)
+            size += len(part) + 1
+            del self.latest[device]
+        self.latest_bytes = max(0, self.latest_bytes - size) if self.latest else 0
+        return ("{" + ",".join(parts) + "}").encode()
+
+    def _next(self) -> Optional[Tuple[str, bytes, int]]:
+        if not self.online or len(self.inflight) >= self.max_inflight:
+            return None
+        if self.latest:
+            return GATEWAY_TOPIC, self._take_latest(), 1
+        if self.queue:
+            item = self.queue.popleft()
+            self.queue_bytes -= len(item[1])
+            return item
+        return None
+
+    def _pump(self):
+        # Not called with the lock held. paho calls on_publish with its own
+        # message lock held, so client.publish() must run outside ours; one
+        # thread at a time pumps so messages go out in order.
+        with self.lock:
+            if self._pumping:
+                self._again = True
+                return
+            self._pumping = True
+        try:
+            self._drain()
+        except BaseException:
+            with self.lock:
+                self._pumping = False
+            raise
+
+    def _drain(self):
+        while True:
+            with self.lock:
+                item = self._next()
+                if item is None:
+                    if self._again:
+                        self._again = False
+                        continue
+                    self._pumping = False
+                    return
+                self.room.notify_all()
+
+            topic, payload, qos = item
+            try:
+                info = self.client.publish(topic, payload, qos=qos)
+                rc, mid, reason = info.rc, info.mid, f"rc={info.rc}"
+            except ValueError as e:
+                # invalid topic or payload: this message can never be sent
+                rc, mid, reason = None, None, repr(e)
+
+            with self.lock:
+                if rc == _NO_CONN:
+                    # dropped the connection; paho keeps QoS > 0 messages for the reconnect
+                    self.online = False
+                    if qos == 0:
+                        self.failed += 1
+                        continue
+                elif rc != 0:
+                    # refused this message only (e.g. MQTT_ERR_QUEUE_SIZE): the
+                    # connection is fine, so drop it and keep the window moving
+                    self.failed += 1
+                    first = rc not in self._logged
+                    self._logged.add(rc)
+                    if first:
+                        print(f"[publisher] dropping a message to {topic}: {reason}", flush=True)
+                    continue
+                if qos == 0:
+                    self.early_acks.discard(mid)
+                elif mid in self.early_acks:
+                    self.early_acks.discard(mid)
+                else:
+                    self.inflight.add(mid)
+
+def publisher_from_env(client) -> BoundedPublisher:
+    """
+    Build a BoundedPublisher for `client` from PUBLISH_* env vars. Must be
+    called before client.connect() so on_connect is seen. Use it instead of,
+    not on top of, a StoreAndForward spool, which already bounds paho's queue.
+    """
+    policy = os.getenv("PUBLISH_OVERLOAD", "coalesce").strip().lower()
+    if policy not in POLICIES:
+        raise SystemExit(f"PUBLISH_OVERLOAD must be one of {', '.join(POLICIES)}, not {policy!r}")
+    return BoundedPublisher(
+        client,
+        max_inflight=env_int("PUBLISH_MAX_INFLIGHT", 20),
+        max_queued_bytes=int(env_float("PUBLISH_MAX_QUEUED_MB", 8.0) * (1 << 20)),
+        policy=policy,
+        max_message_bytes=env_int("MAX_PAYLOAD_BYTES", 65536),
+    )
@@ -0,0 +1,460 @@
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Set, Tuple
+
+from env import env_float, env_int
+
+# Record header: body length, crc32(body), sequence number.
+# A zero length marks the end of the written part of a segment.
+_HDR = struct.Struct("<IIQ")
+# Body prefix: qos, topic length; then topic bytes and payload bytes
+_BODY = struct.Struct("<BH")
+
+# paho's MQTT_ERR_NO_CONN: a QoS > 0 message is still kept and sent on reconnect
+_NO_CONN = 4
+
+class Queued(NamedTuple):
+    # quacks like paho's MQTTMessageInfo for callers that only check .rc
+    rc: int
+    seq: int
+
+@dataclass
+class SegmentInfo:
+    path: str
+    first_seq: int
+    last_seq: int = 0   # 0 = empty
+    size: int = 0       # bytes on disk (preallocated)
+
+class SegmentLog:
+    """
+    Append-only log split into fixed-size, preallocated segment files that are
+    written and read through mmap.
+
+    Only the segment being written and the one being read are mapped at any
+    time, so memory use does not grow with the backlog; the page cache does
+    the rest. Segment files are named after their first sequence number.
+    """
+
+    def __init__(self, directory: str, segment_bytes: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.segments: List[SegmentInfo] = []
+        self._wfile = None
+        self._wmap: Optional[mmap.mmap] = None
+        self._wend = 0
+        self._rinfo: Optional[SegmentInfo] = None
+        self._rfile = None
+        self._rmap: Optional[mmap.mmap] = None
+
+    # -- recovery -----------------------------------------------------------
+
+    def recover(self, after_seq: int) -> Tuple[int, Optional[Tuple[int, int]]]:
+        """
+        Scan existing segments. Drops segments fully <= after_seq.
+        Returns (last_seq, position of the first record > after_seq or None).
+        """
+        names = sorted(n for n in os.listdir(self.directory) if n.endswith(".seg"))
+        last_seq = after_seq
+        first_pos: Optional[Tuple[int, int]] = None
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            info = SegmentInfo(path=path, first_seq=int(name[:-4]), size=os.path.getsize(path))
+            end = 0
+            with open(path, "rb") as f:
+                if info.size == 0:
+                    os.remove(path)
+                    continue
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    off = 0
+                    while True:
+                        rec = self._read_from(mm, off)
+                        if rec is None:
+                            break
+                        seq, _, _, _, nxt = rec
+                        if first_pos is None and seq > after_seq:
+                            first_pos = (info.first_seq, off)
+                        info.last_seq = seq
+                        off = nxt
+                    end = off
+                finally:
+                    mm.close()
+
+            if not info.last_seq or info.last_seq <= after_seq:
+                # fully acknowledged, or empty (crash before the first write)
+                os.remove(path)
+                continue
+            last_seq = max(last_seq, info.last_seq)
+            self.segments.append(info)
+            self._wend = end
+
+        if self.segments:
+            self._open_writer(self.segments[-1], create=False)
+        return last_seq, first_pos
+
+    # -- writing ------------------------------------------------------------
+
+    def _open_writer(self, info: SegmentInfo, create: bool):
+        self._close_writer()
+        if create:
+            self._wfile = open(info.path, "w+b")
+            self._wfile.truncate(info.size)
+            self._wend = 0
+        else:
+            self._wfile = open(info.path, "r+b")
+        self._wmap = mmap.mmap(self._wfile.fileno(), 0)
+
+    def _close_writer(self):
+        if self._wmap is not None:
+            self._wmap.flush()
+            self._wmap.close()
+            self._wfile.close()
+        self._wmap = None
+        self._wfile = None
+
+    def append(self, seq: int, topic: str, payload: bytes, qos: int) -> Tuple[int, int]:
+        """Write one record; returns its position (segment first_seq, offset)."""
+        t = topic.encode()
+        body = _BODY.pack(qos, len(t)) + t + payload
+        need = _HDR.size + len(body)
+
+        if self._wmap is None or self._wend + need + _HDR.size > len(self._wmap):
+            # roll: new segment (bigger than usual if one record needs it)
+            info = SegmentInfo(path=os.path.join(self.directory, f"{seq:020d}.seg"),
+                               first_seq=seq, size=max(self.segment_bytes, need + _HDR.size))
+            self._open_writer(info, create=True)
+            self.segments.append(info)
+
+        off = self._wend
+        # body first, header last: a reader never sees a half-written record
+        self._wmap[off + _HDR.size:off + need] = body
+        self._wmap[off:off + _HDR.size] = _HDR.pack(len(body), zlib.crc32(body), seq)
+        self._wend = off + need
+        self.segments[-1].last_seq = seq
+        return self.segments[-1].first_seq, off
+
+    def flush(self):
+        if self._wmap is not None:
+            self._wmap.flush()
+
+    # -- reading ------------------------------------------------------------
+
+    @staticmethod
+    def _read_from(mm, off: int):
+        if off + _HDR.size > len(mm):
+            return None
+        length, crc, seq = _HDR.unpack_from(mm, off)
+        if length == 0 or off + _HDR.size + length > len(mm):
+            return None
+        body = mm[off + _HDR.size:off + _HDR.size + length]
+        if zlib.crc32(body) != crc:
+            return None
+        qos, tlen = _BODY.unpack_from(body, 0)
+        topic = body[_BODY.size:_BODY.size + tlen].decode()
+        payload = body[_BODY.size + tlen:]
+        return seq, topic, payload, qos, off + _HDR.size + length
+
+    def _map_for(self, info: SegmentInfo):
+        if info is self.segments[-1] and self._wmap is not None:
+            return self._wmap
+        if self._rinfo is not info:
+            self._close_reader()
+            self._rfile = open(info.path, "rb")
+            self._rmap = mmap.mmap(self._rfile.fileno(), 0, access=mmap.ACCESS_READ)
+            self._rinfo = info
+        return self._rmap
+
+    def _close_reader(self):
+        if self._rmap is not None:
+            self._rmap.close()
+            self._rfile.close()
+        self._rinfo = self._rfile = self._rmap = None
+
+    def read(self, pos: Tuple[int, int]):
+        """
+        Read the record at pos=(segment first_seq, offset). Returns
+        (seq, topic, payload, qos, next_pos) or None if nothing is written
+        there yet. Moves on to the next segment at the end of a full one.
+        """
+        first_seq, off = pos
+        for i, info in enumerate(self.segments):
+            if info.first_seq < first_seq:
+                continue
+            if info.first_seq > first_seq:
+                # our segment was evicted: continue at the oldest remaining one
+                off = 0
+            rec = self._read_from(self._map_for(info), off)
+            if rec is not None:
+                seq, topic, payload, qos, nxt = rec
+                return seq, topic, payload, qos, (info.first_seq, nxt)
+            if i == len(self.segments) - 1:
+                return None
+            first_seq, off = self.segments[i + 1].first_seq, 0
+        return None
+
+    # -- retention ----------------------------------------------------------
+
+    def disk_bytes(self) -> int:
+        return sum(s.size for s in self.segments)
+
+    def drop_oldest(self) -> Optional[SegmentInfo]:
+        """Delete the oldest segment unless it is the one being written."""
+        if len(self.segments) < 2:
+            return None
+        info = self.segments.pop(0)
+        if self._rinfo is info:
+            self._close_reader()
+        os.remove(info.path)
+        return info
+
+    def close(self):
+        self._close_reader()
+        self._close_writer()
+
+class StoreAndForward:
+    """
+    Disk-backed store-and-forward for ThingsBoard MQTT publishes.
+
+    publish() appends to a SegmentLog and returns immediately. A sender thread
+    feeds the log to paho while the client is connected, with at most
+    max_inflight unacknowledged messages. Records written before the latest
+    (re)connect, or recovered from disk at startup, also go through a
+    token-bucket rate limit, so a backlog built up during an outage is
+    replayed gradually instead of in one burst; live traffic written after
+    that is only bounded by the in-flight window. While disconnected nothing
+    is handed to paho, so its in-memory queue stays bounded.
+    A record paho refuses outright (invalid topic, queue full) is skipped and
+    counted in `failed` rather than retried forever.
+
+    Acknowledgements come from on_publish mids. The highest contiguous acked
+    sequence number is checkpointed to disk every checkpoint_sec and fully
+    acknowledged segments are deleted. After a restart everything past the
+    checkpoint is sent again (at-least-once). When the log exceeds
+    max_disk_bytes the oldest segment is evicted, acknowledged or not.
+    """
+
+    def __init__(self, client, directory: str, segment_bytes: int = 4 << 20,
+                 max_disk_bytes: int = 256 << 20, replay_rate: float = 50.0,
+                 max_inflight: int = 20, checkpoint_sec: float = 1.0):
+        self.client = client
+        self.log = SegmentLog(directory, segment_bytes)
+        self.max_disk_bytes = max(segment_bytes * 2, max_disk_bytes)
+        self.replay_rate = max(0.1, replay_rate)
+        self.burst = max(1.0, replay_rate)
+        self.max_inflight = max(1, max_inflight)
+        self.checkpoint_sec = checkpoint_sec
+        self.checkpoint_path = os.path.join(directory, "checkpoint")
+
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+
+        self.online = False
+        self.checkpoint = self._load_checkpoint()
+        self._saved_checkpoint = self.checkpoint
+        self.last_seq, pos = self.log.recover(self.checkpoint)
+        self.cursor: Optional[Tuple[int, int]] = pos
+        self.replay_until = self.last_seq    # records up to here are backlog (rate limited)
+        self.inflight: Dict[int, int] = {}   # mid -> seq
+        self.early_acks: Set[int] = set()    # mids acked before publish() returned
+        self.acked: Set[int] = set()         # seqs acked past the checkpoint
+        self.dropped = 0
+        self.failed = 0                      # records paho refused outright, skipped
+        self._logged: Set[Optional[int]] = set()   # rcs of refused records already logged
+
+        client.on_connect = self._on_connect
+        client.on_disconnect = self._on_disconnect
+        client.on_publish = self._on_publish
+
+        self.thread = threading.Thread(target=self._run, name="store-forward", daemon=True)
+        self.thread.start()
+
+    # -- public -------------------------------------------------------------
+
+    def publish(self, topic: str, payload, qos: int = 1) -> Queued:
+        if isinstance(payload, str):
+            payload = payload.encode()
+        with self.lock:
+            self.last_seq += 1
+            seq = self.last_seq
+            pos = self.log.append(seq, topic, payload, qos)
+            if self.cursor is None:
+                self.cursor = pos
+            self._enforce_disk_cap()
+        self.wake.set()
+        return Queued(rc=0, seq=seq)
+
+    @property
+    def pending(self) -> int:
+        """Records written but not yet acknowledged."""
+        return self.last_seq - self.checkpoint
+
+    def close(self):
+        self.stop_event.set()
+        self.wake.set()
+        self.thread.join(timeout=2.0)
+        with self.lock:
+            self._save_checkpoint()
+            self.log.close()
+
+    # -- paho callbacks (VERSION1 and VERSION2 signatures) ------------------
+
+    def _on_connect(self, client, userdata, flags, rc, *args):
+        with self.lock:
+            self.online = (rc == 0)
+            if self.online:
+                # whatever was written while offline is replayed at replay_rate
+                self.replay_until = self.last_seq
+        self.wake.set()
+
+    def _on_disconnect(self, client, userdata, *args):
+        with self.lock:
+            self.online = False
+
+    def _on_publish(self, client, userdata, mid, *args):
+        with self.lock:
+            seq = self.inflight.pop(mid, None)
+            if seq is None:
+                self.early_acks.add(mid)
+                return
+            self._ack(seq)
+        self.wake.set()
+
+    # -- internals ----------------------------------------------------------
+
+    def _load_checkpoint(self) -> int:
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_checkpoint(self):
+        if self.checkpoint == self._saved_checkpoint:
+            return
+        self.log.flush()
+        tmp = self.checkpoint_path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(str(self.checkpoint))
+        os.replace(tmp, self.checkpoint_path)
+        self._saved_checkpoint = self.checkpoint
+
+        # acknowledged segments are no longer needed
+        while len(self.log.segments) > 1 and self.log.segments[0].last_seq <= self.checkpoint:
+            self.log.drop_oldest()
+
+    def _ack(self, seq: int):
+        if seq <= self.checkpoint:
+            return
+        self.acked.add(seq)
+        while self.checkpoint + 1 in self.acked:
+            self.checkpoint += 1
+            self.acked.discard(self.checkpoint)
+
+    def _enforce_disk_cap(self):
+        while self.log.disk_bytes() > self.max_disk_bytes:
+            info = self.log.drop_oldest()
+            if info is None:
+                return
+            lost = info.last_seq - max(info.first_seq, self.checkpoint + 1) + 1
+            if lost > 0:
+                self.dropped += lost
+            if info.last_seq > self.checkpoint:
+                self.checkpoint = info.last_seq
+                self.acked = {s for s in self.acked if s > self.checkpoint}
+            if self.cursor is not None and self.cursor[0] == info.first_seq:
+                self.cursor = (self.log.segments[0].first_seq, 0)
+
+    def _run(self):
+        tokens = self.burst
+        last_refill = time.monotonic()
+        last_checkpoint = last_refill
+
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            tokens = min(self.burst, tokens + (now - last_refill) * self.replay_rate)
+            last_refill = now
+
+            if now - last_checkpoint >= self.checkpoint_sec:
+                with self.lock:
+                    self._save_checkpoint()
+                last_checkpoint = now
+
+            with self.lock:
+                rec = None
+                if self.online and self.cursor is not None and len(self.inflight) < self.max_inflight:
+                    rec = self.log.read(self.cursor)
+                replay_until = self.replay_until
+
+            if rec is None:
+                self.wake.wait(self.checkpoint_sec)
+                self.wake.clear()
+                continue
+            seq, topic, payload, qos, nxt = rec
+            replaying = seq <= replay_until
+            if replaying and tokens < 1.0:
+                time.sleep((1.0 - tokens) / self.replay_rate)
+                continue
+
+            try:
+                info = self.client.publish(topic, payload, qos=qos)
+                rc, mid, reason = info.rc, info.mid, f"rc={info.rc}"
+            except ValueError as e:
+                # invalid topic or payload: this record can never be sent
+                rc, mid, reason = None, None, repr(e)
+            if replaying:
+                tokens -= 1.0
+
+            with self.lock:
+                if rc == _NO_CONN:
+                    # the connection dropped under us. paho keeps a QoS > 0 message
+                    # and resends it on reconnect, so track it like any other; a
+                    # QoS 0 one is gone, so send the record again after on_connect
+                    self.online = False
+                    if qos == 0:
+                        continue
+                elif rc != 0:
+                    # refused this record only (e.g. MQTT_ERR_QUEUE_SIZE): skip it
+                    # so the log keeps moving
+                    self.failed += 1
+                    first = rc not in self._logged
+                    self._logged.add(rc)
+                    if first:
+                        print(f"[spool] skipping record {seq} to {topic}: {reason}", flush=True)
+                    self.cursor = nxt
+                    self._ack(seq)
+                    continue
+                self.cursor = nxt
+                if qos == 0:
+                    self._ack(seq)
+                elif mid in self.early_acks:
+                    self.early_acks.discard(mid)
+                    self._ack(seq)
+                else:
+                    self.inflight[mid] = seq
+
+def spool_from_env(client) -> Optional[StoreAndForward]:
+    """
+    Build a StoreAndForward for `client` from SPOOL_* env vars, or return
+    None when SPOOL_DIR is unset (publish straight to paho).
+    Must be called before client.connect() so on_connect is seen.
+    """
+    directory = os.getenv("SPOOL_DIR", "").strip()
+    if not directory:
+        return None
+    return StoreAndForward(
+        client,
+        directory,
+        segment_bytes=env_int("SPOOL_SEGMENT_MB", 4) << 20,
+        max_disk_bytes=env_int("SPOOL_MAX_MB", 256) << 20,
+        replay_rate=env_float("SPOOL_REPLAY_MSGS_PER_SEC", 50.0),
+        max_inflight=env_int("SPOOL_MAX_INFLIGHT", 20),
+        checkpoint_sec=env_float("SPOOL_CHECKPOINT_SEC", 1.0),
+    )
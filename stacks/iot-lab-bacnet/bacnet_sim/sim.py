@@ -1,87 +1,241 @@
 import os
-import random
+import json
+import math
+import time
+import zlib
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
 
 from bacpypes.app import BIPSimpleApplication
-from bacpypes.core import deferred, run
+from bacpypes.core import run
 from bacpypes.local.device import LocalDeviceObject
-from bacpypes.object import AnalogValueObject
+from bacpypes.object import AnalogInputObject, AnalogValueObject, Property, register_object_type
 from bacpypes.primitivedata import Real
+from bacpypes.service.cov import ChangeOfValueServices
+from bacpypes.service.object import ReadWritePropertyMultipleServices
 from bacpypes.task import FunctionTask
 
 DEVICE_ID = int(os.getenv("BACNET_DEVICE_ID", "40001"))
 DEVICE_NAME = os.getenv("BACNET_DEVICE_NAME", "NUKE-PLANT-01")
 
-# bacpypes wants "ip:port"
+# bacpypes wants "ip:port"; virtual device i listens on BACNET_PORT + i
 BIND_IP = os.getenv("BACNET_BIND_IP", "0.0.0.0")
 BIND_PORT = int(os.getenv("BACNET_PORT", "47808"))
-BIND_ADDR = f"{BIND_IP}:{BIND_PORT}"
 
+SIM_SPEC = os.getenv("SIM_SPEC", os.path.join(os.path.dirname(os.path.abspath(__file__)), "plant.json"))
+SIM_SEED = int(os.getenv("SIM_SEED", "0"))
 DRIFT_INTERVAL = float(os.getenv("DRIFT_INTERVAL_SEC", "2.0"))
-
-device = LocalDeviceObject(
-    objectName=DEVICE_NAME,
-    objectIdentifier=("device", DEVICE_ID),
-    maxApduLengthAccepted=1024,
-    segmentationSupported="noSegmentation",
-    vendorIdentifier=15,
-)
-
-app = BIPSimpleApplication(device, BIND_ADDR)
-
-def av(instance: int, name: str, initial: float) -> AnalogValueObject:
-    return AnalogValueObject(
-        objectIdentifier=("analogValue", instance),
-        objectName=name,
-        presentValue=Real(initial),
+# COV_INCREMENT >= 0 overrides every object's cov_increment from the spec
+COV_INCREMENT = float(os.getenv("COV_INCREMENT", "-1"))
+
+VENDOR_ID = 15
+
+# Catching up more ticks than this at once uses the sum's normal approximation
+# instead of stepping tick by tick.
+MAX_EXACT_STEPS = 16
+
+class PlantModel:
+    """
+    Random walk for every simulated object of every virtual device, held as
+    NumPy arrays: each tick adds uniform(drift_lo, drift_hi) and clips to the
+    object's limits.
+
+    Nothing runs on a timer. advance() is called when a value is read and
+    catches every object up to "now" in a few array operations, so an idle
+    plant costs no CPU however many objects it has. A long gap is covered in
+    one step with the same mean and variance as the individual ticks.
+    """
+
+    def __init__(self, initial: List[float], drift: List[Tuple[float, float]],
+                 limits: List[Tuple[float, float]], tick: float, seed: int):
+        self.values = np.array(initial, dtype=np.float64)
+        lo, hi = (np.array(a, dtype=np.float64) for a in zip(*drift)) if drift else (np.zeros(0), np.zeros(0))
+        self.lo, self.hi = lo, hi
+        self.mean = (lo + hi) / 2.0
+        self.std = (hi - lo) / math.sqrt(12.0)
+        self.vmin, self.vmax = ((np.array(a, dtype=np.float64) for a in zip(*limits))
+                                if limits else (np.zeros(0), np.zeros(0)))
+        self.tick = tick
+        self.rng = np.random.default_rng(seed)
+        self.t0 = time.monotonic()
+        self.steps_done = 0
+
+    def advance(self):
+        steps = int((time.monotonic() - self.t0) / self.tick) - self.steps_done
+        if steps <= 0:
+            return
+        self.steps_done += steps
+        n = len(self.values)
+        if steps <= MAX_EXACT_STEPS:
+            for _ in range(steps):
+                self.values += self.rng.uniform(self.lo, self.hi, n)
+                np.clip(self.values, self.vmin, self.vmax, out=self.values)
+        else:
+            self.values += steps * self.mean + math.sqrt(steps) * self.std * self.rng.standard_normal(n)
+            np.clip(self.values, self.vmin, self.vmax, out=self.values)
+
+    def value(self, index: int) -> float:
+        self.advance()
+        return float(self.values[index])
+
+model: Optional[PlantModel] = None
+
+class ModelPresentValue(Property):
+    """presentValue computed from the plant model when it is read."""
+
+    def __init__(self):
+        Property.__init__(self, "presentValue", Real, default=0.0, optional=False, mutable=True)
+
+    def ReadProperty(self, obj, arrayIndex=None):
+        return Real(model.value(obj._sim_index))
+
+@register_object_type(vendor_id=VENDOR_ID)
+class SimAnalogValueObject(AnalogValueObject):
+    properties = [ModelPresentValue()]
+
+@register_object_type(vendor_id=VENDOR_ID)
+class SimAnalogInputObject(AnalogInputObject):
+    properties = [ModelPresentValue()]
+
+OBJECT_CLASSES = {"analogValue": SimAnalogValueObject, "analogInput": SimAnalogInputObject}
+
+class SimApplication(BIPSimpleApplication, ReadWritePropertyMultipleServices, ChangeOfValueServices):
+    """BIPSimpleApplication plus ReadPropertyMultiple and SubscribeCOV."""
+
+    def add_subscription(self, cov):
+        # the initial notification is built from the stored value, so bring it
+        # up to date first without tripping the change detection
+        obj = cov.obj_ref
+        value = Real(model.value(obj._sim_index))
+        obj._values["presentValue"] = value
+        self.cov_detections[obj].presentValue = value
+        super().add_subscription(cov)
+        start_cov_ticks()
+
+apps: List[SimApplication] = []
+
+def load_plant(path: str) -> Tuple[List[Dict], List[float], List[Tuple[float, float]], List[Tuple[float, float]]]:
+    """
+    Spec format (one entry per device group, one per object group):
+      {"devices": [
+        {"name": "AHU", "id": 50001, "count": 20,
+         "objects": [
+           {"name": "supply_temp_c", "type": "analogInput", "count": 10, "initial": 18.0,
+            "spread": 2.0, "drift": [-0.1, 0.1], "limits": [10, 30],
+            "cov_increment": 0.2, "units": "degreesCelsius"}
+         ]}
+      ]}
+    A device group without name/id uses BACNET_DEVICE_NAME / BACNET_DEVICE_ID;
+    with count > 1 names get a 2-digit suffix (AHU-01, ...) and ids count up.
+    Object names get a 3-digit suffix with count > 1; instances are numbered
+    from 1 per type and device in spec order. spread randomises each
+    object's initial value by +/- spread.
+    """
+    with open(path, "r") as f:
+        spec = json.load(f)
+
+    rng = np.random.default_rng(SIM_SEED)
+    devices: List[Dict] = []
+    initial: List[float] = []
+    drift: List[Tuple[float, float]] = []
+    limits: List[Tuple[float, float]] = []
+    for g in spec.get("devices", []):
+        count = int(g.get("count", 1))
+        base_name = g.get("name", DEVICE_NAME)
+        base_id = int(g.get("id", DEVICE_ID))
+        for d in range(count):
+            objects = []
+            next_instance: Dict[str, int] = {}
+            for og in g.get("objects", []):
+                obj_type = og.get("type", "analogValue")
+                n = int(og.get("count", 1))
+                for i in range(n):
+                    instance = next_instance.get(obj_type, 1)
+                    next_instance[obj_type] = instance + 1
+                    spread = float(og.get("spread", 0.0))
+                    objects.append({
+                        "type": obj_type,
+                        "instance": instance,
+                        "name": og["name"] if n == 1 else f"{og['name']}_{i + 1:03d}",
+                        "index": len(initial),
+                        "cov_increment": float(og.get("cov_increment", 0.0)),
+                        "units": og.get("units", "noUnits"),
+                    })
+                    initial.append(float(og.get("initial", 0.0)) + (rng.uniform(-spread, spread) if spread else 0.0))
+                    drift.append(tuple(og.get("drift", (0.0, 0.0))))
+                    limits.append(tuple(og.get("limits", (-math.inf, math.inf))))
+            devices.append({
+                "name": base_name if count == 1 else f"{base_name}-{d + 1:02d}",
+                "id": base_id + d,
+                "objects": objects,
+                # changes whenever the device's object list, names or units do
+                "revision": zlib.crc32(json.dumps(
+                    [(o["type"], o["instance"], o["name"], o["units"]) for o in objects]).encode()),
+            })
+    return devices, initial, drift, limits
+
+def build_device(spec: Dict, port: int) -> SimApplication:
+    device = LocalDeviceObject(
+        objectName=spec["name"],
+        objectIdentifier=("device", spec["id"]),
+        maxApduLengthAccepted=1024,
+        segmentationSupported="noSegmentation",
+        vendorIdentifier=VENDOR_ID,
+        databaseRevision=spec["revision"],
     )
-
-points = {
-    "reactor_temp_c": av(1, "reactor_temp_c", 290.0),
-    "core_pressure_bar": av(2, "core_pressure_bar", 155.0),
-    "coolant_flow_lps": av(3, "coolant_flow_lps", 2200.0),
-    "steam_temp_c": av(4, "steam_temp_c", 275.0),
-    "turbine_rpm": av(5, "turbine_rpm", 3000.0),
-    "net_mw": av(6, "net_mw", 950.0),
-    "radiation_msvh": av(7, "radiation_msvh", 0.08),
-}
-
-for obj in points.values():
-    app.add_object(obj)
-
-drift = {
-    "reactor_temp_c": (-0.2, 0.25),
-    "core_pressure_bar": (-0.05, 0.05),
-    "coolant_flow_lps": (-5.0, 5.0),
-    "steam_temp_c": (-0.2, 0.2),
-    "turbine_rpm": (-2.0, 2.0),
-    "net_mw": (-1.5, 1.5),
-    "radiation_msvh": (-0.005, 0.008),
-}
-
-limits = {
-    "radiation_msvh": (0.01, 0.5),
-    "turbine_rpm": (2900.0, 3100.0),
-    "net_mw": (800.0, 1100.0),
-}
-
-def drift_once():
-    for name, obj in points.items():
-        lo, hi = drift[name]
-        current = float(obj.presentValue.value)
-        new_val = current + random.uniform(lo, hi)
-
-        if name in limits:
-            mn, mx = limits[name]
-            new_val = max(mn, min(new_val, mx))
-
-        obj.presentValue = Real(new_val)
-
-    # schedule next drift tick
-    FunctionTask(drift_once).install_task(delta=DRIFT_INTERVAL)
-
-def start():
-    print(f"[sim] listening on {BIND_ADDR} device_id={DEVICE_ID}", flush=True)
-    FunctionTask(drift_once).install_task(delta=0)
-
-deferred(start)
-run()
+    app = SimApplication(device, f"{BIND_IP}:{port}")
+    for o in spec["objects"]:
+        obj = OBJECT_CLASSES[o["type"]](
+            objectIdentifier=(o["type"], o["instance"]),
+            objectName=o["name"],
+            statusFlags=[0, 0, 0, 0],
+            units=o["units"],
+            # a COV subscriber is notified once presentValue moves this far from the last report
+            covIncrement=Real(COV_INCREMENT if COV_INCREMENT >= 0 else o["cov_increment"]),
+        )
+        obj._sim_index = o["index"]
+        app.add_object(obj)
+    return app
+
+_cov_ticking = False
+
+def start_cov_ticks():
+    global _cov_ticking
+    if not _cov_ticking:
+        _cov_ticking = True
+        FunctionTask(cov_tick).install_task(delta=0)
+
+def cov_tick():
+    """
+    COV detection only sees values that are written, so while anything is
+    subscribed, write the model's current value into each subscribed object
+    once per tick. Stops when the last subscription goes away.
+    """
+    global _cov_ticking
+    subscribed = [obj for app in apps for obj in app.cov_detections]
+    if not subscribed:
+        _cov_ticking = False
+        return
+    model.advance()
+    for obj in subscribed:
+        obj.presentValue = Real(float(model.values[obj._sim_index]))
+    FunctionTask(cov_tick).install_task(delta=DRIFT_INTERVAL)
+
+def main():
+    global model
+    devices, initial, drift, limits = load_plant(SIM_SPEC)
+    if not devices:
+        raise SystemExit(f"{SIM_SPEC}: no devices defined")
+    model = PlantModel(initial, drift, limits, DRIFT_INTERVAL, SIM_SEED)
+    for i, spec in enumerate(devices):
+        apps.append(build_device(spec, BIND_PORT + i))
+    print(f"[sim] {len(devices)} device(s), {len(initial)} object(s) from {SIM_SPEC}", flush=True)
+    for i, spec in enumerate(devices):
+        if i < 10 or i == len(devices) - 1:
+            print(f"[sim] listening on {BIND_IP}:{BIND_PORT + i} device_id={spec['id']} "
+                  f"name={spec['name']} objects={len(spec['objects'])}", flush=True)
+    run()
+
+if __name__ == "__main__":
+    main()
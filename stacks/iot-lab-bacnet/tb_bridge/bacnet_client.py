@@ -0,0 +1,1017 @@
+import os
+import json
+import time
+import socket
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from bacpypes.app import BIPSimpleApplication
+from bacpypes.local.device import LocalDeviceObject
+from bacpypes.pdu import Address
+from bacpypes.apdu import (
+    AbortPDU, AbortReason, Error, ReadAccessSpecification, ReadPropertyMultipleRequest, ReadPropertyRequest,
+    RejectPDU, RejectReason, SimpleAckPDU, SubscribeCOVRequest,
+)
+from bacpypes.basetypes import EngineeringUnits, PropertyReference, ServicesSupported
+from bacpypes.constructeddata import Any, ArrayOf
+from bacpypes.primitivedata import CharacterString, ObjectIdentifier, Real, Unsigned
+from bacpypes.iocb import IOCB
+from bacpypes.task import FunctionTask
+
+from catalog import catalog_from_env
+from metrics import Counter, Gauge, Histogram, log_readings
+
+BACNET_BIND = os.getenv("BACNET_BIND", "0.0.0.0:47809")
+POINTS_FILE = os.getenv("POINTS_FILE", "/app/points.json")
+
+# Name@host:port[:points_file],... -- one ThingsBoard device per controller.
+# A points file of "discover" (for one target, or POINTS_FILE for all of them)
+# reads the points from the device's objectList instead.
+# Without BACNET_TARGETS the single-device settings below are used.
+BACNET_TARGETS = os.getenv("BACNET_TARGETS", "")
+BACNET_TARGET = os.getenv("BACNET_TARGET", "nuke_bacnet_sim_01:47808")
+TB_DEVICE_NAME = os.getenv("TB_DEVICE_NAME", "NuclearPlant-Quantico")
+
+POLL_SECONDS = float(os.getenv("POLL_SECONDS", "2"))
+READ_TIMEOUT_SEC = float(os.getenv("READ_TIMEOUT_SEC", "2"))  # per attempt
+READ_RETRIES = int(os.getenv("READ_RETRIES", "0"))            # extra attempts after a timeout
+
+# Outstanding confirmed requests, over all devices and per device. bacpypes
+# sends one request at a time to each address, so a per-device window > 1
+# only pipelines requests into its queue.
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "32"))
+MAX_INFLIGHT_PER_DEVICE = int(os.getenv("MAX_INFLIGHT_PER_DEVICE", "1"))
+
+# auto = ReadPropertyMultiple when the device supports it, single = one
+# ReadProperty per point. RPM_MAX_POINTS caps points per request (0 = as many
+# as fit in the device's maxApduLengthAccepted).
+READ_MODE = os.getenv("READ_MODE", "auto").strip().lower()
+RPM_MAX_POINTS = int(os.getenv("RPM_MAX_POINTS", "0"))
+
+# off = poll every point. confirmed / unconfirmed = SubscribeCOV for each
+# point (with that notification type) and poll only the points whose
+# subscription was refused or isn't up yet. Subscriptions are renewed once a
+# third of COV_LIFETIME_SEC is left, so keep POLL_SECONDS well below that.
+# Notifications are published in batches every COV_FLUSH_SEC.
+COV_MODE = os.getenv("COV_MODE", "off").strip().lower()
+COV_LIFETIME_SEC = int(os.getenv("COV_LIFETIME_SEC", "300"))
+COV_FLUSH_SEC = float(os.getenv("COV_FLUSH_SEC", "0.2"))
+
+# DISCOVER_WHOIS=host:port[-last_port],... sends Who-Is to each address (a
+# broadcast address works too) every DISCOVER_INTERVAL_SEC and adds every
+# device that answers as a discovered target named after its objectName.
+# Discovered points are the objects of the DISCOVER_TYPES types. With
+# CATALOG_DIR set they are cached per device and reused after a restart; the
+# device's databaseRevision and object count are re-checked every
+# CATALOG_CHECK_SEC and a change triggers a new enumeration.
+DISCOVER_WHOIS = os.getenv("DISCOVER_WHOIS", "")
+DISCOVER_INTERVAL_SEC = float(os.getenv("DISCOVER_INTERVAL_SEC", "300"))
+DISCOVER_TYPES = [s.strip() for s in os.getenv("DISCOVER_TYPES", "analogInput,analogOutput,analogValue").split(",")
+                  if s.strip()]
+CATALOG_CHECK_SEC = float(os.getenv("CATALOG_CHECK_SEC", "60"))
+DISCOVER = "discover"
+
+if COV_MODE not in ("off", "confirmed", "unconfirmed"):
+    raise SystemExit(f"COV_MODE must be off, confirmed or unconfirmed, not {COV_MODE!r}")
+
+# LOG_READINGS=1 prints every published telemetry dict
+LOG_READINGS = log_readings()
+
+POLL_CYCLE_SECONDS = Histogram("bacnet_poll_cycle_seconds", "Time to read every due device and publish")
+READ_SECONDS = Histogram("bacnet_read_seconds", "Request round trip per device", ["device"])
+REQUESTS = Counter("bacnet_requests_total", "Confirmed requests sent, by service", ["service"])
+READ_ERRORS = Counter("bacnet_read_errors_total", "Failed point reads by device and kind", ["device", "kind"])
+CYCLES_SKIPPED = Counter("bacnet_cycles_skipped_total", "Cycles a device missed because it was still busy",
+                         ["device"])
+COV_NOTIFICATIONS = Counter("bacnet_cov_notifications_total", "COV notifications received, by device",
+                            ["device"])
+COV_REFUSED = Counter("bacnet_cov_refused_total", "SubscribeCOV requests the device refused", ["device"])
+COV_SUBSCRIPTIONS = Gauge("bacnet_cov_subscriptions", "Objects with an active COV subscription")
+ENUMERATIONS = Counter("bacnet_enumerations_total", "Object lists walked because the catalog was missing or stale",
+                       ["device"])
+INFLIGHT = Gauge("bacnet_requests_inflight", "Confirmed requests awaiting a response")
+QUEUED = Gauge("bacnet_requests_queued", "Requests waiting for a window slot")
+
+@dataclass
+class BacnetTarget:
+    name: str
+    host: str
+    port: int
+    points: List[Dict]
+    address: Optional[Address] = None
+    probed: bool = False
+    rpm_batch: int = 1  # points per request, set by size_rpm_batch()
+    max_apdu: int = 0   # device's maxApduLengthAccepted, 0 = not known yet
+    busy: bool = False  # a cycle is still reading this device
+    # discovery: points come from the device (refresh_catalog); a target found
+    # by Who-Is also takes its name from the device's objectName
+    discover: bool = False
+    named_by_device: bool = False
+    device_id: Optional[int] = None
+    catalog: Optional[Dict] = None   # catalog entry the points came from
+    catalog_checked: float = 0.0     # monotonic time of the last check, 0 = due
+    # COV: subscriberProcessIdentifier, object -> expiry / retry time (monotonic)
+    process_id: int = 0
+    cov: Dict[Tuple[str, int], float] = field(default_factory=dict)
+    cov_refused: Dict[Tuple[str, int], float] = field(default_factory=dict)
+    cov_pending: Set[Tuple[str, int]] = field(default_factory=set)
+    keys_by_object: Dict[Tuple[str, int], List[str]] = field(init=False)
+    # RequestWindow bookkeeping
+    inflight: int = 0
+    ready: bool = False
+    queue: Deque[Tuple] = field(default_factory=deque)
+
+    def __post_init__(self):
+        self.set_points(self.points)
+
+    def set_points(self, points: List[Dict]):
+        self.points = points
+        self.keys_by_object = {}
+        for p in points:
+            self.keys_by_object.setdefault(point_object(p), []).append(p["key"])
+        # forget subscriptions for objects that are no longer polled
+        for obj in [o for o in self.cov if o not in self.keys_by_object]:
+            del self.cov[obj]
+        for obj in [o for o in self.cov_refused if o not in self.keys_by_object]:
+            del self.cov_refused[obj]
+
+def point_object(p: Dict) -> Tuple[str, int]:
+    return (p["type"], int(p["instance"]))
+
+def parse_targets(spec: str, default_points: str) -> List[BacnetTarget]:
+    """
+    spec format:
+      Plant-01@host:port,Plant-02@host:port:/app/plant02_points.json
+    """
+    loaded: Dict[str, List[Dict]] = {}
+
+    def load_points(path: str) -> List[Dict]:
+        if path == DISCOVER:
+            return []
+        if path not in loaded:
+            with open(path, "r") as f:
+                loaded[path] = json.load(f)
+        return loaded[path]
+
+    targets: List[BacnetTarget] = []
+    for p in (p.strip() for p in spec.split(",")):
+        if not p:
+            continue
+        # name@host:port[:points_file]
+        name, rest = p.split("@", 1)
+        fields = rest.split(":", 2)
+        host, port = fields[:2]
+        path = fields[2] if len(fields) > 2 else default_points
+        targets.append(BacnetTarget(name=name, host=host, port=int(port), points=load_points(path),
+                                    process_id=len(targets) + 1, discover=path == DISCOVER))
+    return targets
+
+def parse_whois(spec: str) -> List[Tuple[str, int]]:
+    """
+    spec format:
+      10.0.0.255:47808,campus_sim:47808-47827
+    """
+    dests: List[Tuple[str, int]] = []
+    for p in (p.strip() for p in spec.split(",")):
+        if not p:
+            continue
+        host, ports = p.rsplit(":", 1)
+        first, _, last = ports.partition("-")
+        dests.extend((host, port) for port in range(int(first), int(last or first) + 1))
+    return dests
+
+# Filled in by setup()
+targets: List[BacnetTarget] = []
+targets_by_process: Dict[int, BacnetTarget] = {}
+whois_destinations: List[Tuple[str, int]] = []
+
+def add_target(t: BacnetTarget):
+    t.process_id = len(targets) + 1
+    targets.append(t)
+    targets_by_process[t.process_id] = t
+
+# Largest APDU we accept; an RPM-ACK has to fit in it as well as in the device's.
+LOCAL_MAX_APDU = 1024
+# Encoded size of one presentValue in a ReadPropertyMultiple-ACK (object id,
+# property id, opening/closing tags and a Real/Unsigned/Enumerated value or an
+# error class/code pair), rounded up, plus the fixed ACK header.
+RPM_BYTES_PER_POINT = 20
+RPM_HEADER_BYTES = 8
+# maxApduLengthAccepted assumed when the device can't be asked (smallest B/IP value)
+DEFAULT_DEVICE_APDU = 480
+# abort reason bacpypes reports when apduTimeout * (retries + 1) passes unanswered
+NO_RESPONSE = AbortReason.enumerations["noResponse"]
+UNRECOGNIZED_SERVICE = RejectReason.enumerations["unrecognizedService"]
+
+# Encoded size of one objectList[i] / one objectName or units result in a
+# ReadPropertyMultiple-ACK during enumeration (names assumed <= 32 chars).
+ENUM_BYTES_PER_OBJECT_ID = 24
+ENUM_BYTES_PER_NAME = 48
+WILDCARD_DEVICE = ("device", 4194303)
+
+device = LocalDeviceObject(
+    objectName="BACNET-TB-GW-POLLER",
+    objectIdentifier=("device", int(os.getenv("BACNET_DEVICE_ID", "41001"))),
+    maxApduLengthAccepted=LOCAL_MAX_APDU,
+    # lets a device that can segment return a whole objectList in one read
+    segmentationSupported="segmentedReceive",
+    maxSegmentsAccepted=64,
+    vendorIdentifier=15,
+    apduTimeout=int(READ_TIMEOUT_SEC * 1000),
+    numberOfApduRetries=READ_RETRIES,
+)
+
+class BridgeApplication(BIPSimpleApplication):
+    """BIPSimpleApplication that also accepts COV notifications and I-Am."""
+
+    def do_ConfirmedCOVNotificationRequest(self, apdu):
+        on_cov_notification(apdu)
+        self.response(SimpleAckPDU(context=apdu))
+
+    def do_UnconfirmedCOVNotificationRequest(self, apdu):
+        on_cov_notification(apdu)
+
+    def do_IAmRequest(self, apdu):
+        on_i_am(apdu)
+
+def resolve_target(t: BacnetTarget) -> bool:
+    """Look up t's address; False (try again next cycle) while DNS doesn't know it yet."""
+    if t.address is not None:
+        return True
+    try:
+        ip = socket.gethostbyname(t.host)
+    except Exception:
+        print(f"[bridge] {t.name}: waiting for DNS for '{t.host}' ...", flush=True)
+        return False
+    t.address = Address(f"{ip}:{t.port}")
+    print(f"[bridge] {t.name}: target resolved: {t.host}:{t.port} -> {ip}:{t.port}", flush=True)
+    return True
+
+def publish_gateway(gateway_payload: Dict[str, List[Dict]]):
+    if not gateway_payload:
+        return
+    if LOG_READINGS:
+        for name, entries in gateway_payload.items():
+            print("[telemetry]", name, entries[0]["values"], flush=True)
+    publish(gateway_payload)
+
+class RequestWindow:
+    """
+    Bounded set of outstanding confirmed requests: at most max_total across
+    all targets and max_per_target for any one target. Requests beyond that
+    wait in a per-target FIFO; targets with work take turns (round robin), so
+    one large controller can't starve the rest of the campus.
+
+    Timeouts are bacpypes' own APDU timer (apduTimeout / numberOfApduRetries
+    on our device object), which is cancelled when the response arrives and
+    completes the IOCB with an AbortPDU(noResponse) when it doesn't -- so
+    there is no extra task per read.
+    """
+
+    def __init__(self, max_total: int, max_per_target: int):
+        self.max_total = max(1, max_total)
+        self.max_per_target = max(1, max_per_target)
+        self.inflight = 0
+        self.queued = 0
+        self._ready: Deque[BacnetTarget] = deque()
+
+    def submit(self, t: "BacnetTarget", req, on_done: Callable):
+        """Queue a request for t; on_done(apdu, err) runs exactly once."""
+        t.queue.append((req, on_done))
+        self.queued += 1
+        self._mark_ready(t)
+        self._pump()
+
+    def cancel(self, t: "BacnetTarget", err: str):
+        """Fail t's requests that haven't been sent yet (t stopped answering)."""
+        while t.queue:
+            _, on_done = t.queue.popleft()
+            self.queued -= 1
+            on_done(None, err)
+
+    def _mark_ready(self, t: "BacnetTarget"):
+        if t.queue and not t.ready and t.inflight < self.max_per_target:
+            t.ready = True
+            self._ready.append(t)
+
+    def _pump(self):
+        while self.inflight < self.max_total and self._ready:
+            t = self._ready.popleft()
+            t.ready = False
+            if not t.queue or t.inflight >= self.max_per_target:
+                continue
+            req, on_done = t.queue.popleft()
+            self.queued -= 1
+            self._send(t, req, on_done)
+            self._mark_ready(t)
+
+    def _send(self, t: "BacnetTarget", req, on_done: Callable):
+        req.pduDestination = t.address
+        REQUESTS.labels(type(req).__name__).inc()
+        t.inflight += 1
+        self.inflight += 1
+        iocb = IOCB(req)
+
+        def _cb(i):
+            t.inflight -= 1
+            self.inflight -= 1
+            # the slot is free whatever on_done does, or t (and the queue
+            # behind it) would never be pumped again
+            try:
+                if i.ioError:
+                    on_done(None, i.ioError)
+                elif not i.ioResponse:
+                    on_done(None, "No response")
+                else:
+                    on_done(i.ioResponse, None)
+            except Exception as e:
+                print(f"[bridge] {t.name}: {type(req).__name__} callback failed: {e!r}", flush=True)
+            finally:
+                self._mark_ready(t)
+                self._pump()
+
+        iocb.add_callback(_cb)
+        app.request_io(iocb)
+
+# Set by setup()
+app: Optional[BridgeApplication] = None
+window: Optional[RequestWindow] = None
+# Discovered points cached on disk (CATALOG_DIR); None = enumerate every start
+catalog = None
+# Report-by-exception filter; None = publish every reading
+deadband = None
+# Takes each finished {device: [{"ts", "values"}]} message
+publish: Callable[[Dict[str, List[Dict]]], None] = None
+
+def setup(publish_fn: Callable[[Dict[str, List[Dict]]], None], deadband_filter=None):
+    """
+    Parse the targets, bind the BACnet application and set up the request
+    window. Call before bacpypes' run(), then schedule start() with
+    deferred(). Every gateway message the poll cycle or a COV flush produces
+    is handed to publish_fn on bacpypes' thread.
+    """
+    global app, window, catalog, deadband, publish
+    targets.extend(parse_targets(
+        BACNET_TARGETS or ("" if DISCOVER_WHOIS else f"{TB_DEVICE_NAME}@{BACNET_TARGET}"), POINTS_FILE))
+    whois_destinations.extend(parse_whois(DISCOVER_WHOIS))
+    if not targets and not whois_destinations:
+        raise SystemExit("BACNET_TARGETS and DISCOVER_WHOIS are both empty")
+    targets_by_process.update((t.process_id, t) for t in targets)
+
+    catalog = catalog_from_env()
+    deadband = deadband_filter
+    publish = publish_fn
+    app = BridgeApplication(device, BACNET_BIND)
+    window = RequestWindow(MAX_INFLIGHT, MAX_INFLIGHT_PER_DEVICE)
+    INFLIGHT.set_function(lambda: window.inflight)
+    QUEUED.set_function(lambda: window.queued)
+    COV_SUBSCRIPTIONS.set_function(lambda: sum(len(t.cov) for t in targets))
+
+def is_timeout(err) -> bool:
+    return isinstance(err, AbortPDU) and err.apduAbortRejectReason == NO_RESPONSE
+
+def describe_error(err) -> str:
+    if is_timeout(err):
+        return "BACnet read timed out"
+    if isinstance(err, (RejectPDU, AbortPDU)):
+        return f"{err.__class__.__name__} reason={err.apduAbortRejectReason}"
+    if isinstance(err, Error):
+        return f"{err.errorClass}: {err.errorCode}"
+    return str(err)
+
+def decode_value(val):
+    """presentValue (usually a Real wrapped in Any) -> float."""
+    if isinstance(val, Any):
+        # most of your points are Real
+        try:
+            val = val.cast_out(Real)
+        except Exception:
+            pass
+    # Real in bacpypes has .value
+    return float(val.value) if hasattr(val, "value") else float(val)
+
+def _observe(t: BacnetTarget, t0: float, err):
+    READ_SECONDS.labels(t.name).observe(time.perf_counter() - t0)
+    if err:
+        READ_ERRORS.labels(t.name, "timeout" if "timed out" in err else "error").inc()
+
+def read_one_point(t: BacnetTarget, p, on_done):
+    t0 = time.perf_counter()
+
+    def finished(val, err):
+        _observe(t, t0, err)
+        on_done(val, err)
+
+    req = ReadPropertyRequest(
+        objectIdentifier=(p["type"], int(p["instance"])),
+        propertyIdentifier="presentValue",
+    )
+
+    def _cb(apdu, err):
+        if err:
+            finished(None, describe_error(err))
+            return
+        try:
+            finished(decode_value(apdu.propertyValue), None)
+        except Exception as e:
+            finished(None, f"value parse error: {e}")
+
+    window.submit(t, req, _cb)
+
+def read_points_multiple(t: BacnetTarget, batch, on_done):
+    """
+    Read presentValue of every point in batch with one ReadPropertyMultiple.
+    on_done(results) gets a (val, err) per point, in order, or None if the
+    device refused the service (the caller then re-reads with single reads).
+    """
+    t0 = time.perf_counter()
+
+    req = ReadPropertyMultipleRequest(listOfReadAccessSpecs=[
+        ReadAccessSpecification(
+            objectIdentifier=(p["type"], int(p["instance"])),
+            listOfPropertyReferences=[PropertyReference(propertyIdentifier="presentValue")],
+        ) for p in batch
+    ])
+
+    def _cb(apdu, err):
+        if isinstance(err, (RejectPDU, AbortPDU, Error)) and not is_timeout(err):
+            if t.rpm_batch > 1:
+                t.rpm_batch = 1
+                print(f"[bridge] {t.name}: ReadPropertyMultiple refused ({describe_error(err)}), "
+                      f"falling back to single reads", flush=True)
+            on_done(None)
+            return
+
+        results = []
+        if err:
+            results = [(None, describe_error(err))] * len(batch)
+        else:
+            # one ReadAccessResult per ReadAccessSpecification, in request order
+            for res in apdu.listOfReadAccessResults or []:
+                if not res.listOfResults or res.listOfResults[0].readResult is None:
+                    print(f"[bridge] {t.name}: ReadPropertyMultiple returned no result for "
+                          f"{res.objectIdentifier}", flush=True)
+                    results.append((None, "ReadPropertyMultiple returned no result"))
+                    continue
+                elem = res.listOfResults[0].readResult
+                if elem.propertyAccessError is not None:
+                    e = elem.propertyAccessError
+                    results.append((None, f"{e.errorClass}: {e.errorCode}"))
+                    continue
+                try:
+                    results.append((decode_value(elem.propertyValue), None))
+                except Exception as e:
+                    results.append((None, f"value parse error: {e}"))
+            if len(results) != len(batch):
+                results = [(None, "ReadPropertyMultiple result count mismatch")] * len(batch)
+
+        for _, e in results:
+            _observe(t, t0, e)
+        on_done(results)
+
+    window.submit(t, req, _cb)
+
+def size_rpm_batch(t: BacnetTarget, read_multiple: bool):
+    """Points per ReadPropertyMultiple that fit t.max_apdu, or 1 for single reads."""
+    if not read_multiple or READ_MODE == "single":
+        t.rpm_batch = 1
+        return
+    budget = min(t.max_apdu or DEFAULT_DEVICE_APDU, LOCAL_MAX_APDU) - RPM_HEADER_BYTES
+    t.rpm_batch = max(1, budget // RPM_BYTES_PER_POINT)
+    if RPM_MAX_POINTS > 0:
+        t.rpm_batch = min(t.rpm_batch, RPM_MAX_POINTS)
+
+def probe_device(t: BacnetTarget, on_done):
+    """
+    Ask the device (wildcard instance 4194303) whether it executes
+    ReadPropertyMultiple and how large a request it accepts, and size
+    t.rpm_batch from that. Falls back to single reads if it can't tell.
+    on_done(False) means the device didn't answer; it is probed again
+    next cycle.
+    """
+    if READ_MODE == "single":
+        t.probed = True
+        on_done(True)
+        return
+
+    def got_services(apdu, err):
+        if is_timeout(err):
+            on_done(False)
+            return
+        t.probed = True
+        try:
+            if err:
+                raise RuntimeError(describe_error(err))
+            bits = apdu.propertyValue.cast_out(ServicesSupported)  # list of 0/1
+            rpm_bit = ServicesSupported.bitNames["readPropertyMultiple"]
+            supported = len(bits) > rpm_bit and bool(bits[rpm_bit])
+        except Exception as e:
+            print(f"[bridge] {t.name}: protocolServicesSupported unavailable ({e}), using single reads", flush=True)
+            on_done(True)
+            return
+        if not supported:
+            print(f"[bridge] {t.name}: device does not support ReadPropertyMultiple, using single reads", flush=True)
+            on_done(True)
+            return
+
+        def got_apdu(apdu, err):
+            t.max_apdu = DEFAULT_DEVICE_APDU
+            if not err:
+                try:
+                    t.max_apdu = int(apdu.propertyValue.cast_out(Unsigned))
+                except Exception:
+                    pass
+            size_rpm_batch(t, True)
+            print(f"[bridge] {t.name}: ReadPropertyMultiple, max APDU {t.max_apdu}, "
+                  f"{t.rpm_batch} point(s) per request", flush=True)
+            on_done(True)
+
+        window.submit(t, ReadPropertyRequest(objectIdentifier=WILDCARD_DEVICE,
+                                             propertyIdentifier="maxApduLengthAccepted"), got_apdu)
+
+    window.submit(t, ReadPropertyRequest(objectIdentifier=WILDCARD_DEVICE,
+                                         propertyIdentifier="protocolServicesSupported"), got_services)
+
+def read_properties(t: BacnetTarget, specs: List[Tuple], value_bytes: int, on_done):
+    """
+    Read (object, property, array_index) specs in as few requests as fit in
+    the device's APDU: ReadPropertyMultiple batches when t reads that way,
+    one ReadProperty per spec otherwise or when the device refuses a batch.
+    on_done(results) gets an (Any, err) per spec, in order. A timeout fails
+    the rest of t's queued requests.
+    """
+    results: List[Tuple] = [(None, None)] * len(specs)
+    pending = len(specs)
+    if not specs:
+        on_done(results)
+        return
+
+    def settle(i: int, val, err):
+        nonlocal pending
+        results[i] = (val, err)
+        pending -= 1
+        if err and "timed out" in err:
+            window.cancel(t, "skipped: device not responding")
+        if pending == 0:
+            on_done(results)
+
+    def read_single(i: int):
+        obj, prop, index = specs[i]
+
+        def done(apdu, err):
+            if err:
+                settle(i, None, describe_error(err))
+            else:
+                settle(i, apdu.propertyValue, None)
+
+        window.submit(t, ReadPropertyRequest(objectIdentifier=obj, propertyIdentifier=prop,
+                                             propertyArrayIndex=index), done)
+
+    def read_batch(idx: range):
+        req = ReadPropertyMultipleRequest(listOfReadAccessSpecs=[
+            ReadAccessSpecification(
+                objectIdentifier=specs[i][0],
+                listOfPropertyReferences=[PropertyReference(propertyIdentifier=specs[i][1],
+                                                            propertyArrayIndex=specs[i][2])],
+            ) for i in idx
+        ])
+
+        def done(apdu, err):
+            if isinstance(err, (RejectPDU, AbortPDU, Error)) and not is_timeout(err):
+                for i in idx:
+                    read_single(i)
+                return
+            if not err and len(apdu.listOfReadAccessResults) != len(idx):
+                err = "ReadPropertyMultiple result count mismatch"
+            if err:
+                err = describe_error(err)
+                for i in idx:
+                    settle(i, None, err)
+                return
+            for i, res in zip(idx, apdu.listOfReadAccessResults):
+                elem = res.listOfResults[0].readResult
+                if elem.propertyAccessError is not None:
+                    e = elem.propertyAccessError
+                    settle(i, None, f"{e.errorClass}: {e.errorCode}")
+                else:
+                    settle(i, elem.propertyValue, None)
+
+        window.submit(t, req, done)
+
+    if t.rpm_batch > 1:
+        n = max(1, (min(t.max_apdu or DEFAULT_DEVICE_APDU, LOCAL_MAX_APDU) - RPM_HEADER_BYTES) // value_bytes)
+        for start in range(0, len(specs), n):
+            read_batch(range(start, min(start + n, len(specs))))
+    else:
+        for i in range(len(specs)):
+            read_single(i)
+
+def apply_catalog(t: BacnetTarget, entry: Dict):
+    """Poll t from a catalog entry (cached or just enumerated)."""
+    t.catalog = entry
+    t.device_id = entry["device_id"]
+    if t.named_by_device and entry.get("name"):
+        t.name = entry["name"]
+    if not t.probed:
+        # cached: no need to probe again
+        t.max_apdu = entry.get("max_apdu") or 0
+        size_rpm_batch(t, entry.get("read_multiple", False))
+        t.probed = True
+    t.set_points(entry["points"])
+
+def refresh_catalog(t: BacnetTarget, on_done):
+    """
+    Check t's points against the device: read its databaseRevision and
+    object count (one request) and, when there is no catalog entry or they
+    differ from it, enumerate the device -- objectList, then objectName and
+    units of each DISCOVER_TYPES object -- save the new entry and poll from
+    it. on_done(err) with err None on success; on failure the check is
+    repeated next cycle.
+    """
+    t.catalog_checked = time.monotonic()
+
+    def failed(err: str):
+        t.catalog_checked = 0.0
+        if "timed out" not in err and "skipped" not in err:
+            print(f"[bridge] {t.name}: enumeration failed ({err})", flush=True)
+        on_done("device not responding" if "timed out" in err or "skipped" in err else err)
+
+    def identify():
+        def done(apdu, err):
+            if err:
+                failed(describe_error(err))
+                return
+            t.device_id = apdu.propertyValue.cast_out(ObjectIdentifier)[1]
+            check()
+
+        window.submit(t, ReadPropertyRequest(objectIdentifier=WILDCARD_DEVICE,
+                                             propertyIdentifier="objectIdentifier"), done)
+
+    def check():
+        dev = ("device", t.device_id)
+
+        def done(results):
+            (name, _), (revision, _), (count, err) = results
+            if err:
+                # e.g. unknownObject: a different device answers there now
+                t.device_id = None
+                failed(err)
+                return
+            header = {
+                "device_id": dev[1],
+                "name": str(name.cast_out(CharacterString)) if name is not None else t.name,
+                "address": f"{t.host}:{t.port}",
+                "database_revision": int(revision.cast_out(Unsigned)) if revision is not None else None,
+                "object_count": int(count.cast_out(Unsigned)),
+            }
+            e = t.catalog
+            if e is not None and all(e.get(k) == header[k] for k in ("device_id", "database_revision", "object_count")):
+                on_done(None)
+                return
+            print(f"[bridge] {t.name}: {'no catalog entry' if e is None else 'device changed'}, "
+                  f"enumerating {header['object_count']} object(s)", flush=True)
+            ENUMERATIONS.labels(t.name).inc()
+            read_object_list(header)
+
+        read_properties(t, [(dev, "objectName", None), (dev, "databaseRevision", None), (dev, "objectList", 0)],
+                        ENUM_BYTES_PER_NAME, done)
+
+    def read_object_list(header: Dict):
+        dev = ("device", header["device_id"])
+
+        def got_entries(results):
+            err = next((e for _, e in results if e), None)
+            if err:
+                failed(err)
+                return
+            read_names(header, [tuple(v.cast_out(ObjectIdentifier)) for v, _ in results])
+
+        def got_whole(apdu, err):
+            if err is None:
+                try:
+                    objects = [tuple(o) for o in apdu.propertyValue.cast_out(ArrayOf(ObjectIdentifier))]
+                except Exception as e:
+                    failed(f"objectList parse error: {e}")
+                    return
+                read_names(header, objects)
+            elif is_timeout(err) or isinstance(err, str):
+                failed(describe_error(err))
+            else:
+                # too large for one APDU and the device can't segment it: entry by entry
+                read_properties(t, [(dev, "objectList", i) for i in range(1, header["object_count"] + 1)],
+                                ENUM_BYTES_PER_OBJECT_ID, got_entries)
+
+        window.submit(t, ReadPropertyRequest(objectIdentifier=dev, propertyIdentifier="objectList"), got_whole)
+
+    def read_names(header: Dict, objects: List[Tuple[str, int]]):
+        wanted = [o for o in objects if o[0] in DISCOVER_TYPES]
+
+        def done(results):
+            points: List[Dict] = []
+            seen: Set[str] = set()
+            for i, obj in enumerate(wanted):
+                (name, err), (units, _) = results[2 * i], results[2 * i + 1]
+                if err and ("timed out" in err or "skipped" in err):
+                    failed(err)
+                    return
+                key = str(name.cast_out(CharacterString)) if name is not None else f"{obj[0]}_{obj[1]}"
+                if key in seen:
+                    key = f"{key}_{obj[0]}_{obj[1]}"
+                seen.add(key)
+                p = {"key": key, "type": obj[0], "instance": obj[1]}
+                if units is not None:
+                    try:
+                        p["units"] = units.cast_out(EngineeringUnits)
+                    except Exception:
+                        pass
+                points.append(p)
+            entry = dict(header, max_apdu=t.max_apdu, read_multiple=t.rpm_batch > 1, points=points)
+            apply_catalog(t, entry)
+            if catalog is not None:
+                catalog.save(entry)
+            print(f"[bridge] {t.name}: device {entry['device_id']}, {len(points)} point(s) of "
+                  f"{len(objects)} object(s), databaseRevision {entry['database_revision']}", flush=True)
+            on_done(None)
+
+        read_properties(t, [(o, prop, None) for o in wanted for prop in ("objectName", "units")],
+                        ENUM_BYTES_PER_NAME, done)
+
+    if t.device_id is None:
+        identify()
+    else:
+        check()
+
+def poll_target(t: BacnetTarget, on_done):
+    """
+    Read every point of t that has no COV subscription, up to
+    MAX_INFLIGHT_PER_DEVICE requests at a time,
+    and call on_done(telemetry) once all of them have answered or failed.
+    After a timeout the rest of t's queued requests are failed straight
+    away, so an offline controller costs one timeout per cycle, not one per
+    request.
+    """
+    if not t.probed:
+        def probed(ok: bool):
+            if ok:
+                poll_target(t, on_done)
+            else:
+                on_done({"_heartbeat": 1, "poll_error": "device not responding"})
+        probe_device(t, probed)
+        return
+    if t.discover and time.monotonic() - t.catalog_checked >= CATALOG_CHECK_SEC:
+        def refreshed(err: Optional[str]):
+            if err is None:
+                poll_target(t, on_done)
+            else:
+                on_done({"_heartbeat": 1, "poll_error": err})
+        refresh_catalog(t, refreshed)
+        return
+
+    telemetry: Dict = {"_heartbeat": 1}
+    pending = 0
+
+    def record(p, val, err):
+        if err:
+            telemetry[p["key"] + "_error"] = err
+        else:
+            telemetry[p["key"]] = val
+
+    def settle(n: int, err: Optional[str]):
+        nonlocal pending
+        if err and "timed out" in err:
+            window.cancel(t, "skipped: device not responding")
+        pending -= n
+        if pending == 0:
+            on_done(telemetry)
+
+    def read_single(p):
+        def done(val, err):
+            record(p, val, err)
+            settle(1, err)
+        read_one_point(t, p, done)
+
+    def read_multiple(batch):
+        def done(results):
+            if results is None:
+                # refused: t.rpm_batch is 1 now, redo these as single reads
+                for p in batch:
+                    read_single(p)
+                return
+            for p, (val, err) in zip(batch, results):
+                record(p, val, err)
+            settle(len(batch), next((e for _, e in results if e), None))
+        read_points_multiple(t, batch, done)
+
+    points = [p for p in t.points if point_object(p) not in t.cov] if t.cov else t.points
+    batches = [points[i:i + t.rpm_batch] for i in range(0, len(points), t.rpm_batch)]
+    if not batches:
+        on_done(telemetry)
+        return
+    pending = len(points)
+    for batch in batches:
+        if len(batch) == 1:
+            read_single(batch[0])
+        else:
+            read_multiple(batch)
+
+# COV notifications received since the last flush: device -> {key: value}
+cov_updates: Dict[str, Dict] = {}
+
+def flush_cov():
+    global cov_updates
+    updates, cov_updates = cov_updates, {}
+    ts_ms = int(time.time() * 1000)
+    gateway_payload: Dict[str, List[Dict]] = {}
+    for name, values in updates.items():
+        if deadband is not None:
+            values = deadband.filter(name, values)
+        if values:
+            gateway_payload[name] = [{"ts": ts_ms, "values": values}]
+    publish_gateway(gateway_payload)
+
+def on_cov_notification(apdu):
+    t = targets_by_process.get(apdu.subscriberProcessIdentifier)
+    keys = t.keys_by_object.get(tuple(apdu.monitoredObjectIdentifier)) if t is not None else None
+    if not keys:
+        return  # not ours (e.g. a subscription left over from a previous run)
+    COV_NOTIFICATIONS.labels(t.name).inc()
+    for pv in apdu.listOfValues:
+        if pv.propertyIdentifier != "presentValue":
+            continue
+        try:
+            val = decode_value(pv.value)
+        except Exception:
+            continue
+        if not cov_updates:
+            FunctionTask(flush_cov).install_task(delta=COV_FLUSH_SEC)
+        values = cov_updates.setdefault(t.name, {})
+        for key in keys:
+            values[key] = val
+
+def subscribe_cov(t: BacnetTarget, obj: Tuple[str, int]):
+    """(Re)subscribe to obj; refused objects are polled and retried after a lifetime."""
+    t.cov_pending.add(obj)
+    sent = time.monotonic()
+    req = SubscribeCOVRequest(
+        subscriberProcessIdentifier=t.process_id,
+        monitoredObjectIdentifier=obj,
+        issueConfirmedNotifications=COV_MODE == "confirmed",
+        lifetime=COV_LIFETIME_SEC,
+    )
+
+    def done(apdu, err):
+        t.cov_pending.discard(obj)
+        if err is None:
+            t.cov[obj] = sent + COV_LIFETIME_SEC
+        elif isinstance(err, (RejectPDU, AbortPDU, Error)) and not is_timeout(err):
+            # not supported for this object (or, if the service is unknown, for
+            # any object on this device): poll it
+            refused = [obj]
+            if isinstance(err, RejectPDU) and err.apduAbortRejectReason == UNRECOGNIZED_SERVICE:
+                refused = list(t.keys_by_object)
+            if not t.cov_refused:
+                print(f"[bridge] {t.name}: SubscribeCOV {obj[0]}:{obj[1]} refused ({describe_error(err)}), "
+                      f"polling {'all points' if len(refused) > 1 else 'it'}", flush=True)
+            for o in refused:
+                t.cov.pop(o, None)
+                t.cov_refused[o] = sent + COV_LIFETIME_SEC
+            COV_REFUSED.labels(t.name).inc()
+        # a timeout (or a skip after one) leaves any current subscription to
+        # run out; the next cycle retries
+
+    window.submit(t, req, done)
+
+def maintain_cov(t: BacnetTarget):
+    """Subscribe new objects, renew ones with < 1/3 lifetime left, drop lapsed ones."""
+    now = time.monotonic()
+    for obj in t.keys_by_object:
+        if obj in t.cov_pending:
+            continue
+        retry_at = t.cov_refused.get(obj)
+        if retry_at is not None:
+            if now < retry_at:
+                continue
+            del t.cov_refused[obj]
+        expires = t.cov.get(obj)
+        if expires is not None:
+            if now >= expires:
+                del t.cov[obj]  # lapsed: polled again until the renewal succeeds
+            elif expires - now > COV_LIFETIME_SEC / 3:
+                continue
+        subscribe_cov(t, obj)
+
+def poll_cycle():
+    """
+    Every POLL_SECONDS: start a read of every target that isn't still busy
+    with the previous cycle, and publish all of them as one gateway message
+    once the last one is done.
+    """
+    FunctionTask(poll_cycle).install_task(delta=POLL_SECONDS)
+
+    ts_ms = int(time.time() * 1000)
+    cycle_start = time.perf_counter()
+    due = []
+    for t in targets:
+        if t.busy:
+            CYCLES_SKIPPED.labels(t.name).inc()
+        elif resolve_target(t):
+            due.append(t)
+            if COV_MODE != "off":
+                maintain_cov(t)
+    if not due:
+        return
+
+    gateway_payload: Dict[str, List[Dict]] = {}
+    remaining = len(due)
+
+    def target_done(t: BacnetTarget, telemetry: Dict):
+        nonlocal remaining
+        t.busy = False
+        if deadband is not None:
+            telemetry = deadband.filter(t.name, telemetry)
+        if telemetry:
+            gateway_payload[t.name] = [{"ts": ts_ms, "values": telemetry}]
+        remaining -= 1
+        if remaining == 0:
+            publish_gateway(gateway_payload)
+            POLL_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
+
+    for t in due:
+        t.busy = True
+        try:
+            poll_target(t, lambda telemetry, t=t: target_done(t, telemetry))
+        except Exception as e:
+            target_done(t, {"_heartbeat": 1, "poll_error": str(e)})
+
+def who_is():
+    """Send Who-Is to every DISCOVER_WHOIS address; answers arrive in on_i_am()."""
+    FunctionTask(who_is).install_task(delta=DISCOVER_INTERVAL_SEC)
+    resolved: Dict[str, Optional[str]] = {}
+    for host, port in whois_destinations:
+        if host not in resolved:
+            try:
+                resolved[host] = socket.gethostbyname(host)
+            except Exception:
+                resolved[host] = None
+                print(f"[bridge] Who-Is: waiting for DNS for '{host}' ...", flush=True)
+        if resolved[host] is not None:
+            app.who_is(address=Address(f"{resolved[host]}:{port}"))
+
+def on_i_am(apdu):
+    """Add a device that answered Who-Is as a target, unless it is one already."""
+    device_id = apdu.iAmDeviceIdentifier[1]
+    ip, port = apdu.pduSource.addrTuple
+    for t in targets:
+        if t.device_id == device_id:
+            if t.address is not None and t.address.addrTuple != (ip, port):
+                print(f"[bridge] {t.name}: device {device_id} moved to {ip}:{port}", flush=True)
+                t.host, t.port, t.address = ip, port, apdu.pduSource
+            return
+        if t.address is not None and t.address.addrTuple == (ip, port):
+            return
+    t = BacnetTarget(name=f"device-{device_id}", host=ip, port=port, points=[],
+                     discover=True, named_by_device=True, device_id=device_id)
+    add_target(t)
+    print(f"[bridge] I-Am from device {device_id} at {ip}:{port}", flush=True)
+
+def load_catalog():
+    """
+    Start configured "discover" targets from their cached entries and, with
+    DISCOVER_WHOIS, every other cached device too, before anything is sent.
+    """
+    if catalog is None:
+        return
+    used = set()
+    for t in targets:
+        entry = catalog.find(f"{t.host}:{t.port}") if t.discover else None
+        if entry is not None:
+            apply_catalog(t, entry)
+            used.add(entry["device_id"])
+    if whois_destinations:
+        for device_id, entry in catalog.entries.items():
+            if device_id in used:
+                continue
+            host, port = entry["address"].rsplit(":", 1)
+            t = BacnetTarget(name=entry["name"], host=host, port=int(port), points=[],
+                             discover=True, named_by_device=True)
+            add_target(t)
+            apply_catalog(t, entry)
+            used.add(device_id)
+    print(f"[bridge] catalog {catalog.directory}: {len(used)} device(s) loaded, "
+          f"{sum(len(t.points) for t in targets if t.catalog)} point(s)", flush=True)
+
+def start():
+    print(f"[bridge] local bind: {BACNET_BIND}, {len(targets)} target(s), "
+          f"window {MAX_INFLIGHT} total / {MAX_INFLIGHT_PER_DEVICE} per device", flush=True)
+    if READ_MODE == "single":
+        print("[bridge] READ_MODE=single: one ReadProperty per point", flush=True)
+    if COV_MODE != "off":
+        print(f"[bridge] COV_MODE={COV_MODE}: subscribing for {COV_LIFETIME_SEC}s at a time, "
+              f"polling only points without a subscription", flush=True)
+    load_catalog()
+    # kick off first cycle once task manager is live
+    FunctionTask(poll_cycle).install_task(delta=0)
+    if whois_destinations:
+        print(f"[bridge] Who-Is to {len(whois_destinations)} address(es) every {DISCOVER_INTERVAL_SEC:g}s", flush=True)
+        FunctionTask(who_is).install_task(delta=0)
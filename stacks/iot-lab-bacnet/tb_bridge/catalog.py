@@ -0,0 +1,82 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+
+# Bump when the entry layout changes; entries written by another version are
+# ignored and their devices enumerated again.
+CATALOG_VERSION = 1
+
+class DeviceCatalog:
+    """
+    On-disk cache of the points discovered on each BACnet device, so a
+    restarted bridge can start polling straight away instead of walking
+    every controller's object list again.
+
+    One JSON file per device, <directory>/device-<id>.json:
+      {"version": 1, "device_id": 50001, "name": "AHU-01",
+       "address": "ahu_sim:47808", "database_revision": 1234,
+       "object_count": 501, "max_apdu": 1024, "read_multiple": true,
+       "enumerated_at": 1700000000.0,
+       "points": [{"key": "supply_temp_c_001", "type": "analogInput",
+                   "instance": 1, "units": "degreesCelsius"}, ...]}
+    An entry stays valid while the device reports the same databaseRevision
+    and object count; the bridge checks those and calls save() with a fresh
+    entry when they change. Writes go to a temp file that is renamed over
+    the old one, so a crash mid-write keeps the previous entry.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.entries: Dict[int, Dict] = {}
+        self._load()
+
+    def _path(self, device_id: int) -> str:
+        return os.path.join(self.directory, f"device-{device_id}.json")
+
+    def _load(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("device-") and name.endswith(".json")):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), "r") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"[catalog] ignoring {name}: {e}", flush=True)
+                continue
+            if entry.get("version") != CATALOG_VERSION:
+                continue
+            self.entries[int(entry["device_id"])] = entry
+
+    def find(self, address: str) -> Optional[Dict]:
+        """Entry last seen at address ("host:port" as configured), if any."""
+        for entry in self.entries.values():
+            if entry.get("address") == address:
+                return entry
+        return None
+
+    def save(self, entry: Dict):
+        entry["version"] = CATALOG_VERSION
+        entry.setdefault("enumerated_at", time.time())
+        # one device per address: drop an entry for a device that was replaced
+        for device_id, old in list(self.entries.items()):
+            if device_id != entry["device_id"] and old.get("address") == entry.get("address"):
+                del self.entries[device_id]
+                try:
+                    os.remove(self._path(device_id))
+                except OSError:
+                    pass
+        self.entries[int(entry["device_id"])] = entry
+        path = self._path(entry["device_id"])
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(entry, f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+def catalog_from_env() -> Optional[DeviceCatalog]:
+    """CATALOG_DIR enables the cache; unset = enumerate on every start."""
+    directory = os.getenv("CATALOG_DIR", "").strip()
+    if not directory:
+        return None
+    return DeviceCatalog(directory)
@@ -0,0 +1,210 @@
+import json
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+class _Stamped(dict):
+    """A device's merged values plus the time of its latest reading (ms)."""
+
+    __slots__ = ("ts",)
+
+class TelemetryBatcher:
+    """
+    Double-buffered telemetry batcher.
+
+    add() runs on paho's network thread and merges into the active buffer;
+    next_batch() runs on the flush thread and swaps the active buffer for an
+    empty one. Both hold the same lock for a few dict operations only, so a
+    reading is either in the swapped-out batch or in the new buffer -- never
+    lost. (A bare reference swap is not enough in CPython: add() could still
+    be writing into the old dict while flush() serialises it.)
+
+    A batch is released on whichever comes first:
+      - max_devices distinct devices buffered
+      - max_bytes of raw payload buffered
+      - max_age seconds since the first reading of the batch
+    add() sets an Event when a batch opens or fills up, so the flush thread
+    sleeps until there is something to do instead of polling.
+
+    A reading passed with ts (epoch ms, e.g. when it was polled) keeps that
+    stamp; one without is stamped when its batch is flushed.
+    """
+
+    def __init__(self, max_devices: int, max_bytes: int, max_age: float):
+        self.max_devices = max(1, max_devices)
+        self.max_bytes = max(1, max_bytes)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active: Dict[str, Dict] = {}
+        self._bytes = 0
+        self._opened = 0.0
+
+    def add(self, device: str, telemetry: Dict, size: int, ts: Optional[int] = None):
+        with self._lock:
+            buf = self._active
+            opened = not buf
+            if opened:
+                self._opened = time.monotonic()
+            self._merge(buf, device, telemetry, ts)
+            self._bytes += size
+            full = len(buf) >= self.max_devices or self._bytes >= self.max_bytes
+        if opened or full:
+            self._wake.set()
+
+    def _merge(self, buf: Dict, device: str, telemetry: Dict, ts: Optional[int]):
+        # last value per device/key wins; called with the lock held
+        if ts is None:
+            buf.setdefault(device, {}).update(telemetry)
+            return
+        values = buf.get(device)
+        if type(values) is not _Stamped:
+            values = buf[device] = _Stamped(values or ())
+        values.update(telemetry)
+        values.ts = ts
+
+    def to_gateway(self, batch: Dict, ts_ms: int) -> Dict[str, List[Dict]]:
+        return {dev: [{"ts": telemetry.ts if type(telemetry) is _Stamped else ts_ms, "values": telemetry}]
+                for dev, telemetry in batch.items()}
+
+    def depth(self) -> int:
+        """Devices in the open batch (for metrics)."""
+        return len(self._active)
+
+    def swap(self) -> Dict[str, Dict]:
+        with self._lock:
+            batch, self._active = self._active, {}
+            self._bytes = 0
+        return batch
+
+    def next_batch(self, stop: Optional[threading.Event] = None) -> Dict[str, Dict]:
+        """Block until a size or age trigger fires, then return the batch."""
+        while stop is None or not stop.is_set():
+            with self._lock:
+                n = len(self._active)
+                full = n >= self.max_devices or self._bytes >= self.max_bytes
+                remaining = self._opened + self.max_age - time.monotonic()
+            if n and (full or remaining <= 0):
+                return self.swap()
+            self._wake.wait(remaining if n else 1.0)
+            self._wake.clear()
+        return self.swap()
+
+class SampleBatcher(TelemetryBatcher):
+    """
+    Full-fidelity variant: every reading is kept with its timestamp in
+    a per-device ring buffer (deque with maxlen), and sent as one
+    {"ts", "values"} entry per sample. A long flush interval then reduces the
+    message rate without dropping samples or skewing timestamps. If a device
+    produces more than samples_per_device readings in one window the oldest
+    are overwritten and counted in `dropped`.
+    """
+
+    def __init__(self, max_devices: int, max_bytes: int, max_age: float, samples_per_device: int):
+        super().__init__(max_devices, max_bytes, max_age)
+        self.samples_per_device = max(1, samples_per_device)
+        self.dropped = 0
+
+    def _merge(self, buf: Dict, device: str, telemetry: Dict, ts: Optional[int]):
+        ring: Optional[Deque[Tuple[int, Dict]]] = buf.get(device)
+        if ring is None:
+            ring = buf[device] = deque(maxlen=self.samples_per_device)
+        elif len(ring) == ring.maxlen:
+            self.dropped += 1
+        ring.append((int(time.time() * 1000) if ts is None else ts, telemetry))
+
+    def to_gateway(self, batch: Dict, ts_ms: int) -> Dict[str, List[Dict]]:
+        return {dev: [{"ts": ts, "values": values} for ts, values in ring]
+                for dev, ring in batch.items()}
+
+class _Agg:
+    """Running min/max/sum/count/last of one numeric key over a flush window."""
+
+    __slots__ = ("min", "max", "sum", "count", "last")
+
+    def __init__(self, v):
+        self.min = self.max = self.sum = self.last = v
+        self.count = 1
+
+    def add(self, v):
+        if v < self.min:
+            self.min = v
+        elif v > self.max:
+            self.max = v
+        self.sum += v
+        self.count += 1
+        self.last = v
+
+class AggregateBatcher(TelemetryBatcher):
+    """
+    Summarising variant: each numeric key keeps a running
+    min/max/sum/count/last over the flush window (O(1) memory per key,
+    however fast the sensor publishes) and is sent as <key>_min, _max, _mean,
+    _count and _last. Non-numeric values (bools, strings, arrays, nested
+    objects) are passed through last-write-wins under their own key.
+
+    The buffer no longer grows with the reading rate, so max_bytes is not
+    applied: a window closes on max_age or max_devices only. A summary covers
+    the whole window, so it is stamped at flush time whatever ts the readings
+    had.
+    """
+
+    def add(self, device: str, telemetry: Dict, size: int, ts: Optional[int] = None):
+        super().add(device, telemetry, 0, ts)
+
+    def _merge(self, buf: Dict, device: str, telemetry: Dict, ts: Optional[int]):
+        aggs = buf.get(device)
+        if aggs is None:
+            aggs = buf[device] = {}
+        for key, v in telemetry.items():
+            if type(v) is not int and type(v) is not float:
+                aggs[key] = v
+                continue
+            a = aggs.get(key)
+            if type(a) is _Agg:
+                a.add(v)
+            else:
+                aggs[key] = _Agg(v)
+
+    def to_gateway(self, batch: Dict, ts_ms: int) -> Dict[str, List[Dict]]:
+        msg: Dict[str, List[Dict]] = {}
+        for dev, aggs in batch.items():
+            values = {}
+            for key, a in aggs.items():
+                if type(a) is not _Agg:
+                    values[key] = a
+                    continue
+                values[key + "_min"] = a.min
+                values[key + "_max"] = a.max
+                values[key + "_mean"] = a.sum / a.count
+                values[key + "_count"] = a.count
+                values[key + "_last"] = a.last
+            msg[dev] = [{"ts": ts_ms, "values": values}]
+        return msg
+
+def _json_dumps(obj) -> bytes:
+    return json.dumps(obj).encode()
+
+def split_gateway_payload(msg: Dict[str, List[Dict]], max_bytes: int,
+                          dumps: Callable[[object], bytes] = _json_dumps) -> List[bytes]:
+    """
+    Serialise a v1/gateway/telemetry message into one or more JSON documents
+    of at most max_bytes each, splitting on device boundaries. A single device
+    that is larger than max_bytes on its own is sent as its own message.
+    """
+    chunks: List[bytes] = []
+    parts: List[bytes] = []
+    size = 2  # "{}"
+    for dev, entries in msg.items():
+        part = dumps(dev) + b":" + dumps(entries)
+        extra = len(part) + (1 if parts else 0)  # ","
+        if parts and size + extra > max_bytes:
+            chunks.append(b"{" + b",".join(parts) + b"}")
+            parts, size = [], 2
+            extra = len(part)
+        parts.append(part)
+        size += extra
+    if parts:
+        chunks.append(b"{" + b",".join(parts) + b"}")
+    return chunks
@@ -0,0 +1,103 @@
+"""
+Payload codec benchmark over a realistic mix of sensor payloads.
+
+Compares the original try_parse_payload() + json.dumps against
+payload_codec (numeric fast path, orjson when installed, msgpack/cbor when
+installed). Reports messages/sec and allocations per message.
+
+    python bench_codecs.py --messages 200000
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+
+import payload_codec
+from payload_codec import cbor2, msgpack, parse_text
+
+def try_parse_payload(payload: bytes):
+    # Baseline: the parser bridge.py used before payload_codec.py
+    s = payload.decode(errors="ignore").strip()
+    if s.startswith("{") and s.endswith("}"):
+        try:
+            return json.loads(s)
+        except Exception:
+            pass
+    try:
+        if "." in s:
+            return float(s)
+        return int(s)
+    except Exception:
+        return s
+
+def make_mix(n: int, rng: random.Random):
+    """~ what iot-lab-mqtt produces plus some vendor JSON and junk."""
+    out = []
+    for _ in range(n):
+        r = rng.random()
+        if r < 0.55:
+            out.append(f"{20 + rng.random() * 5:.2f}".encode())              # temperature/humidity
+        elif r < 0.80:
+            out.append(b"1" if rng.random() < 0.1 else b"0")                  # motion
+        elif r < 0.95:
+            out.append(json.dumps({"temp": round(rng.uniform(15, 30), 2),
+                                   "hum": round(rng.uniform(30, 70), 1),
+                                   "battery": rng.randint(0, 100)}).encode())
+        else:
+            out.append(rng.choice([b"online", b"ERR", b" 42 ", b"nan"]))
+    return out
+
+def run(name: str, fn, payloads, repeat: int):
+    # allocation count: tracemalloc-traced blocks allocated and kept per message
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    kept = [fn(p) for p in payloads]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(s.count_diff for s in after.compare_to(before, "filename") if s.count_diff > 0)
+    del kept
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for p in payloads:
+            fn(p)
+    dt = time.perf_counter() - t0
+    n = repeat * len(payloads)
+    print(f"{name:<34} {n / dt / 1e6:7.2f} M msg/s   {blocks / len(payloads):5.2f} allocs/msg")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=100000)
+    ap.add_argument("--repeat", type=int, default=5)
+    args = ap.parse_args()
+
+    rng = random.Random(1)
+    payloads = make_mix(args.messages, rng)
+    for p in payloads[:2000]:
+        a, b = try_parse_payload(p), parse_text(p)
+        assert a == b or (a != a and b != b), (p, a, b)
+
+    print(f"python {sys.version.split()[0]}, orjson={'yes' if payload_codec.USE_ORJSON else 'no'}, "
+          f"{len(payloads)} payloads x {args.repeat}")
+    print("-- parse")
+    run("try_parse_payload (baseline)", try_parse_payload, payloads, args.repeat)
+    run("payload_codec.parse_text", parse_text, payloads, args.repeat)
+
+    values = [parse_text(p) for p in payloads]
+    objs = [v if isinstance(v, dict) else {"value": v} for v in values]
+    if msgpack is not None:
+        packed = [msgpack.packb(o) for o in objs]
+        run("msgpack.unpackb", payload_codec.parse_msgpack, packed, args.repeat)
+    if cbor2 is not None:
+        packed = [cbor2.dumps(o) for o in objs]
+        run("cbor2.loads", payload_codec.parse_cbor, packed, args.repeat)
+
+    print("-- serialize (one gateway entry per message)")
+    entries = [[{"ts": 1700000000000, "values": o}] for o in objs]
+    run("json.dumps (baseline)", json.dumps, entries, args.repeat)
+    run("payload_codec.json_dumps", payload_codec.json_dumps, entries, args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,20 @@
 import os
-import json
+import sys
 import time
+import threading
+import multiprocessing as mp
 import paho.mqtt.client as mqtt
 
+from deadband import deadband_from_env
+from metrics import (SIZE_BUCKETS, Counter, Gauge, Histogram, metrics_from_env,
+                     paho_inflight)
+from batcher import AggregateBatcher, SampleBatcher, TelemetryBatcher, split_gateway_payload
+from payload_codec import DecodeError, get_decoder, json_dumps
+from routing import TopicRouter, load_routes
+from scaleout import Dispatcher, HashRing
+from publisher import publisher_from_env
+from store_forward import spool_from_env
+
 MOSQUITTO_HOST = os.getenv("MOSQUITTO_HOST", "mosquitto")
 MOSQUITTO_PORT = int(os.getenv("MOSQUITTO_PORT", "1883"))
 
@@ -11,72 +23,107 @@ TB_PORT = int(os.getenv("TB_PORT", "1883"))
 TB_GATEWAY_TOKEN = os.getenv("TB_GATEWAY_TOKEN", "").strip()
 
 SUB_TOPIC = os.getenv("SUB_TOPIC", "sensors/#")
-INTERVAL_FLUSH_SEC = float(os.getenv("INTERVAL_FLUSH_SEC", "1.0"))
+INTERVAL_FLUSH_SEC = float(os.getenv("INTERVAL_FLUSH_SEC", "1.0"))   # max age of a batch
+FLUSH_MAX_DEVICES = int(os.getenv("FLUSH_MAX_DEVICES", "500"))
+FLUSH_MAX_BYTES = int(os.getenv("FLUSH_MAX_BYTES", "32768"))          # raw payload bytes buffered
+MAX_PAYLOAD_BYTES = int(os.getenv("MAX_PAYLOAD_BYTES", "65536"))      # TB netty.max_payload_size
+
+# last: one value per device/key per flush, stamped at flush time
+# samples: every reading with its arrival ts (ring of SAMPLES_PER_DEVICE per device)
+# aggregate: <key>_min/_max/_mean/_count/_last per device/key over each flush window
+BATCH_MODE = os.getenv("BATCH_MODE", "last").strip().lower()
+SAMPLES_PER_DEVICE = int(os.getenv("SAMPLES_PER_DEVICE", "256"))
+
+# Topic -> (device, key) routes; empty = sensors/<type>/<room>/<sensor> -> <room>_<sensor> / <type>
+ROUTES_FILE = os.getenv("ROUTES_FILE", "")
+ROUTE_CACHE_SIZE = int(os.getenv("ROUTE_CACHE_SIZE", "65536"))
+
+# WORKERS > 1 runs one process per worker, each with its own batcher and TB connection.
+# hash: this process subscribes and fans out by consistent hash of device (keeps per-device order)
+# shared: every worker subscribes to $share/<SHARE_GROUP>/<SUB_TOPIC> (MQTT v5), no fan-out hop,
+#         but the broker round-robins so one device's readings are split across workers. Only
+#         BATCH_MODE=samples keeps them in order then (each sample carries its arrival ts), and
+#         per-process deadband state would diverge, so main() refuses other combinations.
+WORKERS = int(os.getenv("WORKERS", "1"))
+SCALE_MODE = os.getenv("SCALE_MODE", "hash").strip().lower()
+SHARE_GROUP = os.getenv("SHARE_GROUP", "tb_bridge")
+DISPATCH_BATCH = int(os.getenv("DISPATCH_BATCH", "256"))
+WORKER_QUEUE_BATCHES = int(os.getenv("WORKER_QUEUE_BATCHES", "1024"))
 
 if not TB_GATEWAY_TOKEN:
     raise SystemExit("TB_GATEWAY_TOKEN is required")
 
 # Buffer telemetry so we can batch-send multiple devices in one gateway message
-buffer = {}  # deviceName -> dict of telemetry kv
-last_flush = time.time()
-
-def topic_to_device_and_key(topic: str):
-    # sensors/<type>/<room>/<sensor>
-    parts = topic.split("/")
-    if len(parts) < 4:
-        return None, None
-
-    sensor_type = parts[1]
-    room = parts[2]
-    sensor = parts[3]
-
-    device_name = f"{room}_{sensor}"   # ex: livingroom_temp_livingroom_01
-    key = sensor_type                  # ex: temperature/humidity/motion
-    return device_name, key
-
-def try_parse_payload(payload: bytes):
-    s = payload.decode(errors="ignore").strip()
-    # If it's JSON already, pass through (expect {"temp":22.1} etc.)
-    if s.startswith("{") and s.endswith("}"):
-        try:
-            return json.loads(s)
-        except Exception:
-            pass
-    # Otherwise try float/int; else string
-    try:
-        if "." in s:
-            return float(s)
-        return int(s)
-    except Exception:
-        return s
-
-def flush(tb_client: mqtt.Client):
-    global buffer, last_flush
-    if not buffer:
+if BATCH_MODE == "samples":
+    batcher = SampleBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC, SAMPLES_PER_DEVICE)
+elif BATCH_MODE == "aggregate":
+    batcher = AggregateBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC)
+else:
+    batcher = TelemetryBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC)
+
+routes = load_routes(ROUTES_FILE)
+router = TopicRouter(routes, ROUTE_CACHE_SIZE)
+# Report-by-exception (DEADBAND_FILE), applied per reading before batching.
+# Leave it off with BATCH_MODE=aggregate, or the window stats only see the
+# reported values.
+deadband = deadband_from_env()
+# Resolve every codec named in the routes up front (fails fast on a missing dependency)
+decoders = {r.get("codec", "text"): get_decoder(r.get("codec", "text")) for r in routes}
+
+# Metrics (METRICS_PORT); with WORKERS > 1 the supervisor serves METRICS_PORT
+# and worker i serves METRICS_PORT + 1 + i
+READINGS = Counter("tb_bridge_readings_total", "MQTT readings received").labels()
+UNROUTED = Counter("tb_bridge_unrouted_total", "Readings whose topic matched no route").labels()
+DECODE_ERRORS = Counter("tb_bridge_decode_errors_total", "Readings dropped because their codec couldn't decode them", ["codec"])
+SUPPRESSED = Counter("tb_bridge_deadband_suppressed_total", "Readings dropped by the deadband filter").labels()
+DISPATCHED = Counter("tb_bridge_dispatched_total", "Readings fanned out to workers").labels()
+BATCH_DEVICES = Histogram("tb_bridge_batch_devices", "Devices per flushed batch", buckets=SIZE_BUCKETS)
+FLUSH_SECONDS = Histogram("tb_bridge_flush_seconds", "Time to serialise a batch and hand it to paho")
+PUBLISHED = Counter("tb_bridge_published_messages_total", "Gateway messages published to ThingsBoard").labels()
+PUBLISHED_BYTES = Counter("tb_bridge_published_bytes_total", "Gateway payload bytes published").labels()
+PUBLISH_FAILURES = Counter("tb_bridge_publish_failures_total", "Publishes paho rejected, by rc", ["rc"])
+BUFFER_DEVICES = Gauge("tb_bridge_buffer_devices", "Devices in the open batch")
+SAMPLES_DROPPED = Counter("tb_bridge_samples_dropped_total",
+                          "Samples overwritten in a full per-device ring (BATCH_MODE=samples)")
+PAHO_INFLIGHT = Gauge("tb_bridge_paho_inflight", "Messages queued or unacknowledged in paho")
+SPOOL_PENDING = Gauge("tb_bridge_spool_pending", "Spooled messages not yet acknowledged by ThingsBoard")
+WORKER_QUEUE = Gauge("tb_bridge_worker_queue_batches", "Batches waiting in a worker queue", ["worker"])
+BUFFER_DEVICES.set_function(batcher.depth)
+SAMPLES_DROPPED.set_function(lambda: getattr(batcher, "dropped", 0))
+
+def flush(tb_client, batch: dict):
+    if not batch:
         return
 
+    t0 = time.perf_counter()
     ts = int(time.time() * 1000)
-    msg = {}
+    msg = batcher.to_gateway(batch, ts)
 
-    for dev, telemetry in buffer.items():
-        msg[dev] = [{
-            "ts": ts,
-            "values": telemetry
-        }]
+    for payload in split_gateway_payload(msg, MAX_PAYLOAD_BYTES, json_dumps):
+        res = tb_client.publish("v1/gateway/telemetry", payload, qos=1)
+        if res.rc != 0:
+            PUBLISH_FAILURES.labels(res.rc).inc()
+            continue
+        PUBLISHED.inc()
+        PUBLISHED_BYTES.inc(len(payload))
 
-    payload = json.dumps(msg)
-    tb_client.publish("v1/gateway/telemetry", payload, qos=1)
-    buffer = {}
-    last_flush = time.time()
+    BATCH_DEVICES.observe(len(batch))
+    FLUSH_SECONDS.observe(time.perf_counter() - t0)
 
 
-def on_mosq_message(client, userdata, msg):
-    global buffer, last_flush
-    device, key = topic_to_device_and_key(msg.topic)
+def handle_message(topic: str, payload: bytes):
+    READINGS.inc()
+    device, key, codec = router.route(topic)
     if not device:
+        UNROUTED.inc()
         return
 
-    val = try_parse_payload(msg.payload)
+    try:
+        val = decoders[codec](payload)
+    except DecodeError:
+        # one bad payload must not kill paho's network thread (or a worker)
+        DECODE_ERRORS.labels(codec).inc()
+        return
 
     # If sensor already publishes JSON object, merge it
     if isinstance(val, dict):
@@ -84,14 +131,38 @@ def on_mosq_message(client, userdata, msg):
     else:
         telemetry = {key: val}
 
-    buffer.setdefault(device, {}).update(telemetry)
+    if deadband is not None:
+        telemetry = deadband.filter(device, telemetry)
+        if not telemetry:
+            SUPPRESSED.inc()
+            return
 
-def main():
+    batcher.add(device, telemetry, len(payload) + len(device) + len(key))
+
+def on_mosq_message(client, userdata, msg):
+    handle_message(msg.topic, msg.payload)
+
+def connect_tb():
     # Connect to ThingsBoard MQTT (Gateway token is MQTT username)
     tb = mqtt.Client()
     tb.username_pw_set(TB_GATEWAY_TOKEN)
+    # Optional disk spool (SPOOL_DIR) so a ThingsBoard outage doesn't lose data;
+    # without one, a bounded in-flight window and queue (PUBLISH_*)
+    spool = spool_from_env(tb)
+    PAHO_INFLIGHT.set_function(lambda: paho_inflight(tb))
+    if spool is not None:
+        SPOOL_PENDING.set_function(lambda: spool.pending)
+        publisher = spool
+    else:
+        publisher = publisher_from_env(tb)
+        publisher.export("tb_bridge")
     tb.connect(TB_HOST, TB_PORT, 60)
     tb.loop_start()
+    return tb, publisher
+
+def run_single():
+    metrics_from_env()
+    tb, publisher = connect_tb()
 
     # Connect to Mosquitto
     mosq = mqtt.Client()
@@ -101,9 +172,80 @@ def main():
     mosq.loop_start()
 
     while True:
-        time.sleep(0.2)
-        if time.time() - last_flush >= INTERVAL_FLUSH_SEC:
-            flush(tb)
+        flush(publisher, batcher.next_batch())
+
+def consume_queue(q):
+    for batch in iter(q.get, None):
+        for topic, payload in batch:
+            handle_message(topic, payload)
+
+def run_worker(index: int, q):
+    # each worker needs its own spool directory
+    if os.getenv("SPOOL_DIR"):
+        os.environ["SPOOL_DIR"] = os.path.join(os.environ["SPOOL_DIR"], f"worker-{index}")
+    metrics_from_env(offset=1 + index)
+    tb, publisher = connect_tb()
+
+    if q is None:
+        mosq = mqtt.Client(client_id=f"tb_bridge_{SHARE_GROUP}_{index}", protocol=mqtt.MQTTv5)
+        mosq.on_message = on_mosq_message
+        mosq.connect(MOSQUITTO_HOST, MOSQUITTO_PORT, 60)
+        mosq.subscribe(f"$share/{SHARE_GROUP}/{SUB_TOPIC}")
+        mosq.loop_start()
+    else:
+        threading.Thread(target=consume_queue, args=(q,), name="consume", daemon=True).start()
+
+    print(f"[bridge] worker {index} started ({SCALE_MODE})", flush=True)
+    while True:
+        flush(publisher, batcher.next_batch())
+
+def run_supervisor():
+    queues = [mp.Queue(maxsize=WORKER_QUEUE_BATCHES) for _ in range(WORKERS)] if SCALE_MODE == "hash" else [None] * WORKERS
+    procs = [mp.Process(target=run_worker, args=(i, q), name=f"worker-{i}", daemon=True)
+             for i, q in enumerate(queues)]
+    for p in procs:
+        p.start()
+
+    metrics_from_env()
+    if SCALE_MODE == "hash":
+        for i, q in enumerate(queues):
+            WORKER_QUEUE.set_function(q.qsize, i)
+        dispatcher = Dispatcher(queues, HashRing(WORKERS, cache_size=ROUTE_CACHE_SIZE),
+                                lambda topic: router.route(topic)[0], batch_size=DISPATCH_BATCH)
+        mosq = mqtt.Client()
+
+        def on_message(client, userdata, msg):
+            DISPATCHED.inc()
+            dispatcher.submit(msg.topic, msg.payload)
+
+        mosq.on_message = on_message
+        mosq.connect(MOSQUITTO_HOST, MOSQUITTO_PORT, 60)
+        mosq.subscribe(SUB_TOPIC)
+        mosq.loop_start()
+
+    print(f"[bridge] {WORKERS} workers, mode={SCALE_MODE}", flush=True)
+    # If any worker dies, exit and let the container restart everything
+    while all(p.is_alive() for p in procs):
+        time.sleep(1.0)
+    dead = [p.name for p in procs if not p.is_alive()]
+    print(f"[bridge] worker(s) exited: {', '.join(dead)}; shutting down", flush=True)
+    for p in procs:
+        p.terminate()
+    sys.exit(1)
+
+def main():
+    if WORKERS > 1:
+        if SCALE_MODE not in ("hash", "shared"):
+            raise SystemExit(f"SCALE_MODE must be hash or shared, got {SCALE_MODE!r}")
+        # shared splits a device across workers: flush-time stamps (last) and
+        # per-worker windows (aggregate) or deadband state would break its order
+        if SCALE_MODE == "shared" and BATCH_MODE != "samples":
+            raise SystemExit(f"SCALE_MODE=shared needs BATCH_MODE=samples, got {BATCH_MODE!r}; use SCALE_MODE=hash")
+        if SCALE_MODE == "shared" and deadband is not None:
+            raise SystemExit("SCALE_MODE=shared can't be used with DEADBAND_FILE; use SCALE_MODE=hash")
+        run_supervisor()
+    else:
+        run_single()
 
 if __name__ == "__main__":
     main()
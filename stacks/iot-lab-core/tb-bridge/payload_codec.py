@@ -0,0 +1,128 @@
+import json
+import os
+import re
+from typing import Any, Callable, Dict
+
+# Optional accelerators / binary formats; the bridge works without them.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+# JSON_LIB: auto (orjson if installed) | orjson | json
+JSON_LIB = os.getenv("JSON_LIB", "auto").strip().lower()
+USE_ORJSON = orjson is not None and JSON_LIB in ("auto", "orjson")
+if JSON_LIB == "orjson" and orjson is None:
+    raise SystemExit("JSON_LIB=orjson but orjson is not installed")
+
+# Same acceptance rules as the old float()/int() fallback: a '.' makes it a
+# float, otherwise it must be a plain integer. Checking the shape first means
+# the common cases never raise and catch an exception.
+_FLOAT_RE = re.compile(rb"[+-]?(?:\d+\.\d*|\.\d+)(?:[eE][+-]?\d+)?")
+
+_WS = b" \t\r\n"
+
+if USE_ORJSON:
+    json_loads = orjson.loads
+
+    def json_dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj)
+else:
+    def json_loads(b: bytes) -> Any:
+        # json.loads(bytes) sniffs the encoding first; decoding ourselves is cheaper
+        return json.loads(b.decode(errors="ignore"))
+
+    def json_dumps(obj: Any) -> bytes:
+        return json.dumps(obj).encode()
+
+def parse_text(payload: bytes):
+    """
+    Decode a text payload: JSON object, int, float or string.
+    Works on bytes and only decodes to str when the value is a string.
+    """
+    b = payload.strip(_WS)
+    if not b:
+        return ""
+    first = b[0]
+    if first == 0x7B:  # '{'
+        if b[-1] == 0x7D:  # '}'
+            try:
+                return json_loads(b)
+            except ValueError:
+                pass
+        return b.decode(errors="ignore")
+
+    digits = b[1:] if first == 0x2D or first == 0x2B else b  # '-' / '+'
+    if digits.isdigit():
+        return int(b)
+    if digits.find(b".") >= 0:
+        # "22.53": bytes.isdigit() on the rest is much cheaper than a regex
+        if digits.replace(b".", b"", 1).isdigit() or _FLOAT_RE.fullmatch(b):
+            return float(b)
+    return b.decode(errors="ignore")
+
+class DecodeError(ValueError):
+    """A payload its route's codec can't turn into JSON-serialisable telemetry."""
+
+_JSON_SCALARS = (str, int, float, bool, type(None))
+
+def _check_json(v):
+    # msgpack/cbor can carry bytes, non-string map keys, tags, datetimes ...
+    # that the gateway message can't hold; refuse them here, per message,
+    # rather than fail the whole batch in json_dumps() at flush time.
+    if isinstance(v, int) and not isinstance(v, bool) and not -(1 << 63) <= v < (1 << 64):
+        raise DecodeError("integer out of 64-bit range")  # CBOR bignums; orjson refuses them
+    if isinstance(v, _JSON_SCALARS):
+        return
+    if isinstance(v, list):
+        for x in v:
+            _check_json(x)
+        return
+    if isinstance(v, dict):
+        for k, x in v.items():
+            if not isinstance(k, str):
+                raise DecodeError(f"non-string key {k!r}")
+            _check_json(x)
+        return
+    raise DecodeError(f"{type(v).__name__} value is not JSON serialisable")
+
+def parse_msgpack(payload: bytes):
+    try:
+        val = msgpack.unpackb(payload, raw=False)
+    except Exception as e:
+        raise DecodeError(f"msgpack: {e!r}") from e
+    _check_json(val)
+    return val
+
+def parse_cbor(payload: bytes):
+    try:
+        val = cbor2.loads(payload)
+    except Exception as e:
+        raise DecodeError(f"cbor: {e!r}") from e
+    _check_json(val)
+    return val
+
+_DECODERS: Dict[str, Callable[[bytes], Any]] = {
+    "text": parse_text,
+    "json": parse_text,
+    "msgpack": parse_msgpack,
+    "cbor": parse_cbor,
+}
+
+def get_decoder(name: str) -> Callable[[bytes], Any]:
+    name = (name or "text").lower()
+    if name not in _DECODERS:
+        raise ValueError(f"unknown codec {name!r} (expected one of {', '.join(_DECODERS)})")
+    if name == "msgpack" and msgpack is None:
+        raise SystemExit("a route uses codec 'msgpack' but msgpack is not installed")
+    if name == "cbor" and cbor2 is None:
+        raise SystemExit("a route uses codec 'cbor' but cbor2 is not installed")
+    return _DECODERS[name]
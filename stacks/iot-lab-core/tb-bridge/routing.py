@@ -0,0 +1,108 @@
+import json
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+# Same mapping the bridge always used: sensors/<type>/<room>/<sensor>[/...]
+DEFAULT_ROUTES = [
+    {"pattern": "sensors/+type/+room/+sensor/#", "device": "{room}_{sensor}", "key": "{type}"},
+]
+
+_MISS = (None, None, None)
+
+class _Node:
+    __slots__ = ("children", "plus", "hash_routes", "routes")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.plus: Optional["_Node"] = None
+        self.hash_routes: List[int] = []   # routes ending in '#' here
+        self.routes: List[int] = []        # routes ending exactly here
+
+class TopicRouter:
+    """
+    Maps MQTT topics to (device name, telemetry key) through a list of routes.
+
+    A route is {"pattern", "device", "key"} plus an optional "codec"
+    (payload format name, default "text"). Patterns use MQTT wildcards;
+    a '+' level may carry a name ('+room') that the templates can use as
+    {room}. A trailing '#' matches zero or more levels and is available as
+    {#}. Levels are also available positionally as {0}, {1}, ...
+
+    Patterns are compiled into a trie once. Results are cached per topic in a
+    bounded LRU (functools.lru_cache), so for a steady set of sensors the
+    per-message cost is a single cache lookup. When several routes match, the
+    one listed first wins.
+    """
+
+    def __init__(self, routes: List[Dict], cache_size: int = 65536):
+        self.routes = routes
+        self.root = _Node()
+        self.names: List[Dict[str, int]] = []   # per route: '+name' -> level index
+        self.hash_at: List[Optional[int]] = []  # per route: level where '#' starts
+        for idx, r in enumerate(routes):
+            self._insert(r["pattern"], idx)
+        self.route = lru_cache(maxsize=cache_size)(self._resolve)
+
+    def _insert(self, pattern: str, idx: int):
+        node = self.root
+        names: Dict[str, int] = {}
+        hash_at: Optional[int] = None
+        levels = pattern.split("/")
+        for i, level in enumerate(levels):
+            if level == "#":
+                if i != len(levels) - 1:
+                    raise ValueError(f"route {pattern!r}: '#' must be the last level")
+                hash_at = i
+                break
+            if level.startswith("+"):
+                if len(level) > 1:
+                    names[level[1:]] = i
+                if node.plus is None:
+                    node.plus = _Node()
+                node = node.plus
+            else:
+                node = node.children.setdefault(level, _Node())
+        if hash_at is None:
+            node.routes.append(idx)
+        else:
+            node.hash_routes.append(idx)
+        self.names.append(names)
+        self.hash_at.append(hash_at)
+
+    def _match(self, node: _Node, levels: List[str], i: int) -> Optional[int]:
+        """Lowest-index route matching levels[i:] below node."""
+        best = min(node.hash_routes) if node.hash_routes else None
+        if i == len(levels):
+            if node.routes and (best is None or min(node.routes) < best):
+                best = min(node.routes)
+            return best
+        for child in (node.children.get(levels[i]), node.plus):
+            if child is not None:
+                idx = self._match(child, levels, i + 1)
+                if idx is not None and (best is None or idx < best):
+                    best = idx
+        return best
+
+    def _resolve(self, topic: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+        """(device, key, codec) or (None, None, None) if no route matches."""
+        levels = topic.split("/")
+        idx = self._match(self.root, levels, 0)
+        if idx is None:
+            return _MISS
+        r = self.routes[idx]
+        fields = {name: levels[i] for name, i in self.names[idx].items()}
+        if self.hash_at[idx] is not None:
+            fields["#"] = "/".join(levels[self.hash_at[idx]:])
+        try:
+            device, key = r["device"].format(*levels, **fields), r["key"].format(*levels, **fields)
+        except (IndexError, KeyError):
+            return _MISS
+        if not device or not key:
+            return _MISS
+        return device, key, r.get("codec", "text")
+
+def load_routes(path: str) -> List[Dict]:
+    if not path:
+        return DEFAULT_ROUTES
+    with open(path, "r") as f:
+        return json.load(f)
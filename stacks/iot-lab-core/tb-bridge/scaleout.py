@@ -0,0 +1,82 @@
+import bisect
+import hashlib
+import threading
+from functools import lru_cache
+from typing import Callable, List, Optional, Tuple
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class HashRing:
+    """
+    Consistent hash ring (md5, `vnodes` points per worker). A device always
+    maps to the same worker, and changing the worker count only moves about
+    1/N of the devices.
+    """
+
+    def __init__(self, nodes: int, vnodes: int = 160, cache_size: int = 65536):
+        points = []
+        for node in range(nodes):
+            for v in range(vnodes):
+                points.append((_hash(f"worker-{node}#{v}"), node))
+        points.sort()
+        self._hashes = [h for h, _ in points]
+        self._nodes = [n for _, n in points]
+        self.node_for = lru_cache(maxsize=cache_size)(self._node_for)
+
+    def _node_for(self, key: str) -> int:
+        # md5 only for its spread; results are cached per device
+        i = bisect.bisect(self._hashes, _hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+class Dispatcher:
+    """
+    Fans raw (topic, payload) messages out to worker queues by device.
+
+    Messages are grouped into small per-worker lists so the cost of pickling
+    and the queue hop is paid per batch, not per message. A list is sent when
+    it reaches batch_size or after max_delay seconds. Sends for one worker are
+    serialised under the lock, so per-device order is preserved end to end.
+    Worker queues are bounded: when a worker falls behind, put() blocks and
+    the backpressure reaches paho's network thread.
+    """
+
+    def __init__(self, queues: List, ring: HashRing,
+                 device_of: Callable[[str], Optional[str]],
+                 batch_size: int = 256, max_delay: float = 0.02):
+        self.queues = queues
+        self.ring = ring
+        self.device_of = device_of
+        self.batch_size = max(1, batch_size)
+        self.max_delay = max_delay
+        self.pending: List[List[Tuple[str, bytes]]] = [[] for _ in queues]
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._tick, name="dispatch", daemon=True)
+        self.thread.start()
+
+    def submit(self, topic: str, payload: bytes):
+        device = self.device_of(topic)
+        if not device:
+            return
+        i = self.ring.node_for(device)
+        with self.lock:
+            p = self.pending[i]
+            p.append((topic, payload))
+            if len(p) >= self.batch_size:
+                self.pending[i] = []
+                self.queues[i].put(p)
+
+    def _tick(self):
+        while not self.stop_event.wait(self.max_delay):
+            with self.lock:
+                for i, p in enumerate(self.pending):
+                    if p:
+                        self.pending[i] = []
+                        self.queues[i].put(p)
+
+    def close(self):
+        self.stop_event.set()
+        self.thread.join(timeout=1.0)
+        for q in self.queues:
+            q.put(None)
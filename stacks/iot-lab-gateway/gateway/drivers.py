@@ -0,0 +1,168 @@
+import abc
+import asyncio
+import os
+from typing import Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from env import env_int
+from metrics import Counter
+
+READINGS = Counter("gateway_readings_total", "Device readings handed to the batcher, by driver", ["driver"])
+UNROUTED = Counter("gateway_unrouted_total", "MQTT readings whose topic matched no route").labels()
+DECODE_ERRORS = Counter("gateway_decode_errors_total", "MQTT readings dropped because their codec couldn't decode them", ["codec"])
+MESSAGE_ERRORS = Counter("gateway_message_errors_total", "MQTT readings dropped because handling them raised").labels()
+
+# The protocol libraries are imported in run(), so a gateway only needs the
+# ones for the drivers it actually runs.
+
+class Driver(abc.ABC):
+    """
+    One protocol feeding the gateway. run() is a coroutine on the gateway's
+    event loop that lasts as long as the driver; readings go through emit(),
+    which may be called from any thread, with the reading's timestamp (epoch
+    ms) when the protocol has one. A driver built on a blocking library
+    (paho's network loop, pymodbus, bacpypes' run()) keeps that library on a
+    thread of its own via gateway.in_thread() or the loop's executor.
+    """
+
+    name = ""
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self._readings = READINGS.labels(self.name)
+
+    def emit(self, device: str, telemetry: Dict, size: int = 0, ts: Optional[int] = None):
+        self._readings.inc()
+        self.gateway.emit(device, telemetry, size, ts)
+
+    @abc.abstractmethod
+    async def run(self):
+        """Run until the driver fails; cancelled on shutdown."""
+
+    def close(self):
+        """Stop the driver's threads; called once on shutdown."""
+
+class MqttDriver(Driver):
+    """
+    The core bridge's subscriber: routes and decodes each message from
+    Mosquitto on paho's network thread. Settings as for tb-bridge/bridge.py
+    (MOSQUITTO_HOST/PORT, SUB_TOPIC, ROUTES_FILE, ROUTE_CACHE_SIZE); the
+    WORKERS scale-out is not available here.
+    """
+
+    name = "mqtt"
+
+    def __init__(self, gateway):
+        super().__init__(gateway)
+        self.client: Optional[mqtt.Client] = None
+
+    async def run(self):
+        from payload_codec import DecodeError, get_decoder
+        from routing import TopicRouter, load_routes
+
+        host = os.getenv("MOSQUITTO_HOST", "mosquitto")
+        port = env_int("MOSQUITTO_PORT", 1883)
+        topic = os.getenv("SUB_TOPIC", "sensors/#")
+        routes = load_routes(os.getenv("ROUTES_FILE", ""))
+        router = TopicRouter(routes, env_int("ROUTE_CACHE_SIZE", 65536))
+        # Resolve every codec named in the routes up front (fails fast on a missing dependency)
+        decoders = {r.get("codec", "text"): get_decoder(r.get("codec", "text")) for r in routes}
+        logged = set()   # exception types already logged by on_message
+
+        def on_connect(client, userdata, flags, rc):
+            # (re)subscribe on every connect so a broker restart doesn't lose the subscription
+            client.subscribe(topic)
+
+        def on_message(client, userdata, msg):
+            # paho re-raises callback exceptions, which would end loop_forever()
+            # and with it the whole gateway: one bad message is dropped instead
+            codec = None
+            try:
+                device, key, codec = router.route(msg.topic)
+                if not device:
+                    UNROUTED.inc()
+                    return
+                val = decoders[codec](msg.payload)
+                # If sensor already publishes JSON object, merge it
+                telemetry = val if isinstance(val, dict) else {key: val}
+                self.emit(device, telemetry, len(msg.payload) + len(device) + len(key))
+            except DecodeError:
+                DECODE_ERRORS.labels(codec).inc()
+            except Exception as e:
+                MESSAGE_ERRORS.inc()
+                if type(e) not in logged:
+                    logged.add(type(e))
+                    print(f"[gateway] mqtt: dropping message on {msg.topic}: {e!r}", flush=True)
+
+        self.client = mqtt.Client()
+        self.client.on_connect = on_connect
+        self.client.on_message = on_message
+        print(f"[gateway] mqtt: subscribing to {topic} on {host}:{port}", flush=True)
+        self.client.connect(host, port, 60)
+        await self.gateway.in_thread(self.client.loop_forever, "mqtt")
+
+    def close(self):
+        if self.client is not None:
+            self.client.disconnect()
+
+class ModbusDriver(Driver):
+    """
+    The windfarm poller (poller_multi.Windfarm, same WINDMILLS / POLL_* /
+    REGISTER_MAP_FILE settings). Each cycle's blocking pymodbus reads run on
+    the loop's executor; the loop itself sleeps until the next target is due.
+    Without WINDMILLS the single-turbine poller.py settings are used.
+    """
+
+    name = "modbus"
+
+    def __init__(self, gateway):
+        super().__init__(gateway)
+        self.farm = None
+
+    async def run(self):
+        from poller_multi import windfarm_from_env
+
+        # the gateway applies DEADBAND_FILE to every driver's readings
+        self.farm = windfarm_from_env(deadband=None)
+        loop = asyncio.get_running_loop()
+        while True:
+            result = await loop.run_in_executor(None, self.farm.cycle)
+            if result is not None:
+                ts_ms, telemetry = result
+                for name, values in telemetry.items():
+                    self.emit(name, values, ts=ts_ms)
+            await asyncio.sleep(self.farm.next_wakeup())
+
+    def close(self):
+        if self.farm is not None:
+            self.farm.close()
+
+class BacnetDriver(Driver):
+    """
+    The BACnet bridge's client (bacnet_client, same BACNET_TARGETS / POLL_SECONDS
+    / COV_MODE / DISCOVER_* settings). bacpypes' run() keeps its own thread;
+    every message a poll cycle or COV flush produces is emitted device by device.
+    """
+
+    name = "bacnet"
+
+    async def run(self):
+        import bacnet_client
+        from bacpypes.core import deferred, run
+
+        bacnet_client.setup(self.publish)
+        deferred(bacnet_client.start)
+        # signals belong to the gateway's event loop, not bacpypes
+        await self.gateway.in_thread(lambda: run(sigterm=None, sigusr1=None), "bacnet")
+
+    def publish(self, gateway_payload: Dict[str, List[Dict]]):
+        for name, entries in gateway_payload.items():
+            for entry in entries:
+                self.emit(name, entry["values"], ts=entry["ts"])
+
+    def close(self):
+        from bacpypes.core import stop
+        stop()
+
+DRIVERS = {d.name: d for d in (MqttDriver, ModbusDriver, BacnetDriver)}
@@ -0,0 +1,216 @@
+import asyncio
+import os
+import signal
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional
+
+import paho.mqtt.client as mqtt
+
+from batcher import AggregateBatcher, SampleBatcher, TelemetryBatcher, split_gateway_payload
+from deadband import deadband_from_env
+from drivers import DRIVERS, Driver
+from env import env_float, env_int
+from metrics import SIZE_BUCKETS, Counter, Gauge, Histogram, metrics_from_env, paho_inflight
+from payload_codec import json_dumps
+from publisher import publisher_from_env
+from store_forward import spool_from_env
+
+TB_HOST = os.getenv("TB_HOST", "thingsboard")
+TB_PORT = env_int("TB_MQTT_PORT", 1883)
+TB_GATEWAY_TOKEN = os.getenv("TB_GATEWAY_TOKEN", "").strip()
+
+# Protocols to run in this process, comma separated: mqtt, modbus, bacnet.
+# Each driver reads the same settings as the stand-alone script it replaces.
+GATEWAY_DRIVERS = os.getenv("GATEWAY_DRIVERS", "mqtt,modbus,bacnet")
+
+INTERVAL_FLUSH_SEC = env_float("INTERVAL_FLUSH_SEC", 1.0)   # max age of a batch
+FLUSH_MAX_DEVICES = env_int("FLUSH_MAX_DEVICES", 500)
+FLUSH_MAX_BYTES = env_int("FLUSH_MAX_BYTES", 32768)          # raw payload bytes buffered
+MAX_PAYLOAD_BYTES = env_int("MAX_PAYLOAD_BYTES", 65536)      # TB netty.max_payload_size
+BATCH_MODE = os.getenv("BATCH_MODE", "last").strip().lower()  # last | samples | aggregate
+SAMPLES_PER_DEVICE = env_int("SAMPLES_PER_DEVICE", 256)
+
+# Size charged against FLUSH_MAX_BYTES per value when a driver doesn't know
+# the raw size of a reading (polled registers and points)
+BYTES_PER_VALUE = 16
+
+# On shutdown, how long to let the flush in progress finish before releasing
+# a publish that is waiting for queue room (PUBLISH_OVERLOAD=block)
+STOP_FLUSH_SEC = 5.0
+
+SUPPRESSED = Counter("gateway_deadband_suppressed_total", "Readings dropped by the deadband filter").labels()
+BATCH_DEVICES = Histogram("gateway_batch_devices", "Devices per flushed batch", buckets=SIZE_BUCKETS)
+FLUSH_SECONDS = Histogram("gateway_flush_seconds", "Time to serialise a batch and hand it to paho")
+PUBLISHED = Counter("gateway_published_messages_total", "Gateway messages published to ThingsBoard").labels()
+PUBLISHED_BYTES = Counter("gateway_published_bytes_total", "Gateway payload bytes published").labels()
+PUBLISH_FAILURES = Counter("gateway_publish_failures_total", "Publishes paho rejected, by rc", ["rc"])
+BUFFER_DEVICES = Gauge("gateway_buffer_devices", "Devices in the open batch")
+SAMPLES_DROPPED = Counter("gateway_samples_dropped_total",
+                          "Samples overwritten in a full per-device ring (BATCH_MODE=samples)")
+PAHO_INFLIGHT = Gauge("gateway_paho_inflight", "Messages queued or unacknowledged in paho")
+SPOOL_PENDING = Gauge("gateway_spool_pending", "Spooled messages not yet acknowledged by ThingsBoard")
+
+def make_batcher() -> TelemetryBatcher:
+    if BATCH_MODE == "samples":
+        return SampleBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC, SAMPLES_PER_DEVICE)
+    if BATCH_MODE == "aggregate":
+        return AggregateBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC)
+    return TelemetryBatcher(FLUSH_MAX_DEVICES, FLUSH_MAX_BYTES, INTERVAL_FLUSH_SEC)
+
+class Gateway:
+    """
+    One ThingsBoard connection and one batcher shared by every driver.
+
+    Drivers emit() device readings as they arrive; the deadband filter (if
+    any) runs once here for all of them and the batcher merges them. The
+    flush loop waits for the batcher's size/age trigger on an executor thread
+    and publishes each batch as one v1/gateway/telemetry message (split at
+    MAX_PAYLOAD_BYTES), whichever protocols the devices in it came from.
+    """
+
+    def __init__(self, batcher: TelemetryBatcher, deadband=None):
+        self.batcher = batcher
+        self.deadband = deadband
+        # drivers emit from their own threads; the filter's state isn't locked
+        self._deadband_lock = threading.Lock()
+        self.stop = threading.Event()
+        # the flush loop's own thread, so shutdown can wait for the flush in progress
+        self._flusher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flush")
+        self._flushing: Optional[Future] = None
+        BUFFER_DEVICES.set_function(batcher.depth)
+        SAMPLES_DROPPED.set_function(lambda: getattr(batcher, "dropped", 0))
+
+        # Connect to ThingsBoard MQTT (Gateway token is MQTT username)
+        self.tb = mqtt.Client()
+        self.tb.username_pw_set(TB_GATEWAY_TOKEN)
+        # Optional disk spool (SPOOL_DIR) so a ThingsBoard outage doesn't lose data;
+        # without one, a bounded in-flight window and queue (PUBLISH_*)
+        self.spool = spool_from_env(self.tb)
+        PAHO_INFLIGHT.set_function(lambda: paho_inflight(self.tb))
+        if self.spool is not None:
+            SPOOL_PENDING.set_function(lambda: self.spool.pending)
+            self.publisher = self.spool
+        else:
+            self.publisher = publisher_from_env(self.tb)
+            self.publisher.export("gateway")
+
+    def emit(self, device: str, telemetry: Dict, size: int = 0, ts: Optional[int] = None):
+        if self.deadband is not None:
+            with self._deadband_lock:
+                telemetry = self.deadband.filter(device, telemetry)
+            if not telemetry:
+                SUPPRESSED.inc()
+                return
+        self.batcher.add(device, telemetry, size or len(device) + BYTES_PER_VALUE * len(telemetry), ts)
+
+    def flush(self, batch: Dict):
+        if not batch:
+            return
+
+        t0 = time.perf_counter()
+        msg = self.batcher.to_gateway(batch, int(time.time() * 1000))
+        for payload in split_gateway_payload(msg, MAX_PAYLOAD_BYTES, json_dumps):
+            res = self.publisher.publish("v1/gateway/telemetry", payload, qos=1)
+            if res.rc != 0:
+                PUBLISH_FAILURES.labels(res.rc).inc()
+                continue
+            PUBLISHED.inc()
+            PUBLISHED_BYTES.inc(len(payload))
+
+        BATCH_DEVICES.observe(len(batch))
+        FLUSH_SECONDS.observe(time.perf_counter() - t0)
+
+    async def flush_loop(self):
+        while not self.stop.is_set():
+            # on its thread: next_batch() waits, and publish() may too (PUBLISH_OVERLOAD=block)
+            self._flushing = self._flusher.submit(lambda: self.flush(self.batcher.next_batch(self.stop)))
+            await asyncio.wrap_future(self._flushing)
+
+    def _stop_flush_loop(self):
+        """Wait for the flush loop's thread; next_batch() returns once stop is set."""
+        if self._flushing is not None and wait([self._flushing], STOP_FLUSH_SEC).not_done:
+            print(f"[gateway] flush still publishing after {STOP_FLUSH_SEC}s, releasing it", flush=True)
+            if self.spool is None:
+                self.publisher.close()
+        self._flusher.shutdown(wait=True)
+
+    async def in_thread(self, fn: Callable, name: str):
+        """Run a blocking fn (a library's own loop) on a daemon thread and wait for it."""
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def settle(result, exc):
+            if not done.done():
+                if exc is not None:
+                    done.set_exception(exc)
+                else:
+                    done.set_result(result)
+
+        def target():
+            try:
+                result = fn()
+            except Exception as e:
+                loop.call_soon_threadsafe(settle, None, e)
+            else:
+                loop.call_soon_threadsafe(settle, result, None)
+
+        threading.Thread(target=target, name=name, daemon=True).start()
+        return await done
+
+    async def _run_driver(self, driver: Driver):
+        try:
+            await driver.run()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"[gateway] {driver.name} driver failed: {e!r}", flush=True)
+            raise
+        raise RuntimeError(f"{driver.name} driver stopped")
+
+    async def run(self, drivers: List[Driver]):
+        """Run every driver and the flush loop until one of them fails or SIGTERM/SIGINT."""
+        loop = asyncio.get_running_loop()
+        main = asyncio.current_task()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, main.cancel)
+
+        print(f"[gateway] Connecting MQTT to {TB_HOST}:{TB_PORT} (ThingsBoard) ...", flush=True)
+        self.tb.connect(TB_HOST, TB_PORT, 60)
+        self.tb.loop_start()
+        print(f"[gateway] drivers: {', '.join(d.name for d in drivers)}, batch mode {BATCH_MODE}", flush=True)
+        try:
+            await asyncio.gather(self.flush_loop(), *(self._run_driver(d) for d in drivers))
+        except asyncio.CancelledError:
+            print("[gateway] shutting down", flush=True)
+        finally:
+            self.stop.set()
+            for d in drivers:
+                try:
+                    d.close()
+                except Exception as e:
+                    print(f"[gateway] closing {d.name}: {e!r}", flush=True)
+            self._stop_flush_loop()
+            # whatever was still buffered, now that nothing else is flushing
+            self.flush(self.batcher.swap())
+            self.publisher.close()
+            # disconnect first: loop_stop() waits on a network loop stuck on an unresponsive broker
+            self.tb.disconnect()
+            self.tb.loop_stop()
+
+def main():
+    if not TB_GATEWAY_TOKEN:
+        raise SystemExit("TB_GATEWAY_TOKEN is required")
+    names = [n.strip().lower() for n in GATEWAY_DRIVERS.split(",") if n.strip()]
+    unknown = [n for n in names if n not in DRIVERS]
+    if unknown or not names:
+        raise SystemExit(f"GATEWAY_DRIVERS must list some of {', '.join(DRIVERS)}, got {GATEWAY_DRIVERS!r}")
+
+    metrics_from_env()
+    # Report-by-exception (DEADBAND_FILE) for every driver's devices; None = publish every reading
+    gateway = Gateway(make_batcher(), deadband_from_env())
+    asyncio.run(gateway.run([DRIVERS[n](gateway) for n in names]))
+
+if __name__ == "__main__":
+    main()
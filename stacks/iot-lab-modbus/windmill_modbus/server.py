@@ -1,10 +1,11 @@
 import os
-import math
 import time
-import random
+import asyncio
 from threading import Thread
+from typing import Dict, List, Optional, Tuple
 
-from pymodbus.server.sync import StartTcpServer
+import numpy as np
+from pymodbus.server.sync import ModbusTcpServer
 from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext, ModbusSequentialDataBlock
 
 def env_float(name: str, default: float) -> float:
@@ -25,6 +26,20 @@ UNIT_ID = env_int("MODBUS_UNIT_ID", 1)
 
 WIND_BASE = env_float("WIND_BASE_MS", 8.0)   # base wind speed (m/s)
 WIND_GUST = env_float("WIND_GUST_MS", 4.0)   # gust amplitude (m/s)
+WIND_SPREAD = env_float("WIND_SPREAD_MS", 1.5)  # +/- per-turbine base wind offset (TURBINES > 1)
+
+# TURBINES > 1 hosts a whole farm in this process: unit IDs MODBUS_UNIT_ID,
+# MODBUS_UNIT_ID+1, ... on MODBUS_PORT, then on MODBUS_PORT+1 once a port has
+# UNITS_PER_PORT turbines (unit IDs only go up to 247).
+TURBINES = max(1, env_int("TURBINES", 1))
+UNITS_PER_PORT = env_int("UNITS_PER_PORT", 200)
+TICK_SEC = env_float("TICK_SEC", 1.0)
+
+# sync = pymodbus' threaded server (a thread per connection, physics on its own
+# thread); asyncio = every port, connection and the physics tick on one event
+# loop, for load tests with hundreds of concurrent pollers.
+SERVER_MODE = os.getenv("SERVER_MODE", "sync").strip().lower()
+LISTEN_BACKLOG = env_int("LISTEN_BACKLOG", 512)
 
 # Holding register addresses (0-based)
 REG_WIND_X100 = 0
@@ -39,88 +54,154 @@ BIT_RUNNING   = 0
 BIT_OVERSPEED = 1
 BIT_FAULT     = 2
 
-def clamp(v, lo, hi):
-    return max(lo, min(hi, v))
-
-def int16(v: int) -> int:
-    # pymodbus expects 0..65535; convert signed -> unsigned
-    return v & 0xFFFF
-
-def update_loop(context: ModbusServerContext):
-    t0 = time.time()
-    temp_c = 22.0
-    fault_code = 0
-
-    while True:
-        t = time.time() - t0
+def turbine_units(count: int, first_unit: int, units_per_port: int, first_port: int) -> List[Tuple[int, int]]:
+    """(port, unit_id) per turbine: unit IDs fill a port, then move to the next port."""
+    return [(first_port + i // units_per_port, first_unit + i % units_per_port) for i in range(count)]
+
+class TurbineFarm:
+    """
+    Vectorised physics for N turbines: the same wind / rpm / power-curve /
+    temperature / fault model as the original single-turbine loop, but each
+    quantity is one NumPy array and a tick is a handful of array operations
+    regardless of N. Turbines get their own base wind and gust phase so a
+    farm doesn't move in lockstep (a single turbine keeps WIND_BASE_MS and
+    phase 0, as before).
+    """
+
+    def __init__(self, n: int, wind_base: float, wind_gust: float, wind_spread: float, seed: Optional[int] = None):
+        self.n = n
+        self.rng = np.random.default_rng(seed)
+        if n == 1:
+            self.base = np.array([wind_base])
+            self.phase = np.zeros(1)
+        else:
+            self.base = wind_base + self.rng.uniform(-wind_spread, wind_spread, n)
+            self.phase = self.rng.uniform(0.0, 2 * np.pi, n)
+        self.gust = wind_gust
+        self.temp_c = np.full(n, 22.0)
+        self.fault_code = np.zeros(n, dtype=np.int64)
+
+    def step(self, t: float) -> np.ndarray:
+        """Advance the model to time t; returns an (n, 6) array of register values."""
+        rng = self.rng
+        n = self.n
 
         # Wind model: base + sinusoid + random gust jitter
-        wind = WIND_BASE + (WIND_GUST * math.sin(t / 6.0)) + random.uniform(-0.7, 0.7)
-        wind = clamp(wind, 0.0, 30.0)
+        wind = self.base + self.gust * np.sin(t / 6.0 + self.phase) + rng.uniform(-0.7, 0.7, n)
+        wind = np.clip(wind, 0.0, 30.0)
 
-        # Simple turbine model:
         # rpm roughly proportional to wind until capped; overspeed if too high
-        rpm = int(clamp(wind * 35.0 + random.uniform(-5, 5), 0, 2000))
+        rpm = np.clip(wind * 35.0 + rng.uniform(-5, 5, n), 0, 2000).astype(np.int64)
 
-        # Power curve (very simplified): ~wind^3, capped
-        power_kw = clamp((wind ** 3) * 0.02, 0.0, 250.0)  # cap at 250 kW
-        power_kw = power_kw + random.uniform(-1.0, 1.0)
-        power_kw = clamp(power_kw, 0.0, 250.0)
+        # Power curve (very simplified): ~wind^3, capped at 250 kW
+        power_kw = np.clip(np.clip((wind ** 3) * 0.02, 0.0, 250.0) + rng.uniform(-1.0, 1.0, n), 0.0, 250.0)
 
         # Temperature drift
-        temp_c += random.uniform(-0.05, 0.05)
-        temp_c = clamp(temp_c, -20.0, 60.0)
+        self.temp_c = np.clip(self.temp_c + rng.uniform(-0.05, 0.05, n), -20.0, 60.0)
 
         overspeed = rpm > 1750
         running = wind > 1.5
 
-        # Fault logic: persistent overspeed triggers fault
-        if overspeed and fault_code == 0 and random.random() < 0.15:
-            fault_code = 1001  # arbitrary
-        if fault_code != 0 and random.random() < 0.05:
-            fault_code = 0
-
-        status = 0
-        if running:
-            status |= (1 << BIT_RUNNING)
-        if overspeed:
-            status |= (1 << BIT_OVERSPEED)
-        if fault_code != 0:
-            status |= (1 << BIT_FAULT)
-
-        # Scale to integer registers
-        wind_x100 = int(round(wind * 100.0))
-        power_x10 = int(round(power_kw * 10.0))
-        temp_x10  = int(round(temp_c * 10.0))
-
-        # Write holding registers via slave context
-        slave = context[UNIT_ID]
-        slave.setValues(3, REG_WIND_X100, [wind_x100])      # 3 = holding registers
-        slave.setValues(3, REG_RPM,       [rpm])
-        slave.setValues(3, REG_POWER_X10, [power_x10])
-        slave.setValues(3, REG_TEMP_X10,  [int16(temp_x10)])
-        slave.setValues(3, REG_STATUS,    [status])
-        slave.setValues(3, REG_FAULT,     [fault_code])
-
-        time.sleep(1)
+        # Fault logic: persistent overspeed triggers fault, faults clear at random
+        fault = self.fault_code
+        fault[overspeed & (fault == 0) & (rng.random(n) < 0.15)] = 1001  # arbitrary
+        fault[(fault != 0) & (rng.random(n) < 0.05)] = 0
+
+        status = ((running.astype(np.int64) << BIT_RUNNING)
+                  | (overspeed.astype(np.int64) << BIT_OVERSPEED)
+                  | ((fault != 0).astype(np.int64) << BIT_FAULT))
+
+        regs = np.empty((n, 6), dtype=np.int64)
+        regs[:, REG_WIND_X100] = np.rint(wind * 100.0)
+        regs[:, REG_RPM] = rpm
+        regs[:, REG_POWER_X10] = np.rint(power_kw * 10.0)
+        regs[:, REG_TEMP_X10] = np.rint(self.temp_c * 10.0).astype(np.int64) & 0xFFFF  # signed -> unsigned
+        regs[:, REG_STATUS] = status
+        regs[:, REG_FAULT] = fault
+        return regs
+
+def update_loop(farm: TurbineFarm, slaves: List[ModbusSlaveContext], tick: float):
+    t0 = time.time()
+    while True:
+        started = time.time()
+        rows = farm.step(started - t0).tolist()
+        # One bulk write per turbine: the datastore replaces the whole slice in
+        # a single list assignment, so a reader never sees half a tick.
+        for slave, row in zip(slaves, rows):
+            slave.setValues(3, REG_WIND_X100, row)      # 3 = holding registers
+        time.sleep(max(0.0, tick - (time.time() - started)))
+
+async def tick_task(farm: TurbineFarm, slaves: List[ModbusSlaveContext], tick: float):
+    """
+    Asyncio version of update_loop. Requests are executed on the loop thread
+    as well, and there is no await between the first and the last setValues,
+    so a read sees either the previous tick or this one for the whole farm.
+    """
+    loop = asyncio.get_running_loop()
+    t0 = loop.time()
+    next_at = t0
+    while True:
+        rows = farm.step(loop.time() - t0).tolist()
+        for slave, row in zip(slaves, rows):
+            slave.setValues(3, REG_WIND_X100, row)
+        next_at += tick
+        now = loop.time()
+        if next_at < now:
+            next_at = now  # overran a tick: don't burst to catch up
+        await asyncio.sleep(next_at - now)
+
+def serve_sync(farm: TurbineFarm, slaves: List[ModbusSlaveContext], contexts: Dict[int, ModbusServerContext]):
+    Thread(target=update_loop, args=(farm, slaves, TICK_SEC), daemon=True).start()
+
+    servers = [ModbusTcpServer(context, address=(MODBUS_HOST, port), allow_reuse_address=True)
+               for port, context in contexts.items()]
+    for server in servers[1:]:
+        Thread(target=server.serve_forever, daemon=True).start()
+    servers[0].serve_forever()
+
+async def serve_asyncio(farm: TurbineFarm, slaves: List[ModbusSlaveContext], contexts: Dict[int, ModbusServerContext]):
+    # imported here: the asyncio server needs pyserial-asyncio, sync mode doesn't
+    from pymodbus.server.async_io import ModbusTcpServer as AsyncModbusTcpServer
+
+    loop = asyncio.get_running_loop()
+    servers = [AsyncModbusTcpServer(context, address=(MODBUS_HOST, port), allow_reuse_address=True,
+                                    backlog=LISTEN_BACKLOG, loop=loop)
+               for port, context in contexts.items()]
+    await asyncio.gather(tick_task(farm, slaves, TICK_SEC), *(s.serve_forever() for s in servers))
 
 def main():
-    # Holding register block length: at least up to REG_FAULT
-    hr_block = ModbusSequentialDataBlock(0, [0] * 64)
-
-    store = ModbusSlaveContext(
-        di=None,
-        co=None,
-        hr=hr_block,
-        ir=None,
-        zero_mode=True
-    )
-    context = ModbusServerContext(slaves={UNIT_ID: store}, single=False)
-
-    Thread(target=update_loop, args=(context,), daemon=True).start()
-
-    print(f"[modbus] Starting Modbus TCP server on {MODBUS_HOST}:{MODBUS_PORT}, unit_id={UNIT_ID}")
-    StartTcpServer(context, address=(MODBUS_HOST, MODBUS_PORT))
+    if SERVER_MODE not in ("sync", "asyncio"):
+        raise SystemExit(f"SERVER_MODE must be sync or asyncio, not {SERVER_MODE!r}")
+
+    if UNITS_PER_PORT < 1 or UNIT_ID + min(TURBINES, UNITS_PER_PORT) - 1 > 247:
+        raise SystemExit("MODBUS_UNIT_ID + UNITS_PER_PORT - 1 must stay within the Modbus unit ID range (1..247)")
+    layout = turbine_units(TURBINES, UNIT_ID, UNITS_PER_PORT, MODBUS_PORT)
+
+    slaves: List[ModbusSlaveContext] = []
+    contexts: Dict[int, Dict[int, ModbusSlaveContext]] = {}
+    for port, unit in layout:
+        # Holding register block length: at least up to REG_FAULT
+        store = ModbusSlaveContext(
+            di=None,
+            co=None,
+            hr=ModbusSequentialDataBlock(0, [0] * 64),
+            ir=None,
+            zero_mode=True
+        )
+        contexts.setdefault(port, {})[unit] = store
+        slaves.append(store)
+
+    farm = TurbineFarm(TURBINES, WIND_BASE, WIND_GUST, WIND_SPREAD)
+    port_contexts: Dict[int, ModbusServerContext] = {}
+    for port, units in contexts.items():
+        port_contexts[port] = ModbusServerContext(slaves=units, single=False)
+        print(f"[modbus] Starting Modbus TCP server ({SERVER_MODE}) on {MODBUS_HOST}:{port}, "
+              f"unit_id={min(units)}..{max(units)} ({len(units)} turbine(s))")
+
+    if SERVER_MODE == "asyncio":
+        asyncio.run(serve_asyncio(farm, slaves, port_contexts))
+    else:
+        serve_sync(farm, slaves, port_contexts)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,92 @@
+"""
+Decode throughput micro-benchmark.
+
+Compares the original hard-coded decode_values() against the register-map
+decoders in regmap.py on the same random register blocks.
+
+    python bench_decode.py --targets 200 --cycles 200
+"""
+import argparse
+import os
+import random
+import time
+from typing import Dict, List
+
+from regmap import DecodePlan, decode_blocks, load_points, np, plan_reads
+
+def uint16_to_int16(v: int) -> int:
+    return v - 65536 if v > 32767 else v
+
+def decode_values(regs: List[int]) -> Dict:
+    # Baseline: the decoder poller.py / poller_multi.py used before regmap.py
+    wind_ms = regs[0] / 100.0
+    rpm = regs[1]
+    power_kw = regs[2] / 10.0
+    temp_c = uint16_to_int16(regs[3]) / 10.0
+    status = regs[4]
+    fault_code = regs[5]
+
+    running = bool(status & (1 << 0))
+    overspeed = bool(status & (1 << 1))
+    fault = bool(status & (1 << 2))
+
+    return {
+        "wind_speed_ms": wind_ms,
+        "rpm": rpm,
+        "power_kw": power_kw,
+        "temp_c": temp_c,
+        "status_raw": status,
+        "running": running,
+        "overspeed": overspeed,
+        "fault": fault,
+        "fault_code": fault_code,
+    }
+
+DEFAULT_MAP = os.path.join(os.path.dirname(os.path.abspath(__file__)), "registers.json")
+
+def bench(name: str, fn, cycles: int, regs_per_cycle: int):
+    t0 = time.perf_counter()
+    for _ in range(cycles):
+        fn()
+    dt = time.perf_counter() - t0
+    total = cycles * regs_per_cycle
+    print(f"{name:<28} {dt * 1000 / cycles:8.3f} ms/cycle  {total / dt / 1e6:8.2f} M regs/s")
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--map", default=DEFAULT_MAP)
+    ap.add_argument("--targets", type=int, default=200)
+    ap.add_argument("--cycles", type=int, default=200)
+    args = ap.parse_args()
+
+    blocks = plan_reads(load_points(args.map))
+    plan = DecodePlan(blocks)
+    rng = random.Random(1)
+    rows = [[[rng.randrange(65536) for _ in range(b.count)] for b in blocks] for _ in range(args.targets)]
+    regs_per_cycle = args.targets * sum(b.count for b in blocks)
+
+    # sanity: every decoder must agree with the baseline (or, for another
+    # map, with the generic decoder)
+    baseline = os.path.samefile(args.map, DEFAULT_MAP)
+    if baseline:
+        expected = [decode_values(r[0]) for r in rows]
+        assert [decode_blocks(blocks, r) for r in rows] == expected
+    else:
+        expected = [decode_blocks(blocks, r) for r in rows]
+    assert [plan.decode(r) for r in rows] == expected
+    if np is not None:
+        cols = plan.decode_columns(rows)
+        assert {k: c.tolist() for k, c in cols.items()} == {k: [e[k] for e in expected] for k in expected[0]}
+
+    print(f"{args.targets} targets x {regs_per_cycle // args.targets} registers, {args.cycles} cycles")
+    if baseline:
+        bench("decode_values (baseline)", lambda: [decode_values(r[0]) for r in rows], args.cycles, regs_per_cycle)
+    bench("regmap.decode_blocks", lambda: [decode_blocks(blocks, r) for r in rows], args.cycles, regs_per_cycle)
+    bench("DecodePlan.decode", lambda: [plan.decode(r) for r in rows], args.cycles, regs_per_cycle)
+    if np is not None:
+        bench("DecodePlan.decode_columns", lambda: plan.decode_columns(rows), args.cycles, regs_per_cycle)
+    else:
+        print("numpy not installed: skipping batch decoders")
+
+if __name__ == "__main__":
+    main()
@@ -5,17 +5,12 @@ import time
 import paho.mqtt.client as mqtt
 from pymodbus.client.sync import ModbusTcpClient
 
-def env_int(name: str, default: int) -> int:
-    try:
-        return int(os.getenv(name, str(default)))
-    except ValueError:
-        return default
-
-def env_float(name: str, default: float) -> float:
-    try:
-        return float(os.getenv(name, str(default)))
-    except ValueError:
-        return default
+from deadband import deadband_from_env
+from env import env_float, env_int
+from metrics import Counter, Gauge, Histogram, log_readings, metrics_from_env, paho_inflight
+from regmap import DecodePlan, load_points, plan_reads, read_blocks
+from publisher import publisher_from_env
+from store_forward import spool_from_env
 
 MODBUS_HOST = os.getenv("MODBUS_HOST", "windmill_modbus")
 MODBUS_PORT = env_int("MODBUS_PORT", 5020)
@@ -27,40 +22,14 @@ TB_PORT = env_int("TB_MQTT_PORT", 1883)
 TB_TOKEN = os.getenv("TB_GATEWAY_TOKEN", "")
 TB_DEVICE_NAME = os.getenv("TB_DEVICE_NAME", "Windmill-01")
 
-# Register addresses
-REG_WIND_X100 = 0
-REG_RPM       = 1
-REG_POWER_X10 = 2
-REG_TEMP_X10  = 3
-REG_STATUS    = 4
-REG_FAULT     = 5
-
-def uint16_to_int16(v: int) -> int:
-    return v - 65536 if v > 32767 else v
-
-def decode_values(regs):
-    wind_ms = regs[0] / 100.0
-    rpm = regs[1]
-    power_kw = regs[2] / 10.0
-    temp_c = uint16_to_int16(regs[3]) / 10.0
-    status = regs[4]
-    fault_code = regs[5]
-
-    running = bool(status & (1 << 0))
-    overspeed = bool(status & (1 << 1))
-    fault = bool(status & (1 << 2))
-
-    return {
-        "wind_speed_ms": wind_ms,
-        "rpm": rpm,
-        "power_kw": power_kw,
-        "temp_c": temp_c,
-        "status_raw": status,
-        "running": running,
-        "overspeed": overspeed,
-        "fault": fault,
-        "fault_code": fault_code,
-    }
+REGISTER_MAP_FILE = os.getenv("REGISTER_MAP_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "registers.json"))
+READ_GAP_TOLERANCE = env_int("READ_GAP_TOLERANCE", 8)
+
+READ_SECONDS = Histogram("windfarm_read_seconds", "Modbus read time", ["target"])
+READ_ERRORS = Counter("windfarm_read_errors_total", "Failed Modbus reads by error", ["target", "error"])
+PUBLISHED = Counter("windfarm_published_messages_total", "Gateway messages published").labels()
+PUBLISH_FAILURES = Counter("windfarm_publish_failures_total", "Publishes paho rejected, by rc", ["rc"])
+PAHO_INFLIGHT = Gauge("windfarm_paho_inflight", "Messages queued or unacknowledged in paho")
 
 def build_gateway_payload(device_name: str, values: dict, ts_ms: int) -> str:
     # ThingsBoard Gateway telemetry format
@@ -81,6 +50,15 @@ def main():
     # MQTT client: username = token, password empty (TB default)
     client = mqtt.Client(client_id=f"windmill_poller_{TB_DEVICE_NAME}")
     client.username_pw_set(TB_TOKEN)
+    # Optional disk spool (SPOOL_DIR) so a ThingsBoard outage doesn't lose data;
+    # without one, a bounded in-flight window and queue (PUBLISH_*)
+    publisher = spool_from_env(client)
+    if publisher is None:
+        publisher = publisher_from_env(client)
+        publisher.export("windfarm")
+    metrics_from_env()
+    PAHO_INFLIGHT.set_function(lambda: paho_inflight(client))
+    log_each = log_readings()
 
     print(f"[poller] Connecting MQTT to {TB_HOST}:{TB_PORT} (ThingsBoard) ...")
     client.connect(TB_HOST, TB_PORT, keepalive=60)
@@ -94,30 +72,46 @@ def main():
         print("[poller] Modbus connect failed, retrying in 2s...")
         time.sleep(2)
 
+    blocks = plan_reads(load_points(REGISTER_MAP_FILE), gap_tolerance=READ_GAP_TOLERANCE)
+    plan = DecodePlan(blocks)
+    print(f"[poller] Register map {REGISTER_MAP_FILE}: {sum(len(b.points) for b in blocks)} points in {len(blocks)} read(s)")
+    deadband = deadband_from_env()  # None = publish every reading
     print("[poller] Started. Publishing to topic: v1/gateway/telemetry")
 
     try:
         while True:
-            rr = modbus.read_holding_registers(REG_WIND_X100, 6, unit=UNIT_ID)
-            if rr.isError():
-                print(f"[poller] Modbus read error: {rr}")
+            t0 = time.perf_counter()
+            block_regs, err = read_blocks(modbus, blocks, UNIT_ID)
+            READ_SECONDS.labels(TB_DEVICE_NAME).observe(time.perf_counter() - t0)
+            if block_regs is None:
+                READ_ERRORS.labels(TB_DEVICE_NAME, err).inc()
+                print(f"[poller] Modbus read error: {err}")
                 time.sleep(POLL_INTERVAL)
                 continue
 
-            values = decode_values(rr.registers)
+            values = plan.decode(block_regs)
+            if deadband is not None:
+                values = deadband.filter(TB_DEVICE_NAME, values)
+                if not values:
+                    time.sleep(POLL_INTERVAL)
+                    continue
             ts_ms = int(time.time() * 1000)
             msg = build_gateway_payload(TB_DEVICE_NAME, values, ts_ms)
 
             # QoS 1 is usually a good default for telemetry
-            res = client.publish("v1/gateway/telemetry", msg, qos=1)
+            res = publisher.publish("v1/gateway/telemetry", msg, qos=1)
             if res.rc != 0:
+                PUBLISH_FAILURES.labels(res.rc).inc()
                 print(f"[poller] MQTT publish failed rc={res.rc}")
             else:
-                print(f"[poller] {TB_DEVICE_NAME} -> {values}")
+                PUBLISHED.inc()
+                if log_each:
+                    print(f"[poller] {TB_DEVICE_NAME} -> {values}")
 
             time.sleep(POLL_INTERVAL)
 
     finally:
+        publisher.close()
         client.loop_stop()
         client.disconnect()
         modbus.close()
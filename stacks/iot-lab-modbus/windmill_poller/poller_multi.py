@@ -1,58 +1,32 @@
 import os
 import json
 import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from dataclasses import dataclass
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple, Union
 
 import paho.mqtt.client as mqtt
 from pymodbus.client.sync import ModbusTcpClient
 
-# Registers
-REG_WIND_X100 = 0
-REG_RPM       = 1
-REG_POWER_X10 = 2
-REG_TEMP_X10  = 3
-REG_STATUS    = 4
-REG_FAULT     = 5
+from deadband import deadband_from_env
+from env import env_float, env_int
+from metrics import (SIZE_BUCKETS, Counter, Gauge, Histogram, log_readings, metrics_from_env,
+                     paho_inflight)
+from regmap import DecodePlan, ReadBlock, load_points, plan_reads, read_blocks
+from scheduler import HealthScheduler
+from publisher import BoundedPublisher, publisher_from_env
+from store_forward import StoreAndForward, spool_from_env
 
-def env_int(name: str, default: int) -> int:
-    try:
-        return int(os.getenv(name, str(default)))
-    except ValueError:
-        return default
-
-def env_float(name: str, default: float) -> float:
-    try:
-        return float(os.getenv(name, str(default)))
-    except ValueError:
-        return default
-
-def uint16_to_int16(v: int) -> int:
-    return v - 65536 if v > 32767 else v
-
-def decode_values(regs: List[int]) -> Dict:
-    wind_ms = regs[0] / 100.0
-    rpm = regs[1]
-    power_kw = regs[2] / 10.0
-    temp_c = uint16_to_int16(regs[3]) / 10.0
-    status = regs[4]
-    fault_code = regs[5]
-
-    running = bool(status & (1 << 0))
-    overspeed = bool(status & (1 << 1))
-    fault = bool(status & (1 << 2))
-
-    return {
-        "wind_speed_ms": wind_ms,
-        "rpm": rpm,
-        "power_kw": power_kw,
-        "temp_c": temp_c,
-        "status_raw": status,
-        "running": running,
-        "overspeed": overspeed,
-        "fault": fault,
-        "fault_code": fault_code,
-    }
+POLL_CYCLE_SECONDS = Histogram("windfarm_poll_cycle_seconds", "Poll + decode + publish time per cycle")
+READ_SECONDS = Histogram("windfarm_read_seconds", "Modbus connect + read time per target", ["target"])
+READ_ERRORS = Counter("windfarm_read_errors_total", "Failed Modbus polls by target and error", ["target", "error"])
+BATCH_DEVICES = Histogram("windfarm_batch_devices", "Windmills per gateway message", buckets=SIZE_BUCKETS)
+PUBLISHED = Counter("windfarm_published_messages_total", "Gateway messages published").labels()
+PUBLISHED_BYTES = Counter("windfarm_published_bytes_total", "Gateway payload bytes published").labels()
+PUBLISH_FAILURES = Counter("windfarm_publish_failures_total", "Publishes paho rejected, by rc", ["rc"])
+OPEN_CIRCUITS = Gauge("windfarm_open_circuits", "Targets whose circuit breaker is open")
+PAHO_INFLIGHT = Gauge("windfarm_paho_inflight", "Messages queued or unacknowledged in paho")
+SPOOL_PENDING = Gauge("windfarm_spool_pending", "Spooled messages not yet acknowledged by ThingsBoard")
 
 @dataclass
 class WindmillTarget:
@@ -60,11 +34,12 @@ class WindmillTarget:
     host: str
     port: int
     unit: int
+    interval: float = 0.0  # 0 = use POLL_INTERVAL_SEC
 
 def parse_targets(spec: str) -> List[WindmillTarget]:
     """
     spec format:
-      Windmill-01@host:port:unit,Windmill-02@host:port:unit
+      Windmill-01@host:port:unit,Windmill-02@host:port:unit[:interval_sec]
     """
     targets: List[WindmillTarget] = []
     if not spec.strip():
@@ -72,84 +47,314 @@ def parse_targets(spec: str) -> List[WindmillTarget]:
 
     parts = [p.strip() for p in spec.split(",") if p.strip()]
     for p in parts:
-        # name@host:port:unit
+        # name@host:port:unit[:interval]
         name, rest = p.split("@", 1)
-        host, port, unit = rest.split(":", 2)
-        targets.append(WindmillTarget(name=name, host=host, port=int(port), unit=int(unit)))
+        fields = rest.split(":")
+        host, port, unit = fields[:3]
+        interval = float(fields[3]) if len(fields) > 3 else 0.0
+        targets.append(WindmillTarget(name=name, host=host, port=int(port), unit=int(unit), interval=interval))
     return targets
 
-def connect_mqtt(tb_host: str, tb_port: int, token: str) -> mqtt.Client:
+def poll_target(client: ModbusTcpClient, t: WindmillTarget,
+                blocks: List[ReadBlock]) -> Tuple[Optional[List[List[int]]], str]:
+    """
+    Connect (if needed) and read one windmill's register blocks.
+    Returns (block_regs, "") on success or (None, error_tag) on failure.
+    Decoding is left to the caller so a whole cycle can be decoded at once.
+    """
+    t0 = time.perf_counter()
+    block_regs, err = _read_target(client, t, blocks)
+    READ_SECONDS.labels(t.name).observe(time.perf_counter() - t0)
+    if block_regs is None:
+        READ_ERRORS.labels(t.name, err).inc()
+    return block_regs, err
+
+def _read_target(client: ModbusTcpClient, t: WindmillTarget,
+                 blocks: List[ReadBlock]) -> Tuple[Optional[List[List[int]]], str]:
+    try:
+        if not client.connect():
+            return None, "MODBUS_CONNECT_FAIL"
+
+        block_regs, err = read_blocks(client, blocks, t.unit)
+        if block_regs is None:
+            return None, err
+    except Exception:
+        # pymodbus raises ConnectionException if the socket drops mid-read
+        client.close()
+        return None, "MODBUS_EXC"
+
+    return block_regs, ""
+
+def poll_serial(targets: List[WindmillTarget], modbus_clients: Dict[str, ModbusTcpClient],
+                blocks: List[ReadBlock]) -> Dict[str, Tuple[Optional[List[List[int]]], str]]:
+    return {t.name: poll_target(modbus_clients[t.name], t, blocks) for t in targets}
+
+class ConcurrentPoller:
+    """
+    Reads every target at once on a bounded thread pool.
+
+    Each target owns its ModbusTcpClient, so at most one request per target is
+    in flight. A target whose previous read is still running (hung socket) is
+    reported as MODBUS_BUSY instead of being queued again.
+    """
+
+    def __init__(self, modbus_clients: Dict[str, ModbusTcpClient], blocks: List[ReadBlock],
+                 workers: int, cycle_timeout: float):
+        self.modbus_clients = modbus_clients
+        self.blocks = blocks
+        self.cycle_timeout = cycle_timeout
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="modbus")
+        self.pending: Dict[str, Future] = {}
+
+    def poll(self, targets: List[WindmillTarget]) -> Dict[str, Tuple[Optional[List[List[int]]], str]]:
+        results: Dict[str, Tuple[Optional[List[List[int]]], str]] = {}
+        submitted: Dict[str, Future] = {}
+
+        for t in targets:
+            prev = self.pending.get(t.name)
+            if prev is not None and not prev.done():
+                results[t.name] = (None, "MODBUS_BUSY")
+                continue
+            fut = self.executor.submit(poll_target, self.modbus_clients[t.name], t, self.blocks)
+            self.pending[t.name] = fut
+            submitted[t.name] = fut
+
+        wait(submitted.values(), timeout=self.cycle_timeout)
+
+        for name, fut in submitted.items():
+            if not fut.done():
+                results[name] = (None, "MODBUS_TIMEOUT")
+                continue
+            try:
+                results[name] = fut.result()
+            except Exception:
+                results[name] = (None, "MODBUS_EXC")
+        return results
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+def connect_mqtt(tb_host: str, tb_port: int,
+                 token: str) -> Tuple[mqtt.Client, Union[StoreAndForward, BoundedPublisher]]:
     client = mqtt.Client(client_id="windfarm_poller")
     client.username_pw_set(token)
+    # Optional disk spool (SPOOL_DIR) so a ThingsBoard outage doesn't lose data;
+    # without one, a bounded in-flight window and queue (PUBLISH_*)
+    spool = spool_from_env(client)
+    PAHO_INFLIGHT.set_function(lambda: paho_inflight(client))
+    if spool is not None:
+        SPOOL_PENDING.set_function(lambda: spool.pending)
+        publisher = spool
+    else:
+        publisher = publisher_from_env(client)
+        publisher.export("windfarm")
     client.connect(tb_host, tb_port, keepalive=60)
     client.loop_start()
-    return client
+    return client, publisher
 
-def main():
+class Windfarm:
+    """
+    Everything a poll cycle needs: the targets, their Modbus clients, the read
+    plan, the health scheduler and the poll strategy. cycle() reads whatever
+    is due and returns decoded values; publishing is left to the caller, so
+    main() below and the gateway's Modbus driver share the same cycle.
+    """
+
+    def __init__(self, targets: List[WindmillTarget], blocks: List[ReadBlock], poll_interval: float,
+                 scheduler: HealthScheduler, poll_mode: str, modbus_timeout: float, deadband=None,
+                 workers: int = 0, probe_workers: int = 4):
+        self.targets = targets
+        self.by_name: Dict[str, WindmillTarget] = {t.name: t for t in targets}
+        self.blocks = blocks
+        self.plan = DecodePlan(blocks)
+        self.poll_interval = poll_interval
+        self.scheduler = scheduler
+        self.deadband = deadband
+        self.log_cycle = log_readings()  # LOG_READINGS=1: one line per cycle with every target's values
+
+        # Modbus clients per target
+        self.modbus_clients: Dict[str, ModbusTcpClient] = {
+            t.name: ModbusTcpClient(t.host, port=t.port, timeout=modbus_timeout) for t in targets}
+
+        self.poller: Optional[ConcurrentPoller] = None
+        if poll_mode == "concurrent":
+            # connect + one read per block, each bounded by the socket timeout
+            self.poller = ConcurrentPoller(self.modbus_clients, blocks, max(1, workers or min(len(targets), 256)),
+                                           cycle_timeout=(1 + len(blocks)) * modbus_timeout + 0.5)
+
+        start = time.monotonic()
+        for t in targets:
+            scheduler.add(t.name, t.interval or poll_interval, start)
+
+        # Open-circuit probes run here so a dead turbine never blocks a poll cycle
+        self.probe_executor = ThreadPoolExecutor(max_workers=max(1, probe_workers), thread_name_prefix="probe")
+
+    def _submit_probe(self, name: str, done):
+        # A poll that timed out (MODBUS_TIMEOUT) may still be running on this
+        # target's client, and pymodbus sync clients aren't thread-safe: leave
+        # the client to it and try again at the next probe time.
+        if self.poller is not None:
+            prev = self.poller.pending.get(name)
+            if prev is not None and not prev.done():
+                done(False)
+                return
+        fut =self.probe_executor.submit(poll_target, self.modbus_clients[name], self.by_name[name], self.blocks)
+        fut.add_done_callback(lambda f: done(not f.exception() and f.result()[0] is not None))
+
+    def next_wakeup(self) -> float:
+        return self.scheduler.next_wakeup(time.monotonic(), self.poll_interval)
+
+    def cycle(self) -> Optional[Tuple[int, Dict[str, Dict]]]:
+        """
+        Start due probes and poll the due targets. Returns None when nothing
+        was due, else (ts_ms, {target name: values}) with the values after
+        the deadband filter; targets with nothing to report are left out.
+        """
+        now = time.monotonic()
+        self.scheduler.start_probes(now, self._submit_probe)
+
+        due = [self.by_name[name] for name in self.scheduler.due(now)]
+        if not due:
+            return None
+
+        ts_ms = int(time.time() * 1000)
+        telemetry: Dict[str, Dict] = {}
+        debug_line: List[str] = []
+        failed: List[str] = []
+
+        if self.poller is not None:
+            results = self.poller.poll(due)
+        else:
+            results = poll_serial(due, self.modbus_clients, self.blocks)
+
+        done_at = time.monotonic()
+        ok: List[WindmillTarget] = []
+        for t in due:
+            block_regs, err = results[t.name]
+            if block_regs is None:
+                if self.scheduler.record_failure(t.name, done_at):
+                    print(f"[windfarm] {t.name}: circuit open after repeated failures, probing in background")
+                failed.append(f"{t.name}={err}")
+                continue
+
+            self.scheduler.record_success(t.name, done_at)
+            ok.append(t)
+
+        for t in ok:
+            values = self.plan.decode(results[t.name][0])
+            if self.deadband is not None:
+                values = self.deadband.filter(t.name, values, done_at)
+                if not values:
+                    if self.log_cycle:
+                        debug_line.append(f"{t.name}=unchanged")
+                    continue
+            telemetry[t.name] = values
+            if self.log_cycle:
+                summary = " ".join(f"{k}={v}" for k, v in list(values.items())[:3])
+                debug_line.append(f"{t.name}=ok {summary}")
+
+        if not ok:
+            print("[windfarm] No telemetry this cycle (all due targets failed): " + " | ".join(failed))
+        elif self.log_cycle:
+            print("[windfarm] " + " | ".join(debug_line + failed))
+        elif failed:
+            print("[windfarm] " + " | ".join(failed))
+        return ts_ms, telemetry
+
+    def close(self):
+        self.probe_executor.shutdown(wait=False)
+        if self.poller is not None:
+            self.poller.shutdown()
+        for c in self.modbus_clients.values():
+            try:
+                c.close()
+            except Exception:
+                pass
+
+def windfarm_from_env(deadband=None) -> Windfarm:
+    """
+    Builds a Windfarm from the poller's environment. Without WINDMILLS, polls
+    the single turbine poller.py is configured with (TB_DEVICE_NAME@
+    MODBUS_HOST:MODBUS_PORT:MODBUS_UNIT_ID).
+    """
     poll_interval = env_float("POLL_INTERVAL_SEC", 1.0)
-    tb_host = os.getenv("TB_HOST", "thingsboard")
-    tb_port = env_int("TB_MQTT_PORT", 1883)
-    token = os.getenv("TB_GATEWAY_TOKEN", "")
     spec = os.getenv("WINDMILLS", "")
+    poll_mode = os.getenv("POLL_MODE", "concurrent").strip().lower()  # concurrent | serial
+    modbus_timeout = env_float("MODBUS_TIMEOUT_SEC", 1.0)
+    regmap_file = os.getenv("REGISTER_MAP_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "registers.json"))
+    gap_tolerance = env_int("READ_GAP_TOLERANCE", 8)
 
-    if not token:
-        raise SystemExit("TB_GATEWAY_TOKEN is empty. Set it to your ThingsBoard gateway device token.")
+    scheduler = HealthScheduler(
+        backoff_base=env_float("BACKOFF_BASE_SEC", 1.0),
+        backoff_max=env_float("BACKOFF_MAX_SEC", 30.0),
+        fail_threshold=env_int("CIRCUIT_FAIL_THRESHOLD", 5),
+        probe_interval=env_float("CIRCUIT_PROBE_SEC", 15.0),
+    )
+
+    if not spec.strip() and os.getenv("MODBUS_HOST"):
+        spec = (f"{os.getenv('TB_DEVICE_NAME', 'Windmill-01')}@{os.getenv('MODBUS_HOST')}:"
+                f"{env_int('MODBUS_PORT', 5020)}:{env_int('MODBUS_UNIT_ID', 1)}")
     targets = parse_targets(spec)
     if not targets:
         raise SystemExit("WINDMILLS is empty. Example: Windmill-01@windmill_modbus_01:5020:1,...")
 
+    blocks = plan_reads(load_points(regmap_file), gap_tolerance=gap_tolerance)
+    print(f"[windfarm] Register map {regmap_file}: {sum(len(b.points) for b in blocks)} points in {len(blocks)} read(s)")
     print(f"[windfarm] Targets: {', '.join([f'{t.name}({t.host}:{t.port} u{t.unit})' for t in targets])}")
-    print(f"[windfarm] Connecting MQTT to {tb_host}:{tb_port} ...")
-    mqtt_client = connect_mqtt(tb_host, tb_port, token)
+    print(f"[windfarm] Poll mode: {poll_mode}, modbus timeout {modbus_timeout}s")
 
-    # Modbus clients per target
-    modbus_clients: Dict[str, ModbusTcpClient] = {}
-    for t in targets:
-        modbus_clients[t.name] = ModbusTcpClient(t.host, port=t.port)
+    farm = Windfarm(targets, blocks, poll_interval, scheduler, poll_mode, modbus_timeout,
+                    deadband=deadband, workers=env_int("POLL_WORKERS", 0),
+                    probe_workers=env_int("PROBE_WORKERS", 4))
+    OPEN_CIRCUITS.set_function(lambda: len(scheduler.open_circuits()))
+    return farm
 
-    try:
-        while True:
-            ts_ms = int(time.time() * 1000)
-
-            gateway_payload: Dict[str, List[Dict]] = {}
-            debug_line: List[str] = []
+def main():
+    tb_host = os.getenv("TB_HOST", "thingsboard")
+    tb_port = env_int("TB_MQTT_PORT", 1883)
+    token = os.getenv("TB_GATEWAY_TOKEN", "")
+    if not token:
+        raise SystemExit("TB_GATEWAY_TOKEN is empty. Set it to your ThingsBoard gateway device token.")
 
-            for t in targets:
-                client = modbus_clients[t.name]
+    # Report-by-exception (DEADBAND_FILE); None = publish every reading
+    deadband = deadband_from_env()
+    if deadband is not None:
+        print(f"[windfarm] Deadband filter: {os.getenv('DEADBAND_FILE')}, heartbeat {deadband.heartbeat_sec}s")
 
-                if not client.connect():
-                    debug_line.append(f"{t.name}=MODBUS_CONNECT_FAIL")
-                    continue
+    farm = windfarm_from_env(deadband)
+    metrics_from_env()
 
-                rr = client.read_holding_registers(REG_WIND_X100, 6, unit=t.unit)
-                if rr.isError():
-                    debug_line.append(f"{t.name}=MODBUS_READ_ERR")
-                    continue
+    print(f"[windfarm] Connecting MQTT to {tb_host}:{tb_port} ...")
+    mqtt_client, publisher = connect_mqtt(tb_host, tb_port, token)
 
-                values = decode_values(rr.registers)
-                gateway_payload[t.name] = [{"ts": ts_ms, "values": values}]
-                debug_line.append(f"{t.name}=ok wind={values['wind_speed_ms']:.2f} rpm={values['rpm']} kw={values['power_kw']:.1f}")
+    try:
+        while True:
+            cycle_start = time.perf_counter()
+            result = farm.cycle()
+            if result is None:
+                time.sleep(farm.next_wakeup())
+                continue
 
-            if gateway_payload:
-                msg = json.dumps(gateway_payload)
-                res = mqtt_client.publish("v1/gateway/telemetry", msg, qos=1)
+            ts_ms, telemetry = result
+            if telemetry:
+                msg = json.dumps({name: [{"ts": ts_ms, "values": values}] for name, values in telemetry.items()})
+                res = publisher.publish("v1/gateway/telemetry", msg, qos=1)
                 if res.rc != 0:
+                    PUBLISH_FAILURES.labels(res.rc).inc()
                     print(f"[windfarm] MQTT publish failed rc={res.rc}")
                 else:
-                    print("[windfarm] " + " | ".join(debug_line))
-            else:
-                print("[windfarm] No telemetry this cycle (all targets failed)")
+                    PUBLISHED.inc()
+                    PUBLISHED_BYTES.inc(len(msg))
+                    BATCH_DEVICES.observe(len(telemetry))
+            POLL_CYCLE_SECONDS.observe(time.perf_counter() - cycle_start)
 
-            time.sleep(poll_interval)
+            time.sleep(farm.next_wakeup())
 
     finally:
+        farm.close()
+        publisher.close()
         mqtt_client.loop_stop()
         mqtt_client.disconnect()
-        for c in modbus_clients.values():
-            try:
-                c.close()
-            except Exception:
-                pass
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,304 @@
+import json
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # only decode_columns() needs it
+    np = None
+
+# Modbus PDU limit for a single read (registers)
+MAX_READ_REGS = 125
+
+TABLES = ("holding", "input")
+
+# type -> (register count, struct format for the big-endian byte string)
+TYPES = {
+    "int16":   (1, ">h"),
+    "uint16":  (1, ">H"),
+    "int32":   (2, ">i"),
+    "uint32":  (2, ">I"),
+    "float32": (2, ">f"),
+}
+
+# bits value: bit number -> bool, or [start_bit, width] -> int
+BitSpec = Union[int, List[int]]
+
+@dataclass
+class Point:
+    key: str
+    address: int
+    type: str = "uint16"
+    table: str = "holding"
+    scale: Optional[float] = None
+    offset: float = 0.0
+    byte_order: str = "big"   # byte order inside each 16-bit register
+    word_order: str = "big"   # register order for 32-bit values
+    bits: Dict[str, BitSpec] = field(default_factory=dict)
+
+    @property
+    def count(self) -> int:
+        return TYPES[self.type][0]
+
+    @property
+    def end(self) -> int:
+        return self.address + self.count
+
+@dataclass
+class ReadBlock:
+    table: str
+    start: int
+    count: int
+    points: List[Point]
+
+def _bit_spec(key: str, name: str, spec) -> BitSpec:
+    # DecodePlan compiles these into source, so only plain ints get through
+    if type(spec) is int and 0 <= spec < 32:
+        return spec
+    if isinstance(spec, list) and len(spec) == 2 and all(type(x) is int for x in spec):
+        start, width = spec
+        if start >= 0 and width >= 1 and start + width <= 32:
+            return [start, width]
+    raise ValueError(f"{key}: bits[{name!r}] must be a bit number or [start_bit, width] within 32 bits, got {spec!r}")
+
+def _point_from_dict(d: Dict) -> Point:
+    scale = d.get("scale")
+    p = Point(
+        key=d["key"],
+        address=int(d["address"]),
+        type=d.get("type", "uint16"),
+        table=d.get("table", "holding"),
+        scale=None if scale is None else float(scale),
+        offset=float(d.get("offset", 0.0)),
+        byte_order=d.get("byte_order", "big"),
+        word_order=d.get("word_order", "big"),
+        bits={name: _bit_spec(d["key"], name, spec) for name, spec in d.get("bits", {}).items()},
+    )
+    if p.type not in TYPES:
+        raise ValueError(f"{p.key}: unknown type {p.type!r} (expected one of {', '.join(TYPES)})")
+    if p.table not in TABLES:
+        raise ValueError(f"{p.key}: unknown table {p.table!r} (expected holding or input)")
+    if p.byte_order not in ("big", "little") or p.word_order not in ("big", "little"):
+        raise ValueError(f"{p.key}: byte_order/word_order must be 'big' or 'little'")
+    if p.bits and p.type == "float32":
+        raise ValueError(f"{p.key}: bits need an integer type, not {p.type}")
+    return p
+
+def load_points(path: str) -> List[Point]:
+    with open(path, "r") as f:
+        doc = json.load(f)
+    items = doc["points"] if isinstance(doc, dict) else doc
+    return [_point_from_dict(d) for d in items]
+
+def plan_reads(points: List[Point], gap_tolerance: int = 0,
+               max_regs: int = MAX_READ_REGS) -> List[ReadBlock]:
+    """
+    Coalesce points into the fewest read requests.
+
+    Points in the same table are merged into one block while the hole between
+    them is <= gap_tolerance registers and the block stays within max_regs.
+    Reading a few unused registers is much cheaper than another round-trip.
+    """
+    max_regs = max(1, min(max_regs, MAX_READ_REGS))
+    blocks: List[ReadBlock] = []
+
+    for table in TABLES:
+        pts = sorted((p for p in points if p.table == table), key=lambda p: (p.address, p.count))
+        cur: Optional[ReadBlock] = None
+        for p in pts:
+            if p.count > max_regs:
+                raise ValueError(f"{p.key}: {p.count} registers exceeds max block size {max_regs}")
+            if cur is not None:
+                cur_end = cur.start + cur.count
+                new_end = max(cur_end, p.end)
+                if p.address - cur_end <= gap_tolerance and new_end - cur.start <= max_regs:
+                    cur.count = new_end - cur.start
+                    cur.points.append(p)
+                    continue
+                blocks.append(cur)
+            cur = ReadBlock(table=table, start=p.address, count=p.count, points=[p])
+        if cur is not None:
+            blocks.append(cur)
+
+    return blocks
+
+def _raw_bytes(p: Point, regs: List[int]) -> bytes:
+    words = list(regs)
+    if p.word_order == "little":
+        words.reverse()
+    raw = struct.pack(f">{len(words)}H", *words)
+    if p.byte_order == "little":
+        # swap the two bytes inside every register
+        raw = b"".join(raw[i + 1:i + 2] + raw[i:i + 1] for i in range(0, len(raw), 2))
+    return raw
+
+def _scale_factors(p: Point) -> Tuple[Optional[int], Optional[float]]:
+    """(divisor, multiplier); at most one is set."""
+    if p.scale is None:
+        return None, None
+    inv = 1.0 / p.scale
+    if abs(inv - round(inv)) < 1e-9:
+        # 0.1 / 0.01 style scales: divide so 937 * 0.01 stays 9.37
+        return round(inv), None
+    return None, p.scale
+
+def _apply_scale(p: Point, v):
+    div, mul = _scale_factors(p)
+    if div is not None:
+        return v / div + p.offset
+    if mul is not None:
+        return v * mul + p.offset
+    return v + p.offset if p.offset else v
+
+def decode_point(p: Point, regs: List[int], out: Dict):
+    v = struct.unpack(TYPES[p.type][1], _raw_bytes(p, regs))[0]
+    out[p.key] = _apply_scale(p, v)
+    for name, spec in p.bits.items():
+        if isinstance(spec, int):
+            out[name] = bool(v & (1 << spec))
+        else:
+            start, width = spec
+            out[name] = (v >> start) & ((1 << width) - 1)
+
+def decode_blocks(blocks: List[ReadBlock], block_regs: List[List[int]]) -> Dict:
+    out: Dict = {}
+    for b, regs in zip(blocks, block_regs):
+        for p in b.points:
+            i = p.address - b.start
+            decode_point(p, regs[i:i + p.count], out)
+    return out
+
+def read_blocks(client, blocks: List[ReadBlock], unit: int) -> Tuple[Optional[List[List[int]]], str]:
+    """Issue one read per block. Returns (block_regs, "") or (None, error_tag)."""
+    block_regs: List[List[int]] = []
+    for b in blocks:
+        if b.table == "input":
+            rr = client.read_input_registers(b.start, b.count, unit=unit)
+        else:
+            rr = client.read_holding_registers(b.start, b.count, unit=unit)
+        if rr.isError():
+            return None, "MODBUS_READ_ERR"
+        block_regs.append(rr.registers)
+    return block_regs, ""
+
+_U32 = struct.Struct(">I")
+_F32 = struct.Struct(">f")
+
+def _f32(u: int) -> float:
+    return _F32.unpack(_U32.pack(u))[0]
+
+def _word_expr(reg: str, p: Point) -> str:
+    if p.byte_order == "little":
+        return f"((({reg}) & 0xFF) << 8 | ({reg}) >> 8)"
+    return reg
+
+def _raw_expr(p: Point, r: str, i: int) -> str:
+    """Python expression for the unscaled value of p inside register list r."""
+    words = [_word_expr(f"{r}[{i + k}]", p) for k in range(p.count)]
+    if p.count == 1:
+        w = words[0]
+        return f"(({w} ^ 0x8000) - 0x8000)" if p.type == "int16" else w
+    hi, lo = (words[1], words[0]) if p.word_order == "little" else (words[0], words[1])
+    u = f"({hi} << 16 | {lo})"
+    if p.type == "int32":
+        return f"(({u} ^ 0x80000000) - 0x80000000)"
+    if p.type == "float32":
+        return f"_f32({u})"
+    return u
+
+class DecodePlan:
+    """
+    Register map compiled for a fixed list of ReadBlocks.
+
+    decode() runs a function generated from the map (same idea as
+    collections.namedtuple): plain indexing and precomputed scale constants,
+    no per-point loop or lookups. decode_columns() decodes a whole cycle (all
+    targets) at once with NumPy into one array per key; the poller sticks to
+    decode(), since turning the columns back into one dict per target costs
+    more than decode() does.
+    """
+
+    def __init__(self, blocks: List[ReadBlock]):
+        self.blocks = blocks
+        self.decode = self._compile(blocks)
+
+    @staticmethod
+    def _compile(blocks: List[ReadBlock]):
+        lines = ["def decode(block_regs):"]
+        items = []
+        n = 0
+        for bi, b in enumerate(blocks):
+            r = f"r{bi}"
+            lines.append(f"    {r} = block_regs[{bi}]")
+            for p in b.points:
+                raw = _raw_expr(p, r, p.address - b.start)
+                if p.bits:
+                    # bitfields reuse the raw value, so bind it once
+                    v = f"v{n}"
+                    n += 1
+                    lines.append(f"    {v} = {raw}")
+                    raw = v
+                div, mul = _scale_factors(p)
+                expr = raw
+                if div is not None:
+                    expr = f"{raw} / {div}"
+                elif mul is not None:
+                    expr = f"{raw} * {mul!r}"
+                if p.offset:
+                    expr = f"{expr} + {p.offset!r}"
+                items.append(f"{p.key!r}: {expr}")
+                for name, spec in p.bits.items():
+                    if isinstance(spec, int):
+                        items.append(f"{name!r}: bool({raw} & {1 << int(spec)})")
+                    else:
+                        start, width = spec
+                        items.append(f"{name!r}: ({raw} >> {int(start)}) & {(1 << int(width)) - 1}")
+        lines.append("    return {" + ", ".join(items) + "}")
+        ns = {"_f32": _f32}
+        exec("\n".join(lines), ns)
+        return ns["decode"]
+
+    def decode_columns(self, rows: List[List[List[int]]]) -> Dict:
+        """
+        rows[target][block] -> register list. Returns key -> ndarray with one
+        entry per target, in row order.
+        """
+        if np is None:
+            raise RuntimeError("numpy is required for batch decoding")
+        cols: Dict = {}
+        for bi, b in enumerate(self.blocks):
+            arr = np.array([r[bi] for r in rows], dtype=np.uint16).reshape(len(rows), b.count)
+            for p in b.points:
+                i = p.address - b.start
+                words = [arr[:, i + k] for k in range(p.count)]
+                if p.byte_order == "little":
+                    words = [w.byteswap() for w in words]
+                if p.count == 1:
+                    u = words[0]
+                    raw = u.view(np.int16) if p.type == "int16" else u
+                else:
+                    hi, lo = (words[1], words[0]) if p.word_order == "little" else (words[0], words[1])
+                    u = (hi.astype(np.uint32) << 16) | lo.astype(np.uint32)
+                    raw = u.view({"int32": np.int32, "float32": np.float32}.get(p.type, np.uint32))
+                # scale in float64 like decode(): float32 / 10.0 would stay float32
+                raw = raw.astype(np.float64 if p.type == "float32" else np.int64)
+
+                div, mul = _scale_factors(p)
+                if div is not None:
+                    v = raw / float(div)
+                elif mul is not None:
+                    v = raw * mul
+                else:
+                    v = raw
+                if p.offset:
+                    v = v + p.offset
+                cols[p.key] = v
+
+                for name, spec in p.bits.items():
+                    if isinstance(spec, int):
+                        cols[name] = (u & (1 << spec)) != 0
+                    else:
+                        start, width = spec
+                        cols[name] = ((u >> start) & ((1 << width) - 1)).astype(np.int64)
+        return cols
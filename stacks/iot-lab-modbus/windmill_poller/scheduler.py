@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+STATE_CLOSED = "closed"   # healthy: polled on its own interval
+STATE_OPEN = "open"       # dead: skipped, only probed in the background
+
+@dataclass
+class TargetHealth:
+    interval: float
+    next_due: float = 0.0
+    failures: int = 0
+    state: str = STATE_CLOSED
+    next_probe: float = 0.0
+    probing: bool = False
+
+class HealthScheduler:
+    """
+    Per-target poll scheduling with exponential backoff and a circuit breaker.
+
+    - Healthy targets keep their own cadence (next_due advances by interval,
+      not by "now + interval", so slow cycles don't drift the schedule).
+    - A failing target is retried after base * 2^(failures-1) seconds with
+      jitter, capped at backoff_max.
+    - After fail_threshold consecutive failures the circuit opens: the target
+      leaves the poll cycle and is probed every probe_interval (jittered) by
+      start_probes(). A successful probe closes the circuit again.
+
+    Thread-safe: probe results are recorded from worker threads.
+    """
+
+    def __init__(self, backoff_base: float, backoff_max: float,
+                 fail_threshold: int, probe_interval: float,
+                 rng: Optional[random.Random] = None):
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.fail_threshold = max(1, fail_threshold)
+        self.probe_interval = probe_interval
+        self.rng = rng or random.Random()
+        self.health: Dict[str, TargetHealth] = {}
+        self.lock = threading.Lock()
+
+    def add(self, name: str, interval: float, now: float):
+        with self.lock:
+            self.health[name] = TargetHealth(interval=interval, next_due=now)
+
+    def _jitter(self, delay: float) -> float:
+        # "equal jitter": keep at least half the delay so retries stay spaced out
+        return delay / 2.0 + self.rng.uniform(0.0, delay / 2.0)
+
+    def due(self, now: float) -> List[str]:
+        with self.lock:
+            return [name for name, h in self.health.items()
+                    if h.state == STATE_CLOSED and h.next_due <= now]
+
+    def record_success(self, name: str, now: float):
+        with self.lock:
+            h = self.health[name]
+            if h.failures:
+                # recovered from backoff: restart cadence from now
+                h.next_due = now + h.interval
+            else:
+                h.next_due += h.interval
+                if h.next_due <= now:
+                    h.next_due = now + h.interval
+            h.failures = 0
+            h.state = STATE_CLOSED
+
+    def record_failure(self, name: str, now: float) -> bool:
+        """Returns True if this failure opened the circuit."""
+        with self.lock:
+            h = self.health[name]
+            h.failures += 1
+            if h.failures >= self.fail_threshold:
+                opened = h.state != STATE_OPEN
+                h.state = STATE_OPEN
+                h.next_probe = now + self._jitter(self.probe_interval)
+                return opened
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (h.failures - 1)))
+            h.next_due = now + self._jitter(delay)
+            return False
+
+    def start_probes(self, now: float, submit: Callable[[str, Callable[[bool], None]], None]):
+        """
+        For every open circuit whose probe time has come, call
+        submit(name, done). The caller runs the probe asynchronously and
+        calls done(ok) when finished.
+        """
+        with self.lock:
+            ready = [name for name, h in self.health.items()
+                     if h.state == STATE_OPEN and not h.probing and h.next_probe <= now]
+            for name in ready:
+                self.health[name].probing = True
+
+        for name in ready:
+            submit(name, self._probe_done(name))
+
+    def _probe_done(self, name: str) -> Callable[[bool], None]:
+        def done(ok: bool):
+            t = time.monotonic()
+            with self.lock:
+                h = self.health[name]
+                h.probing = False
+                if ok:
+                    h.state = STATE_CLOSED
+                    h.failures = 0
+                    h.next_due = t
+                else:
+                    h.next_probe = t + self._jitter(self.probe_interval)
+        return done
+
+    def next_wakeup(self, now: float, default: float) -> float:
+        """Seconds until the next target is due (or a probe should start)."""
+        with self.lock:
+            times = [h.next_due if h.state == STATE_CLOSED else h.next_probe
+                     for h in self.health.values() if not h.probing]
+        if not times:
+            return default
+        return max(0.0, min(times) - now)
+
+    def open_circuits(self) -> List[str]:
+        with self.lock:
+            return [name for name, h in self.health.items() if h.state == STATE_OPEN]
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import heapq
+import random
+import socket
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, List, Set, Tuple
+
+import paho.mqtt.client as mqtt
+
+from sensor import generate_value
+
+BROKER_HOST = os.getenv("MQTT_BROKER", "mosquitto")
+BROKER_PORT = int(os.getenv("MQTT_PORT", "1883"))
+
+FLEET_SPEC = os.getenv("FLEET_SPEC", os.path.join(os.path.dirname(os.path.abspath(__file__)), "fleet.json"))
+FLEET_CONNECTIONS = int(os.getenv("FLEET_CONNECTIONS", "4"))
+FLEET_MAX_INFLIGHT = int(os.getenv("FLEET_MAX_INFLIGHT", "1000"))      # per connection
+FLEET_QOS = int(os.getenv("FLEET_QOS", "0"))
+FLEET_INTERVAL_SCALE = float(os.getenv("FLEET_INTERVAL_SCALE", "1.0"))  # 0.1 = 10x the spec rate
+FLEET_REPORT_SEC = float(os.getenv("FLEET_REPORT_SEC", "10"))
+FLEET_DURATION_SEC = float(os.getenv("FLEET_DURATION_SEC", "0"))      # 0 = run forever
+FLEET_CLIENT_PREFIX = os.getenv("FLEET_CLIENT_PREFIX", f"fleet-{socket.gethostname()}")
+
+def log(msg):
+    print(msg, flush=True)
+
+@dataclass
+class VirtualSensor:
+    topic: str
+    sensor_type: str
+    interval: float
+    jitter: float  # fraction of interval, e.g. 0.1 = +/-10%
+
+def load_fleet(path: str, interval_scale: float = 1.0) -> List[VirtualSensor]:
+    """
+    Spec format (one entry per sensor group):
+      {"sensors": [
+        {"type": "temperature", "rooms": ["kitchen", "garage"], "name": "temp",
+         "count": 1, "interval": 5, "jitter": 0.1},
+        {"type": "humidity", "rooms": 500, "name": "hum", "count": 4, "interval": 10}
+      ]}
+    rooms is a list of names or a number (room001, room002, ...). With
+    count 1 the topic is sensors/<type>/<room>/<name>, otherwise the name
+    gets a 2-digit suffix per sensor (hum01, hum02, ...).
+    """
+    with open(path, "r") as f:
+        spec = json.load(f)
+
+    fleet: List[VirtualSensor] = []
+    for g in spec.get("sensors", []):
+        rooms = g.get("rooms", ["livingroom"])
+        if isinstance(rooms, int):
+            rooms = [f"room{i:03d}" for i in range(1, rooms + 1)]
+        count = int(g.get("count", 1))
+        name = g.get("name", "sensor")
+        names = [name] if count == 1 else [f"{name}{i:02d}" for i in range(1, count + 1)]
+        interval = float(g.get("interval", 5)) * interval_scale
+        jitter = float(g.get("jitter", 0.0))
+        for room in rooms:
+            for n in names:
+                fleet.append(VirtualSensor(f"sensors/{g['type']}/{room}/{n}", g["type"], interval, jitter))
+    return fleet
+
+class Connection:
+    """
+    One MQTT connection with a bounded in-flight window.
+
+    Publishes never wait for the broker (they are pipelined on paho's network
+    thread); the window only caps how many can be outstanding. on_publish is
+    handed to the event loop with call_soon_threadsafe, so the mid is always
+    registered before its ack is processed and all bookkeeping stays on the
+    loop thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, client_id: str, max_inflight: int, qos: int,
+                 username: str = ""):
+        self.loop = loop
+        self.qos = qos
+        self.window = asyncio.Semaphore(max_inflight)
+        self.outstanding: Set[int] = set()
+        self.sent = 0
+        self.errors = 0
+        self.client_id = client_id
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.max_inflight_messages_set(max_inflight)
+        if username:
+            self.client.username_pw_set(username)
+        self.client.on_connect = self._on_connect
+        self.client.on_publish = self._on_publish
+
+    def _on_connect(self, client, userdata, flags, reason_code, properties=None):
+        log(f"[fleet] {self.client_id} connected rc={reason_code}")
+
+    def _on_publish(self, client, userdata, mid, *args):
+        self.loop.call_soon_threadsafe(self._acked, mid)
+
+    def _acked(self, mid: int):
+        if mid in self.outstanding:
+            self.outstanding.discard(mid)
+            self.window.release()
+
+    def connect(self):
+        while True:
+            try:
+                self.client.connect(BROKER_HOST, BROKER_PORT, 60)
+                self.client.loop_start()
+                return
+            except Exception as e:
+                log(f"[fleet] connect to {BROKER_HOST}:{BROKER_PORT} failed: {e!r}, retrying in 5s")
+                time.sleep(5)
+
+    async def publish(self, topic: str, payload: str):
+        await self.window.acquire()
+        info = self.client.publish(topic, payload, qos=self.qos)
+        if info.rc == mqtt.MQTT_ERR_SUCCESS or (self.qos > 0 and info.rc == mqtt.MQTT_ERR_NO_CONN):
+            # QoS>0 messages queued while disconnected are sent (and acked) after reconnect
+            self.outstanding.add(info.mid)
+            self.sent += 1
+        else:
+            self.errors += 1
+            self.window.release()
+
+    @property
+    def inflight(self) -> int:
+        return len(self.outstanding)
+
+    def close(self):
+        self.client.loop_stop()
+        self.client.disconnect()
+
+async def run_fleet(fleet: List[VirtualSensor], conns: List[Connection],
+                    report_sec: float, duration: float) -> Dict:
+    """
+    Heap scheduler: one (due, index) entry per sensor. Each sensor is pinned
+    to a connection so its readings stay in order. The next due time is
+    computed from the previous one (not from "now") so intervals don't drift;
+    a sensor that falls more than one interval behind is rescheduled from now
+    instead of bursting to catch up.
+    """
+    rng = random.Random()
+    start = time.monotonic()
+    heap: List[Tuple[float, int]] = [(start + rng.random() * s.interval, i) for i, s in enumerate(fleet)]
+    heapq.heapify(heap)
+
+    published = 0
+    max_lag = 0.0
+    last_report, last_published = start, 0
+    stop_at = start + duration if duration > 0 else None
+
+    while heap:
+        now = time.monotonic()
+        if stop_at is not None and now >= stop_at:
+            break
+
+        due, i = heap[0]
+        if due > now:
+            wake = min(due, last_report + report_sec)
+            if stop_at is not None:
+                wake = min(wake, stop_at)
+            await asyncio.sleep(max(0.0, wake - now))
+        else:
+            s = fleet[i]
+            await conns[i % len(conns)].publish(s.topic, generate_value(s.sensor_type))
+            published += 1
+            max_lag = max(max_lag, now - due)
+
+            nxt = due + s.interval * (1.0 + rng.uniform(-s.jitter, s.jitter))
+            if nxt < now - s.interval:
+                nxt = now + s.interval
+            heapq.heapreplace(heap, (nxt, i))
+
+        now = time.monotonic()
+        if now - last_report >= report_sec:
+            rate = (published - last_published) / (now - last_report)
+            inflight = sum(c.inflight for c in conns)
+            errors = sum(c.errors for c in conns)
+            log(f"[fleet] {rate:.0f} msg/s  total={published} inflight={inflight} "
+                f"errors={errors} max_lag={max_lag * 1000:.0f}ms")
+            last_report, last_published, max_lag = now, published, 0.0
+
+    elapsed = time.monotonic() - start
+    return {
+        "sensors": len(fleet),
+        "published": published,
+        "errors": sum(c.errors for c in conns),
+        "elapsed_sec": round(elapsed, 3),
+        "msg_per_sec": round(published / elapsed, 1) if elapsed > 0 else 0.0,
+    }
+
+def target_rate(fleet: List[VirtualSensor]) -> float:
+    return sum(1.0 / s.interval for s in fleet if s.interval > 0)
+
+async def amain():
+    fleet = load_fleet(FLEET_SPEC, FLEET_INTERVAL_SCALE)
+    if not fleet:
+        raise SystemExit(f"{FLEET_SPEC}: no sensors defined")
+    log(f"[fleet] {len(fleet)} sensors from {FLEET_SPEC}, target {target_rate(fleet):.0f} msg/s "
+        f"over {FLEET_CONNECTIONS} connection(s), window {FLEET_MAX_INFLIGHT}, qos {FLEET_QOS}")
+
+    loop = asyncio.get_running_loop()
+    conns = [Connection(loop, f"{FLEET_CLIENT_PREFIX}-{i}", FLEET_MAX_INFLIGHT, FLEET_QOS)
+             for i in range(max(1, FLEET_CONNECTIONS))]
+    for c in conns:
+        await loop.run_in_executor(None, c.connect)
+
+    try:
+        summary = await run_fleet(fleet, conns, FLEET_REPORT_SEC, FLEET_DURATION_SEC)
+        log("[fleet] summary " + json.dumps(summary))
+    finally:
+        for c in conns:
+            c.close()
+
+def main():
+    asyncio.run(amain())
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Record MQTT telemetry to a binary trace and replay it.
+
+  python telemetry_trace.py record --topic 'sensors/#' --out lab.trace --duration 600
+  python telemetry_trace.py replay lab.trace --speed 10        # 10x
+  python telemetry_trace.py replay lab.trace --speed 0         # as fast as possible
+  python telemetry_trace.py info lab.trace
+
+ThingsBoard does not echo v1/gateway/telemetry to subscribers; to capture
+what a bridge sends, point its TB_HOST at Mosquitto and record
+--topic v1/gateway/telemetry there. Replaying such a trace into ThingsBoard
+needs --username <gateway token>.
+
+Trace format (little endian):
+  header   b"IOTTRACE" u8 version, f64 wall-clock start (unix seconds)
+  topic    b"T" u32 index, u16 len, topic bytes      (first use of a topic)
+  message  b"M" u64 offset_us, u32 topic index, u32 len, payload bytes
+
+Offsets are relative to the start of the recording, so replay keeps the
+original inter-arrival times (and bursts) scaled by --speed. Each topic is
+replayed on a fixed connection, so per-topic order is preserved.
+"""
+import os
+import json
+import time
+import struct
+import asyncio
+import argparse
+import threading
+from typing import BinaryIO, Dict, Iterator, List, Tuple
+
+import paho.mqtt.client as mqtt
+
+from fleet import Connection, log
+
+MAGIC = b"IOTTRACE"
+VERSION = 1
+_HEADER = struct.Struct("<Bd")
+_TOPIC = struct.Struct("<IH")
+_MSG = struct.Struct("<QII")
+
+class TraceWriter:
+    def __init__(self, path: str):
+        self.f: BinaryIO = open(path, "wb", buffering=1 << 20)
+        self.f.write(MAGIC + _HEADER.pack(VERSION, time.time()))
+        self.t0 = time.monotonic()
+        self.topics: Dict[str, int] = {}
+        self.count = 0
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def write(self, topic: str, payload: bytes):
+        offset_us = int((time.monotonic() - self.t0) * 1_000_000)
+        with self.lock:
+            idx = self.topics.get(topic)
+            if idx is None:
+                idx = self.topics[topic] = len(self.topics)
+                raw = topic.encode()
+                self.f.write(b"T" + _TOPIC.pack(idx, len(raw)) + raw)
+            self.f.write(b"M" + _MSG.pack(offset_us, idx, len(payload)))
+            self.f.write(payload)
+            self.count += 1
+            self.bytes += len(payload)
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+def read_trace(path: str) -> Iterator[Tuple[int, int, str, bytes]]:
+    """Yields (offset_us, topic_index, topic, payload) in recorded order."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SystemExit(f"{path}: not a trace file")
+        head = f.read(_HEADER.size)
+        if len(head) < _HEADER.size:
+            raise SystemExit(f"{path}: truncated trace header")
+        version, _start = _HEADER.unpack(head)
+        if version != VERSION:
+            raise SystemExit(f"{path}: unsupported trace version {version}")
+        topics: List[str] = []
+        while True:
+            kind = f.read(1)
+            if kind == b"T":
+                head = f.read(_TOPIC.size)
+                if len(head) < _TOPIC.size:
+                    return  # recording was cut off mid-record
+                idx, n = _TOPIC.unpack(head)
+                raw = f.read(n)
+                if len(raw) < n:
+                    return
+                topics.append(raw.decode())
+            elif kind == b"M":
+                head = f.read(_MSG.size)
+                if len(head) < _MSG.size:
+                    return  # recording was cut off mid-record
+                offset_us, idx, n = _MSG.unpack(head)
+                payload = f.read(n)
+                if len(payload) < n:
+                    return
+                yield offset_us, idx, topics[idx], payload
+            else:
+                return
+
+def record(args):
+    writer = TraceWriter(args.out)
+    client = mqtt.Client(client_id=args.client_id)
+
+    def on_connect(client, userdata, flags, reason_code, properties=None):
+        log(f"[trace] connected rc={reason_code}, subscribing {args.topic}")
+        client.subscribe(args.topic, qos=args.qos)
+
+    def on_message(client, userdata, msg):
+        writer.write(msg.topic, msg.payload)
+
+    client.on_connect = on_connect
+    client.on_message = on_message
+    if args.username:
+        client.username_pw_set(args.username)
+    client.connect(args.host, args.port, 60)
+    client.loop_start()
+
+    log(f"[trace] recording {args.topic} from {args.host}:{args.port} -> {args.out}")
+    start = time.monotonic()
+    try:
+        while True:
+            time.sleep(1.0)
+            if args.duration and time.monotonic() - start >= args.duration:
+                break
+            if args.max_messages and writer.count >= args.max_messages:
+                break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.loop_stop()
+        client.disconnect()
+        writer.close()
+    log(f"[trace] wrote {writer.count} messages, {len(writer.topics)} topics, "
+        f"{writer.bytes} payload bytes in {time.monotonic() - start:.1f}s")
+
+async def replay_async(args) -> Dict:
+    loop = asyncio.get_running_loop()
+    conns = [Connection(loop, f"{args.client_id}-{i}", args.max_inflight, args.qos, args.username)
+             for i in range(max(1, args.connections))]
+    for c in conns:
+        await loop.run_in_executor(None, c.connect)
+
+    published = 0
+    max_lag = 0.0
+    start = time.monotonic()
+    try:
+        for n in range(args.loops):
+            base = time.monotonic()
+            for offset_us, idx, topic, payload in read_trace(args.trace):
+                if args.speed > 0:
+                    due = base + offset_us / 1_000_000 / args.speed
+                    now = time.monotonic()
+                    if due > now:
+                        await asyncio.sleep(due - now)
+                    else:
+                        max_lag = max(max_lag, now - due)
+                await conns[idx % len(conns)].publish(topic, payload)
+                published += 1
+    finally:
+        for c in conns:
+            c.close()
+
+    elapsed = time.monotonic() - start
+    return {
+        "published": published,
+        "errors": sum(c.errors for c in conns),
+        "elapsed_sec": round(elapsed, 3),
+        "msg_per_sec": round(published / elapsed, 1) if elapsed > 0 else 0.0,
+        "max_lag_ms": round(max_lag * 1000, 1),
+    }
+
+def replay(args):
+    speed = "as fast as possible" if args.speed <= 0 else f"{args.speed}x"
+    log(f"[trace] replaying {args.trace} at {speed} to {os.getenv('MQTT_BROKER', 'mosquitto')}")
+    summary = asyncio.run(replay_async(args))
+    log("[trace] summary " + json.dumps(summary))
+
+def info(args):
+    count = 0
+    size = 0
+    last = 0
+    per_topic: Dict[str, int] = {}
+    for offset_us, _idx, topic, payload in read_trace(args.trace):
+        count += 1
+        size += len(payload)
+        last = offset_us
+        per_topic[topic] = per_topic.get(topic, 0) + 1
+    duration = last / 1_000_000
+    print(json.dumps({
+        "messages": count,
+        "topics": len(per_topic),
+        "payload_bytes": size,
+        "duration_sec": round(duration, 3),
+        "avg_msg_per_sec": round(count / duration, 1) if duration > 0 else 0.0,
+        "busiest_topics": sorted(per_topic.items(), key=lambda kv: -kv[1])[:5],
+    }, indent=2))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    r = sub.add_parser("record", help="subscribe and write a trace")
+    r.add_argument("--host", default=os.getenv("MQTT_BROKER", "mosquitto"))
+    r.add_argument("--port", type=int, default=int(os.getenv("MQTT_PORT", "1883")))
+    r.add_argument("--username", default=os.getenv("MQTT_USERNAME", ""), help="e.g. a device token")
+    r.add_argument("--topic", default="sensors/#")
+    r.add_argument("--qos", type=int, default=0)
+    r.add_argument("--out", default="telemetry.trace")
+    r.add_argument("--duration", type=float, default=0, help="seconds, 0 = until Ctrl-C")
+    r.add_argument("--max-messages", type=int, default=0)
+    r.add_argument("--client-id", default="trace-recorder")
+    r.set_defaults(func=record)
+
+    p = sub.add_parser("replay", help="publish a trace (broker from MQTT_BROKER / MQTT_PORT)")
+    p.add_argument("trace")
+    p.add_argument("--speed", type=float, default=1.0, help="time scale, 0 = as fast as possible")
+    p.add_argument("--loops", type=int, default=1)
+    p.add_argument("--connections", type=int, default=4)
+    p.add_argument("--max-inflight", type=int, default=1000, help="per connection")
+    p.add_argument("--qos", type=int, default=0)
+    p.add_argument("--username", default=os.getenv("MQTT_USERNAME", ""), help="e.g. a gateway token")
+    p.add_argument("--client-id", default="trace-replay")
+    p.set_defaults(func=replay)
+
+    i = sub.add_parser("info", help="summarise a trace")
+    i.add_argument("trace")
+    i.set_defaults(func=info)
+
+    args = ap.parse_args()
+    args.func(args)
+
+if __name__ == "__main__":
+    main()
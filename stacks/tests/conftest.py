@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The services import their modules flat (the Dockerfiles copy common/*.py
+# next to each script), so put the same directories on the path here.
+STACKS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for d in ("iot-lab-bacnet/tb_bridge", "common", "iot-lab-core/tb-bridge", "iot-lab-modbus/windmill_poller", "iot-lab-mqtt/fake_sensor"):
+    sys.path.insert(0, os.path.join(STACKS, d))
@@ -0,0 +1,78 @@
+from bacpypes.apdu import ReadPropertyRequest
+
+import bacnet_client
+from bacnet_client import BacnetTarget, RequestWindow
+
+class FakeApp:
+    """Holds the IOCBs RequestWindow sends so the test decides when they complete."""
+
+    def __init__(self):
+        self.sent = []
+
+    def request_io(self, iocb):
+        self.sent.append(iocb)
+
+def _req():
+    return ReadPropertyRequest(objectIdentifier=("analogInput", 1), propertyIdentifier="presentValue")
+
+def _target(name):
+    return BacnetTarget(name=name, host="127.0.0.1", port=47808, points=[], address=bacnet_client.Address("127.0.0.1:47808"))
+
+def test_window_limits_and_round_robin(monkeypatch):
+    app = FakeApp()
+    monkeypatch.setattr(bacnet_client, "app", app)
+    window = RequestWindow(max_total=2, max_per_target=1)
+    a, b = _target("A"), _target("B")
+    done = []
+    for t in (a, a, a, b):
+        window.submit(t, _req(), lambda apdu, err, t=t: done.append((t.name, err)))
+
+    # one per target, and B isn't stuck behind A's queue
+    assert [i.args[0].pduDestination for i in app.sent] == [a.address, b.address]
+    assert window.inflight == 2 and window.queued == 2
+
+    app.sent[0].abort("timed out")
+    assert done == [("A", "timed out")]
+    assert len(app.sent) == 3 and window.inflight == 2 and window.queued == 1
+
+def test_failing_callback_still_frees_the_slot(monkeypatch):
+    app = FakeApp()
+    monkeypatch.setattr(bacnet_client, "app", app)
+    window = RequestWindow(max_total=1, max_per_target=1)
+    t = _target("A")
+    done = []
+
+    def boom(apdu, err):
+        raise RuntimeError("bad response")
+
+    window.submit(t, _req(), boom)
+    window.submit(t, _req(), lambda apdu, err: done.append(err))
+    app.sent[0].abort("timed out")
+
+    assert t.inflight == 1 and window.inflight == 1 and len(app.sent) == 2
+    app.sent[1].abort("timed out")
+    assert done == ["timed out"] and window.inflight == 0 and window.queued == 0
+
+def test_rpm_result_without_values_fails_only_that_point(monkeypatch):
+    from bacpypes.apdu import ReadAccessResult, ReadAccessResultElement, ReadAccessResultElementChoice, ReadPropertyMultipleACK
+    from bacpypes.constructeddata import Any
+    from bacpypes.primitivedata import Real
+
+    app = FakeApp()
+    monkeypatch.setattr(bacnet_client, "app", app)
+    monkeypatch.setattr(bacnet_client, "window", RequestWindow(max_total=4, max_per_target=1))
+    t = _target("A")
+    got = []
+    batch = [{"type": "analogInput", "instance": 1}, {"type": "analogInput", "instance": 2}]
+    bacnet_client.read_points_multiple(t, batch, got.append)
+
+    ok = ReadAccessResultElement(propertyIdentifier="presentValue",
+                                 readResult=ReadAccessResultElementChoice(propertyValue=Any(Real(21.5))))
+    ack = ReadPropertyMultipleACK(listOfReadAccessResults=[
+        ReadAccessResult(objectIdentifier=("analogInput", 1), listOfResults=[ok]),
+        ReadAccessResult(objectIdentifier=("analogInput", 2), listOfResults=[]),
+    ])
+    app.sent[0].complete(ack)
+
+    assert got == [[(21.5, None), (None, "ReadPropertyMultiple returned no result")]]
+    assert bacnet_client.window.inflight == 0
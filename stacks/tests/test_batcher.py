@@ -0,0 +1,34 @@
+from batcher import AggregateBatcher, SampleBatcher, TelemetryBatcher
+
+def test_aggregate_passes_arrays_through():
+    b = AggregateBatcher(10, 1 << 20, 1.0)
+    b.add("d", {"t": 1.0, "arr": [1, 2, 3]}, 0)
+    b.add("d", {"t": 3.0, "arr": [4, 5, 6, 7, 8]}, 0)
+    values = b.to_gateway(b.swap(), 0)["d"][0]["values"]
+    assert values["arr"] == [4, 5, 6, 7, 8]
+    assert values["t_min"] == 1.0 and values["t_max"] == 3.0
+    assert values["t_mean"] == 2.0 and values["t_count"] == 2 and values["t_last"] == 3.0
+
+def test_aggregate_numeric_after_array_starts_fresh():
+    b = AggregateBatcher(10, 1 << 20, 1.0)
+    arr = [1, 2, 3, 4, 5]
+    b.add("d", {"k": arr}, 0)
+    b.add("d", {"k": 7}, 0)
+    values = b.to_gateway(b.swap(), 0)["d"][0]["values"]
+    assert arr == [1, 2, 3, 4, 5]
+    assert values["k_min"] == 7 and values["k_count"] == 1
+
+def test_last_keeps_the_reading_timestamp():
+    b = TelemetryBatcher(10, 1 << 20, 1.0)
+    b.add("polled", {"t": 1.0, "rpm": 5}, 0, ts=1000)
+    b.add("polled", {"t": 2.0}, 0, ts=2000)
+    b.add("mqtt", {"t": 3.0}, 0)
+    msg = b.to_gateway(b.swap(), 9000)
+    assert msg["polled"] == [{"ts": 2000, "values": {"t": 2.0, "rpm": 5}}]
+    assert msg["mqtt"] == [{"ts": 9000, "values": {"t": 3.0}}]
+
+def test_samples_keep_the_reading_timestamp():
+    b = SampleBatcher(10, 1 << 20, 1.0, 8)
+    b.add("polled", {"t": 1.0}, 0, ts=1000)
+    b.add("polled", {"t": 2.0}, 0, ts=2000)
+    assert [e["ts"] for e in b.to_gateway(b.swap(), 9000)["polled"]] == [1000, 2000]
@@ -0,0 +1,13 @@
+import pytest
+
+from metrics import Counter, _Metric, render
+
+def test_label_values_are_escaped():
+    c = Counter("test_escape_errors_total", "Errors by kind", ["kind"])
+    c.labels('bad "value"\nwith \\ backslash').inc()
+    line = next(l for l in render().decode().splitlines() if l.startswith("test_escape_errors_total{"))
+    assert line == 'test_escape_errors_total{kind="bad \\"value\\"\\nwith \\\\ backslash"} 1.0'
+
+def test_metric_base_is_abstract():
+    with pytest.raises(TypeError):
+        _Metric("test_abstract", "doc")
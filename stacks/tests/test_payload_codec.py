@@ -0,0 +1,25 @@
+import cbor2
+import msgpack
+import pytest
+
+from payload_codec import DecodeError, parse_cbor, parse_msgpack, parse_text
+
+def test_binary_codecs_decode_telemetry():
+    doc = {"temp": 21.5, "ok": True, "tags": ["a", 1], "nested": {"x": None}}
+    assert parse_msgpack(msgpack.packb(doc)) == doc
+    assert parse_cbor(cbor2.dumps(doc)) == doc
+
+@pytest.mark.parametrize("payload", [b"\xc1", b"", msgpack.packb({"raw": b"\x00\x01"}), msgpack.packb({1: 2})])
+def test_msgpack_rejects_bad_payloads(payload):
+    with pytest.raises(DecodeError):
+        parse_msgpack(payload)
+
+@pytest.mark.parametrize("payload", [b"\xff", cbor2.dumps({"raw": b"\x00"}), cbor2.dumps(1 << 70)])
+def test_cbor_rejects_bad_payloads(payload):
+    with pytest.raises(DecodeError):
+        parse_cbor(payload)
+
+def test_text_never_raises():
+    assert parse_text(b"\xc1\xff") == ""
+    assert parse_text(b"{broken") == "{broken"
+    assert parse_text(b" 22.5 ") == 22.5
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+
+from poller_multi import ConcurrentPoller, Windfarm, parse_targets
+from regmap import load_points, plan_reads
+from scheduler import STATE_CLOSED, HealthScheduler
+
+REGISTERS = os.path.join(os.path.dirname(__file__), "..", "iot-lab-modbus", "windmill_poller", "registers.json")
+
+class _Response:
+    def __init__(self, registers):
+        self.registers = registers
+
+    def isError(self):
+        return False
+
+class HangingClient:
+    """ModbusTcpClient stand-in whose reads block until released; records overlapping use."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.lock = threading.Lock()
+        self.active = 0
+        self.overlapped = False
+        self.reads = 0
+
+    def connect(self):
+        return True
+
+    def close(self):
+        pass
+
+    def read_holding_registers(self, start, count, unit=1):
+        with self.lock:
+            self.active += 1
+            self.reads += 1
+            self.overlapped |= self.active > 1
+        try:
+            self.release.wait(5.0)
+            return _Response([0] * count)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+    read_input_registers = read_holding_registers
+
+def test_hung_target_times_out_without_holding_up_the_rest():
+    blocks = plan_reads(load_points(REGISTERS))
+    targets = parse_targets("WT-1@127.0.0.1:1:1,WT-2@127.0.0.1:1:2,WT-3@127.0.0.1:1:3")
+    clients = {t.name: HangingClient() for t in targets}
+    clients["WT-1"].release.set()
+    clients["WT-3"].release.set()
+    poller = ConcurrentPoller(clients, blocks, workers=3, cycle_timeout=0.2)
+    try:
+        t0 = time.monotonic()
+        results = poller.poll(targets)
+        assert time.monotonic() - t0 < 1.0
+        assert results["WT-2"] == (None, "MODBUS_TIMEOUT")
+        assert results["WT-1"][1] == "" and results["WT-3"][1] == ""
+
+        # the hung read still owns WT-2's client: not queued behind it
+        results = poller.poll(targets)
+        assert results["WT-2"] == (None, "MODBUS_BUSY")
+        assert clients["WT-2"].reads == 1
+    finally:
+        clients["WT-2"].release.set()
+        poller.shutdown()
+
+def _farm():
+    scheduler = HealthScheduler(backoff_base=0.01, backoff_max=0.01, fail_threshold=1, probe_interval=0.0)
+    blocks = plan_reads(load_points(REGISTERS))
+    farm = Windfarm(parse_targets("WT-1@127.0.0.1:1:1"), blocks, 0.05, scheduler, "concurrent",
+                    modbus_timeout=0.01)
+    client = HangingClient()
+    farm.modbus_clients["WT-1"] = client   # the poller shares this dict
+    return farm, scheduler, client
+
+def _wait(pred, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not pred() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pred()
+
+def test_timeout_opens_circuit_and_probe_waits_for_pending_poll():
+    farm, scheduler, client = _farm()
+    try:
+        ts, telemetry = farm.cycle()
+        assert telemetry == {}
+        assert scheduler.open_circuits() == ["WT-1"]
+        assert not farm.poller.pending["WT-1"].done()
+
+        # probes come due at once (probe_interval=0) but the poll still owns the client
+        for _ in range(5):
+            assert farm.cycle() is None
+        assert client.reads == 1
+
+        client.release.set()
+        assert _wait(lambda: farm.poller.pending["WT-1"].done())
+        farm.cycle()   # now the probe runs and closes the circuit
+        assert _wait(lambda: scheduler.health["WT-1"].state == STATE_CLOSED)
+        assert client.reads == 2 and not client.overlapped
+    finally:
+        client.release.set()
+        farm.close()
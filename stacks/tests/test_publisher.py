@@ -0,0 +1,70 @@
+from publisher import BoundedPublisher
+
+MQTT_ERR_NO_CONN = 4
+MQTT_ERR_QUEUE_SIZE = 15
+
+class _Info:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+class ScriptedClient:
+    """paho stand-in: publish() returns the next scripted rc (0 by default); acks are manual."""
+
+    def __init__(self, rcs=()):
+        self.rcs = list(rcs)
+        self.sent = []
+        self._mid = 0
+
+    def publish(self, topic, payload, qos=1):
+        if not topic:
+            raise ValueError("Invalid topic.")
+        self._mid += 1
+        rc = self.rcs.pop(0) if self.rcs else 0
+        if rc in (0, MQTT_ERR_NO_CONN):
+            self.sent.append(payload)
+        return _Info(rc, self._mid)
+
+def _connected(client, **kw):
+    pub = BoundedPublisher(client, **kw)
+    pub._on_connect(client, None, {}, 0)
+    return pub
+
+def test_refused_message_is_dropped_and_the_window_keeps_moving():
+    client = ScriptedClient([MQTT_ERR_QUEUE_SIZE])
+    pub = _connected(client, max_inflight=5)
+    pub.publish("t", b"a")
+    pub.publish("t", b"b")
+    pub.publish("", b"c")
+    pub.publish("t", b"d")
+    assert client.sent == [b"b", b"d"]
+    assert pub.failed == 2 and pub.online and pub.queued == 0
+
+def test_lost_connection_pauses_until_reconnect():
+    client = ScriptedClient([MQTT_ERR_NO_CONN])
+    pub = _connected(client, max_inflight=5)
+    pub.publish("t", b"a")   # kept by paho for the reconnect
+    pub.publish("t", b"b")
+    assert client.sent == [b"a"] and not pub.online and pub.queued == 1
+    pub._on_connect(client, None, {}, 0)
+    assert client.sent == [b"a", b"b"] and pub.failed == 0
+
+def test_inflight_window_is_bounded_by_acks():
+    client = ScriptedClient()
+    pub = _connected(client, max_inflight=2)
+    for i in range(5):
+        pub.publish("t", b"%d" % i)
+    assert len(client.sent) == 2 and pub.queued == 3
+    pub._on_publish(client, None, 1)
+    assert len(client.sent) == 3
+
+def test_export_registers_prefixed_metrics():
+    from metrics import render
+
+    pub = _connected(ScriptedClient([MQTT_ERR_QUEUE_SIZE]))
+    pub.export("test_export")
+    pub.publish("t", b"a")
+    text = render().decode()
+    assert "test_export_publish_queue 0" in text
+    assert 'test_export_publish_overload_total{action="failed"} 1' in text
+    assert "test_export_publish_blocked_seconds_total 0.0" in text
@@ -0,0 +1,36 @@
+import pytest
+
+from regmap import DecodePlan, _point_from_dict, decode_point, plan_reads
+
+@pytest.mark.parametrize("spec", [
+    "__import__('os').system('true')",
+    ["0); import os; (0", 4],
+    [0, "4) or __import__('os')"],
+    1.5, True, -1, 32, [28, 8], [0, 0], [1, 2, 3],
+])
+def test_bad_bit_specs_are_rejected_at_load(spec):
+    with pytest.raises(ValueError):
+        _point_from_dict({"key": "status", "address": 0, "bits": {"flag": spec}})
+
+def test_bitfields_decode_the_same_compiled_or_not():
+    p = _point_from_dict({"key": "status", "address": 0, "type": "uint32",
+                          "bits": {"running": 0, "fault": 31, "mode": [4, 3]}})
+    regs = [0x8000, 0x0051]
+    plan = DecodePlan(plan_reads([p]))
+    expected = {}
+    decode_point(p, regs, expected)
+    assert plan.decode([regs]) == expected
+    assert expected["running"] is True and expected["fault"] is True and expected["mode"] == 5
+
+def test_bits_on_float_point_are_rejected():
+    with pytest.raises(ValueError, match="temp"):
+        _point_from_dict({"key": "temp", "address": 0, "type": "float32", "bits": {"flag": 0}})
+
+def test_columns_scale_float32_like_the_row_decoder():
+    pts = [_point_from_dict({"key": "temp", "address": 0, "type": "float32", "scale": 0.1}),
+           _point_from_dict({"key": "flow", "address": 2, "type": "float32", "scale": 0.3, "offset": 1.5}),
+           _point_from_dict({"key": "level", "address": 4, "type": "int16", "scale": 0.01})]
+    plan = DecodePlan(plan_reads(pts))
+    rows = [[[0x41BC, 0xCCCD, 0x4049, 0x0FDB, 0xFC5F]], [[0xC2F6, 0xE979, 0x3F80, 0x0000, 0x03A9]]]
+    cols = plan.decode_columns(rows)
+    assert [{k: cols[k][i].item() for k in cols} for i in range(len(rows))] == [plan.decode(r) for r in rows]
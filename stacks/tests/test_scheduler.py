@@ -0,0 +1,45 @@
+import random
+import time
+
+from scheduler import STATE_CLOSED, STATE_OPEN, HealthScheduler
+
+def _scheduler(**kw):
+    args = dict(backoff_base=1.0, backoff_max=8.0, fail_threshold=5, probe_interval=10.0, rng=random.Random(1))
+    args.update(kw)
+    return HealthScheduler(**args)
+
+def test_backoff_doubles_with_jitter_up_to_the_cap():
+    s = _scheduler()
+    s.add("dead", 1.0, 0.0)
+    for failures, delay in enumerate([1.0, 2.0, 4.0, 8.0], start=1):
+        s.record_failure("dead", 100.0)
+        assert delay / 2 <= s.health["dead"].next_due - 100.0 <= delay
+    assert s.health["dead"].state == STATE_CLOSED
+
+def test_flapping_target_keeps_healthy_cadence():
+    s = _scheduler()
+    s.add("ok", 1.0, 0.0)
+    s.add("flaky", 1.0, 0.0)
+    for now in (0.0, 1.0, 2.0):
+        assert "ok" in s.due(now)
+        s.record_success("ok", now + 0.3)   # a slow cycle doesn't drift the schedule
+        s.record_failure("flaky", now + 0.3)
+    assert s.health["ok"].next_due == 3.0
+
+def test_circuit_opens_at_threshold_and_probe_closes_it():
+    s = _scheduler(fail_threshold=2, probe_interval=0.0)
+    s.add("t", 1.0, 0.0)
+    assert s.record_failure("t", 0.0) is False
+    assert s.record_failure("t", 0.0) is True
+    assert s.open_circuits() == ["t"] and s.due(100.0) == []
+
+    probes = []
+    s.start_probes(0.0, lambda name, done: probes.append((name, done)))
+    s.start_probes(0.0, lambda name, done: probes.append((name, done)))
+    assert [name for name, _ in probes] == ["t"]   # one probe at a time
+
+    probes[0][1](False)
+    assert s.health["t"].state == STATE_OPEN and not s.health["t"].probing
+    # probe results are stamped with time.monotonic()
+    s.start_probes(time.monotonic(), lambda name, done: done(True))
+    assert s.open_circuits() == [] and s.health["t"].failures == 0
@@ -0,0 +1,135 @@
+import threading
+import time
+
+from store_forward import StoreAndForward
+
+class _Info:
+    def __init__(self, rc, mid):
+        self.rc = rc
+        self.mid = mid
+
+class AckingClient:
+    """Stands in for a connected paho client whose broker acks immediately."""
+
+    def __init__(self):
+        self.sent = []
+        self._mid = 0
+        self._lock = threading.Lock()
+
+    def publish(self, topic, payload, qos=1):
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+        self.sent.append(payload)
+        self.on_publish(self, None, mid)
+        return _Info(0, mid)
+
+def _wait(pred, timeout=3.0):
+    deadline = time.monotonic() + timeout
+    while not pred() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return pred()
+
+def test_live_traffic_is_not_rate_limited(tmp_path):
+    client = AckingClient()
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16, replay_rate=5.0)
+    try:
+        spool._on_connect(client, None, {}, 0)
+        for i in range(200):
+            spool.publish("t", b"%d" % i)
+        assert _wait(lambda: len(client.sent) == 200, timeout=2.0)
+    finally:
+        spool.close()
+
+def test_backlog_is_replayed_at_the_replay_rate(tmp_path):
+    client = AckingClient()
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16, replay_rate=5.0)
+    try:
+        for i in range(50):
+            spool.publish("t", b"%d" % i)
+        spool._on_connect(client, None, {}, 0)
+        time.sleep(1.0)
+        # a full bucket (5) plus about 5/s
+        assert 5 <= len(client.sent) <= 15
+        spool.publish("t", b"live")
+        assert b"live" not in client.sent   # still queued behind the backlog, in order
+    finally:
+        spool.close()
+
+class DroppingClient(AckingClient):
+    """Connection drops under the spool: publish() returns NO_CONN but keeps the
+    QoS 1 message, like paho, and resends it (same mid) on reconnect()."""
+
+    def __init__(self):
+        super().__init__()
+        self.connected = False
+        self.held = []
+
+    def publish(self, topic, payload, qos=1):
+        if not topic:
+            raise ValueError("Invalid topic.")
+        if self.connected:
+            return super().publish(topic, payload, qos)
+        with self._lock:
+            self._mid += 1
+            mid = self._mid
+        self.sent.append(payload)
+        self.held.append(mid)
+        return _Info(4, mid)
+
+    def reconnect(self, spool):
+        self.connected = True
+        for mid in self.held:
+            self.on_publish(self, None, mid)
+        self.held = []
+        spool._on_connect(self, None, {}, 0)
+
+def test_no_conn_publish_is_tracked_not_resent(tmp_path):
+    client = DroppingClient()
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16)
+    try:
+        spool._on_connect(client, None, {}, 0)   # thinks it's online; the socket is gone
+        for i in range(3):
+            spool.publish("t", b"%d" % i)
+        assert _wait(lambda: not spool.online)
+        client.reconnect(spool)
+        assert _wait(lambda: spool.pending == 0)
+        assert client.sent == [b"0", b"1", b"2"]
+        assert not spool.early_acks and not spool.inflight
+    finally:
+        spool.close()
+
+def test_refused_record_is_skipped(tmp_path):
+    client = DroppingClient()
+    client.connected = True
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16)
+    try:
+        spool._on_connect(client, None, {}, 0)
+        spool.publish("", b"bad")
+        spool.publish("t", b"good")
+        assert _wait(lambda: spool.pending == 0)
+        assert client.sent == [b"good"] and spool.failed == 1 and spool.thread.is_alive()
+    finally:
+        spool.close()
+
+def test_restart_resends_only_unacked_records(tmp_path):
+    client = AckingClient()
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16)
+    spool._on_connect(client, None, {}, 0)
+    for i in range(5):
+        spool.publish("t", b"acked-%d" % i)
+    assert _wait(lambda: len(client.sent) == 5)
+    spool._on_disconnect(client, None)
+    for i in range(3):
+        spool.publish("t", b"offline-%d" % i)
+    spool.close()
+
+    client = AckingClient()
+    spool = StoreAndForward(client, str(tmp_path), segment_bytes=1 << 16)
+    try:
+        spool._on_connect(client, None, {}, 0)
+        assert _wait(lambda: len(client.sent) == 3)
+        time.sleep(0.1)
+        assert client.sent == [b"offline-0", b"offline-1", b"offline-2"]
+    finally:
+        spool.close()
@@ -0,0 +1,30 @@
+import pytest
+
+from telemetry_trace import TraceWriter, read_trace
+
+def _trace(path):
+    w = TraceWriter(str(path))
+    w.write("sensors/temp/r1/s1", b"21.5")
+    w.write("sensors/hum/r1/s1", b"40")
+    w.close()
+    return path.read_bytes()
+
+def test_reads_back_what_was_written(tmp_path):
+    _trace(tmp_path / "t")
+    got = [(topic, payload) for _, _, topic, payload in read_trace(str(tmp_path / "t"))]
+    assert got == [("sensors/temp/r1/s1", b"21.5"), ("sensors/hum/r1/s1", b"40")]
+
+def test_truncated_trace_stops_cleanly_at_every_cut(tmp_path):
+    data = _trace(tmp_path / "full")
+    header = 8 + 9
+    cut = tmp_path / "cut"
+    for n in range(header, len(data)):
+        cut.write_bytes(data[:n])
+        got = list(read_trace(str(cut)))
+        assert len(got) <= 2
+
+def test_truncated_header_is_reported(tmp_path):
+    data = _trace(tmp_path / "full")
+    (tmp_path / "cut").write_bytes(data[:12])
+    with pytest.raises(SystemExit):
+        list(read_trace(str(tmp_path / "cut")))